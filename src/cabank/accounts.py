@@ -0,0 +1,88 @@
+from datetime import datetime
+import pandas as pd
+from cabank.storage import (
+    MAIN_ACCOUNT,
+    UserStore,
+    get_account_dataset,
+)
+from cabank.pipeline import compute_user_period_results
+
+CONSOLIDATED_TOTAL = "Total"
+# Datasets of the user that every account depends on
+SHARED_DATASETS = ["transfers.csv", "rates.csv", "holidays.csv"]
+
+
+def _is_account_change(
+        name: str|None,
+        account: str) -> bool :
+
+    if name is None or name in SHARED_DATASETS :
+        return True
+
+    if account == MAIN_ACCOUNT :
+        # Datasets of the main account are directly in the user folder
+        return not "/" in name
+
+    return name.startswith(get_account_dataset(account, ""))
+
+
+def get_account_daily_balance(
+        store: UserStore,
+        account: str,
+        period_start: datetime,
+        period_end: datetime) -> pd.DataFrame :
+    """
+    Daily balance of one account, shared by every caller.
+    Materialized : only recomputed when a dataset of the account (or the transfers) is saved, not on every save.
+    """
+
+    def _compute() -> pd.DataFrame :
+        return compute_user_period_results(
+            store=store,
+            period_start=period_start,
+            period_end=period_end,
+            account=account,
+        ).daily_balance
+
+    return store.get_materialized(
+        ("account_daily_balance", account, period_start, period_end),
+        _compute,
+        lambda value, changes: _compute() if any(_is_account_change(name, account) for name, _ in changes) else value,
+    )
+
+
+def consolidate_daily_balances(balances: dict[str, pd.DataFrame]) -> pd.DataFrame :
+    """
+    One balance column per account and their total, on the union of their dates.
+    Series are aligned on dates in one concat : an account holds its previous balance on a day it doesn't have.
+    Transfers between the accounts cancel out in the total.
+    """
+
+    if not balances :
+        return pd.DataFrame(columns=["date", CONSOLIDATED_TOTAL])
+
+    consolidated = pd.concat(
+        {account: df.set_index("date")["balance"].astype(float) for account, df in balances.items()},
+        axis=1,
+    ).sort_index().ffill().fillna(0.)
+
+    consolidated[CONSOLIDATED_TOTAL] = consolidated.sum(axis=1)
+
+    return consolidated.rename_axis("date").reset_index()
+
+
+def get_consolidated_balance(
+        store: UserStore,
+        period_start: datetime,
+        period_end: datetime,
+        accounts: list[str]|None=None) -> pd.DataFrame :
+    """
+    consolidate_daily_balances of the accounts of the user (all by default).
+    """
+
+    accounts = store.get_account_names() if accounts is None else accounts
+
+    return consolidate_daily_balances({
+        account: get_account_daily_balance(store, account, period_start, period_end)
+        for account in accounts
+    })
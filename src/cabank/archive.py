@@ -0,0 +1,244 @@
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+from typing import Any
+import shutil
+import pandas as pd
+from cabank.utils import safe_concat
+from cabank.storage import (
+    MAIN_ACCOUNT,
+    ARCHIVES_FOLDER,
+    CHECKPOINTS_COLUMNS,
+    UserStore,
+    SaveConflictError,
+    get_account_dataset,
+    get_archive_dataset,
+    get_empty_frame,
+)
+from cabank.balance import get_real_period
+from cabank.pipeline import (
+    ADJUSTMENTS_COLUMNS,
+    compute_user_period_results,
+    get_account_ponctuals,
+    get_user_adjustments,
+)
+
+
+# region COMPACTION
+
+def get_live_years(
+        store: UserStore,
+        account: str=MAIN_ACCOUNT) -> list[int] :
+    """
+    Years of the ponctuals and checkpoints still in the live files of the account.
+    The anchor checkpoint of the last archived year doesn't make it live.
+    """
+
+    archived = set(store.get_archive_years(account))
+
+    dates = pd.concat([
+        store.get(get_account_dataset(account, "ponctuals.csv"))["date"],
+        store.get(get_account_dataset(account, "checkpoints.csv"))["date"],
+    ])
+
+    return sorted(int(y) for y in dates.dt.year.dropna().unique() if not int(y) in archived)
+
+
+def get_compactable_years(
+        store: UserStore,
+        before: int,
+        account: str=MAIN_ACCOUNT) -> list[int] :
+    """
+    Live years before the given one, oldest first : years are archived in order,
+    so that the anchor of the last archived year is the start of everything that is live.
+    """
+
+    return [year for year in get_live_years(store, account) if year < before]
+
+
+def compact_year(
+        store: UserStore,
+        year: int,
+        account: str=MAIN_ACCOUNT) -> dict[str, Any] :
+    """
+    Moves the ponctuals, checkpoints and checkpoint adjustments of a closed year to a compressed archive,
+    with a summary : the closing balance and the net amount of every category over the year.
+
+    The closing balance is written to the live checkpoints on the last day of the year : it is the anchor
+    from which the engine computes every later balance, without replaying the archived rows.
+    The adjustments of the following days up to the next checkpoint become live ponctuals, so that every live balance is kept.
+    Must be called on the oldest live year. Returns the summary.
+
+    The summary is computed from the datasets as read : if another session or process saves them meanwhile,
+    SaveConflictError is raised and the live files and archives are left as they were.
+    """
+
+    year_start, year_end = datetime(year, 1, 1), datetime(year + 1, 1, 1)
+    closing_day = year_end - relativedelta(days=1)
+
+    live_years = get_live_years(store, account)
+    if live_years and year != live_years[0] :
+        raise ValueError(f"Les années s'archivent dans l'ordre, la plus ancienne d'abord : {live_years[0]}")
+    if year_end > datetime.now() :
+        raise ValueError(f"L'année {year} n'est pas terminée")
+
+    checkpoints_name, ponctuals_name = get_account_dataset(account, "checkpoints.csv"), get_account_dataset(account, "ponctuals.csv")
+
+    checkpoints = store.get(checkpoints_name)
+    checkpoints_version = store.get_version(checkpoints_name)
+    if len(checkpoints) == 0 :
+        raise ValueError("Impossible d'archiver sans checkpoint : le solde de clôture serait inconnu")
+
+    ponctuals = store.get(ponctuals_name)
+    ponctuals_version = store.get_version(ponctuals_name)
+    adjustments = get_user_adjustments(store, account)
+
+    # The balance at the start of the next year, as computed for any later period (cabank balance --date).
+    # The daily balance of a period view would drift from it : it leaves out the periodics without a last date
+    closing_balance = compute_user_period_results(store, year_end, year_end + relativedelta(days=1), account=account).offset
+
+    # Totals from every saved periodic too, so that they add up to the change of balance over the year
+    period = get_real_period(
+        period_start=year_start,
+        period_end=year_end,
+        periodics=store.get(get_account_dataset(account, "periodics.csv")),
+        ponctuals=safe_concat(get_account_ponctuals(store, account), adjustments),
+        modify_periodic_occurences=store.get(get_account_dataset(account, "periodic_occurences_modifications.json")),
+        rates=store.get("rates.csv"),
+        holidays=store.get("holidays.csv"),
+    )
+    period = period[period["is_ignored"] != True]
+
+    summary = {
+        "year": year,
+        "closing_date": f"{closing_day:%Y-%m-%d}",
+        "closing_balance": round(float(closing_balance), 2),
+        "categories": {
+            str(category): round(float(total), 2)
+            for category, total in period["amount"].astype(float).groupby(period["category"].astype(str)).sum().items()
+        },
+    }
+
+    in_year = lambda df: ( df["date"] >= year_start ) & ( df["date"] < year_end )
+
+    # The adjustments of the checkpoint interval across the end of the year are spread from its first checkpoint :
+    # the anchor would spread them differently, so the ones after the anchor are kept in the live ponctuals as they are
+    kept = pd.Series(False, index=adjustments.index)
+    next_checkpoints = checkpoints["date"][checkpoints["date"] > closing_day]
+    if len(next_checkpoints) > 0 and ( checkpoints["date"] < closing_day ).any() :
+        kept = ( adjustments["date"] > closing_day ) & ( adjustments["date"] <= next_checkpoints.min() )
+    kept_adjustments = adjustments[kept][ADJUSTMENTS_COLUMNS].assign(currency="")
+    archived = {
+        "ponctuals.csv.gz": ponctuals[in_year(ponctuals)],
+        "checkpoints.csv.gz": checkpoints[in_year(checkpoints)],
+        "adjustments.csv.gz": adjustments[in_year(adjustments)][ADJUSTMENTS_COLUMNS],
+    }
+    summary["rows"] = {name.split(".")[0]: len(df) for name, df in archived.items()}
+
+    # The archive is written aside and renamed once complete, before anything leaves the live files :
+    # an interrupted compaction leaves no partial archive to read next to the live rows
+    archive_path = store.get_path(get_archive_dataset(year, "", account))
+    if archive_path.exists() :
+        raise ValueError(f"L'archive de {year} existe déjà : {archive_path}")
+
+    staging = lambda name: get_account_dataset(account, f"{ARCHIVES_FOLDER}/.{year}/{name}")
+    staging_path = store.get_path(staging(""))
+    shutil.rmtree(staging_path, ignore_errors=True)
+    staging_path.mkdir(parents=True)
+
+    for name, df in archived.items() :
+        store.save_csv(staging(name), df.reset_index(drop=True))
+    store.save_json(staging("summary.json"), summary)
+
+    def remove_archive() :
+        shutil.rmtree(archive_path)
+        for name in [*archived, "summary.json"] :
+            store.invalidate(get_archive_dataset(year, name, account))
+
+    staging_path.rename(archive_path)
+    for name in [*archived, "summary.json"] :
+        store.invalidate(get_archive_dataset(year, name, account))
+
+    # No base rows to merge with : a row saved meanwhile in the archived year would be left out of the summary
+    anchor = pd.DataFrame({"date": [closing_day], "net_position": [summary["closing_balance"]]}).astype(CHECKPOINTS_COLUMNS)
+    anchored = safe_concat(anchor, checkpoints[checkpoints["date"] >= year_end]).reset_index(drop=True)
+    try :
+        anchored_version = store.save_csv(checkpoints_name, anchored, base_version=checkpoints_version)
+    except SaveConflictError :
+        remove_archive()
+        raise
+
+    try :
+        store.save_csv(
+            ponctuals_name,
+            safe_concat(ponctuals[~in_year(ponctuals)], kept_adjustments).reset_index(drop=True),
+            changed_range=(year_start, year_end),
+            base_version=ponctuals_version,
+        )
+    except SaveConflictError :
+        # The checkpoints saved since the anchor are kept
+        store.save_csv(checkpoints_name, checkpoints, base_version=anchored_version, base_df=anchored, key="date")
+        remove_archive()
+        raise
+
+    return summary
+
+
+def compact_years(
+        store: UserStore,
+        before: int,
+        account: str=MAIN_ACCOUNT) -> list[dict[str, Any]] :
+
+    return [compact_year(store, year, account) for year in get_compactable_years(store, before, account)]
+
+# endregion
+
+
+# region READING
+
+def get_archive_summaries(
+        store: UserStore,
+        account: str=MAIN_ACCOUNT) -> list[dict[str, Any]] :
+
+    return [store.get(get_archive_dataset(year, "summary.json", account)) for year in store.get_archive_years(account)]
+
+
+def get_archived_ponctuals(
+        store: UserStore,
+        start: datetime,
+        end: datetime,
+        account: str=MAIN_ACCOUNT,
+        with_adjustments: bool=True) -> pd.DataFrame :
+    """
+    Archived ponctuals over [start, end), and the checkpoint adjustments of these days. Only the archives of
+    the years in the range are read, once : they are cached by the store like the live datasets.
+    """
+
+    frames = []
+    for year in store.get_archive_years(account) :
+
+        if not ( datetime(year, 1, 1) < end and datetime(year + 1, 1, 1) > start ) :
+            continue
+
+        frames.append(store.get(get_archive_dataset(year, "ponctuals.csv.gz", account)))
+        if with_adjustments :
+            frames.append(store.get(get_archive_dataset(year, "adjustments.csv.gz", account)))
+
+    archived = get_empty_frame({})
+    for df in frames :
+        archived = safe_concat(archived, df)
+
+    if len(archived) == 0 :
+        return archived
+
+    return archived[( archived["date"] >= start ) & ( archived["date"] < end )].reset_index(drop=True)
+
+
+def get_first_archived_day(
+        store: UserStore,
+        account: str=MAIN_ACCOUNT) -> datetime|None :
+
+    years = store.get_archive_years(account)
+
+    return datetime(years[0], 1, 1) if years else None
+
+# endregion
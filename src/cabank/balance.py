@@ -1,14 +1,27 @@
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
+import numpy as np
 import pandas as pd
 from cabank.utils import (
     safe_get,
     safe_concat,
     apply_modifs_to_period,
     split_amount,
+    compact_frame,
+    has_rates,
+    add_occurences_currency,
+    convert_amounts,
 )
 import uuid
 from decimal import Decimal, ROUND_HALF_UP
+from cabank.timing import timed
+from cabank.recurrence import (
+    get_rules,
+    expand_recurrence_rules,
+)
+
+# Ids of the adjustments only depend on their checkpoint interval and rank, so they are stable between rebuilds
+ADJUSTMENTS_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_DNS, "adjustments.cabank")
 
 
 # region PERIODICS
@@ -17,6 +30,9 @@ def get_all_occurences_in_period(
         periodic: pd.Series,
         period_start: datetime,
         period_end: datetime) -> list[datetime] :
+    """
+    Occurences of the days and months intervals, periodics with a rule are expanded by expand_recurrence_rules.
+    """
     
     days_interval = safe_get(periodic, "days", 0)
     months_interval = safe_get(periodic, "months", 0)
@@ -47,10 +63,18 @@ def get_all_occurences_in_period(
     return all_occurences        
 
 
+@timed
 def get_all_periodics_in_period(
         period_start: datetime,
         period_end: datetime,
-        data: pd.DataFrame) -> pd.DataFrame :
+        data: pd.DataFrame,
+        holidays: pd.DataFrame|None=None) -> pd.DataFrame :
+    """
+    Periodics with a rule are expanded all at once, after the others.
+    """
+
+    has_rule = get_rules(data) != ""
+    ruled, data = data[has_rule], data[~has_rule]
     
     all_periodics = pd.DataFrame(columns=["category", "tags", "description", "amount", "date", "periodic_id"])
     for i, periodic in data.iterrows() :
@@ -65,20 +89,32 @@ def get_all_periodics_in_period(
                 occurence,
                 safe_get(periodic, "id", None)
             ]
+
+    if len(ruled) > 0 :
+        return safe_concat(compact_frame(all_periodics), expand_recurrence_rules(ruled, period_start, period_end, holidays))
     
-    return all_periodics
+    return compact_frame(all_periodics)
 
 # endregion
 
 
 # region AGGREGATION
 
+@timed
 def get_aggregated_period(
         period_start: datetime,
         period_end: datetime,
         periodics: pd.DataFrame,
         ponctuals: pd.DataFrame,
-        modify_periodic_occurences: dict[str, dict[str, float|None]]) -> pd.DataFrame :
+        modify_periodic_occurences: dict[str, dict[str, float|None]],
+        expanded_periodics: pd.DataFrame|None=None,
+        rates: pd.DataFrame|None=None,
+        holidays: pd.DataFrame|None=None) -> pd.DataFrame :
+    """
+    expanded_periodics are occurences already expanded over the period, placed before those of periodics.
+    With rates (see convert_amounts), amounts in other currencies are converted to the display currency.
+    holidays are the days off of the periodics with an on_holiday option (see expand_recurrence_rules).
+    """
 
     period_items = ponctuals[ponctuals.apply(lambda row: period_start <= row["date"] < period_end, axis=1)].copy()
     
@@ -86,7 +122,11 @@ def get_aggregated_period(
         period_items.loc[:, "amount"] *= -1
         period_items.loc[:, "periodic_id"] = None
 
-    period_periodics = get_all_periodics_in_period(period_start, period_end, periodics)
+    period_periodics = get_all_periodics_in_period(period_start, period_end, periodics, holidays)
+    if has_rates(rates) :
+        period_periodics = add_occurences_currency(period_periodics, periodics)
+    if not expanded_periodics is None :
+        period_periodics = safe_concat(expanded_periodics, period_periodics)
 
     period = safe_concat(period_items, period_periodics).reset_index(drop=True)
     
@@ -101,84 +141,136 @@ def get_aggregated_period(
         modify_periodic_occurences=modify_periodic_occurences,
     )
 
+    # After the modifications, which are in the currency of the periodic
+    if has_rates(rates) :
+        adjusted_period = convert_amounts(adjusted_period, rates)
+
     return adjusted_period 
 
 
+@timed
 def get_real_period(
         period_start: datetime,
         period_end: datetime,
         periodics: pd.DataFrame,
         ponctuals: pd.DataFrame,
-        modify_periodic_occurences: dict[str, dict[str, float|None]]) -> pd.DataFrame :
+        modify_periodic_occurences: dict[str, dict[str, float|None]],
+        rates: pd.DataFrame|None=None,
+        holidays: pd.DataFrame|None=None) -> pd.DataFrame :
 
     return get_aggregated_period(
         period_start=period_start, 
         period_end=period_end, 
         periodics=periodics, 
         ponctuals=ponctuals, 
-        modify_periodic_occurences=modify_periodic_occurences
+        modify_periodic_occurences=modify_periodic_occurences,
+        rates=rates,
+        holidays=holidays,
     )
 
 
+@timed
 def get_budget_period(
         period_start: datetime,
         period_end: datetime,
         periodics: pd.DataFrame,
         budget_periodics: pd.DataFrame,
-        budget_ponctuals: pd.DataFrame) -> pd.DataFrame :
-    
-    corrected_budget_periodics = budget_periodics.copy()
-    corrected_budget_periodics.loc[:, "amount"] *= -1
+        budget_ponctuals: pd.DataFrame,
+        rates: pd.DataFrame|None=None,
+        holidays: pd.DataFrame|None=None) -> pd.DataFrame :
 
-    return get_aggregated_period(
-        period_start=period_start, 
-        period_end=period_end, 
-        periodics=safe_concat(periodics, corrected_budget_periodics), 
-        ponctuals=budget_ponctuals,
-        modify_periodic_occurences={}
-    )
+    return get_budget_periods(
+        period_start=period_start,
+        period_end=period_end,
+        periodics=periodics,
+        budgets={None: (budget_periodics, budget_ponctuals)},
+        rates=rates,
+        holidays=holidays,
+    )[None]
+
+
+@timed
+def get_budget_periods(
+        period_start: datetime,
+        period_end: datetime,
+        periodics: pd.DataFrame,
+        budgets: dict[str|None, tuple[pd.DataFrame, pd.DataFrame]],
+        rates: pd.DataFrame|None=None,
+        holidays: pd.DataFrame|None=None) -> dict[str|None, pd.DataFrame] :
+    """
+    get_budget_period of several budgets, given as {name: (budget_periodics, budget_ponctuals)}.
+    The real periodics are expanded once for all of them, then only the rows of each budget.
+    """
+
+    real_occurences = get_all_periodics_in_period(period_start, period_end, periodics, holidays)
+    if has_rates(rates) :
+        real_occurences = add_occurences_currency(real_occurences, periodics)
+
+    budget_periods = {}
+    for name, (budget_periodics, budget_ponctuals) in budgets.items() :
+
+        corrected_budget_periodics = budget_periodics.copy()
+        corrected_budget_periodics.loc[:, "amount"] *= -1
+
+        budget_periods[name] = get_aggregated_period(
+            period_start=period_start, 
+            period_end=period_end, 
+            periodics=corrected_budget_periodics, 
+            ponctuals=budget_ponctuals,
+            modify_periodic_occurences={},
+            expanded_periodics=real_occurences,
+            rates=rates,
+            holidays=holidays,
+        )
+
+    return budget_periods
 
 # endregion
 
 
 # region BALANCE
 
+@timed
 def get_daily_balance(
         period_start: datetime,
         period_end: datetime,
         aggregated_period: pd.DataFrame,
         start_offset: float=0.) -> pd.DataFrame :
+    """
+    Balance of every day, from the day before period_start (to show the first bump) to period_end excluded.
+    Each day sums the amounts up to that day included : a cumulative sum read with a binary search, in linear time.
+    """
 
-    one_day = relativedelta(days=1)
-    daily_balance = pd.DataFrame(columns=["date", "balance"])
+    days = pd.date_range(period_start - relativedelta(days=1), period_end, freq="D", inclusive="left")
 
-    day = period_start - one_day # TO SHOW THE FIRST BUMP
-    while day < period_end :
+    spent = aggregated_period[aggregated_period["is_ignored"] == False] if len(aggregated_period) > 0 else aggregated_period
+    spent_dates = pd.to_datetime(spent["date"]).to_numpy(dtype="datetime64[ns]") if len(spent) > 0 else np.zeros(0, dtype="datetime64[ns]")
+    spent_amounts = spent["amount"].to_numpy(dtype=float) if len(spent) > 0 else np.zeros(0)
 
-        expenses_before_day = (
-            ( aggregated_period["date"] <= day ) & 
-            ( aggregated_period["is_ignored"] == False )
-        )
+    order = np.argsort(spent_dates, kind="stable")
+    cumulated = np.concatenate([[0.], np.cumsum(spent_amounts[order])])
+    expenses_before_day = np.searchsorted(spent_dates[order], days.to_numpy(dtype="datetime64[ns]"), side="right")
 
-        balance = aggregated_period[expenses_before_day]["amount"].sum() + start_offset
-        daily_balance.loc[len(daily_balance)] = [day, balance]
-        
-        day+=one_day
-    
-    return daily_balance
+    return pd.DataFrame({
+        "date": days,
+        "balance": cumulated[expenses_before_day] + start_offset,
+    })
 
 # endregion
 
 
 # region OFFSET
 
+@timed
 def get_offset(
         ref_day: datetime,
         ref_balance: float,
         target_day: datetime,
         periodics: pd.DataFrame,
         ponctuals: pd.DataFrame,
-        modify_periodic_occurences: dict[str, dict[str, float|None]]) -> float :
+        modify_periodic_occurences: dict[str, dict[str, float|None]],
+        rates: pd.DataFrame|None=None,
+        holidays: pd.DataFrame|None=None) -> float :
     """
     Keep in mind that balance on day D is at the end of day D.
     Here we want the offset at the START of day target_day. 2 situations :
@@ -223,6 +315,8 @@ def get_offset(
         periodics=periodics,
         ponctuals=ponctuals,
         modify_periodic_occurences=modify_periodic_occurences,
+        rates=rates,
+        holidays=holidays,
     )
 
     past_balance = get_daily_balance(
@@ -246,6 +340,7 @@ def get_offset(
 
 # region CHECKPOINT
 
+@timed
 def build_checkpoint_adjustments(
     checkpoints: pd.DataFrame,
     periodics: pd.DataFrame,
@@ -254,10 +349,13 @@ def build_checkpoint_adjustments(
     category: str="Quotidien",
     tags: list[str]=[],
     adjustments_step_days: int|None=7,
+    rates: pd.DataFrame|None=None,
+    holidays: pd.DataFrame|None=None,
 ) -> pd.DataFrame:
     """
     Build synthetic ponctual expenses that reconcile real balances
     between successive checkpoints.
+    Ids are uuid5 of the interval and rank of the adjustment.
     """
 
     if len(checkpoints) < 2:
@@ -285,6 +383,8 @@ def build_checkpoint_adjustments(
             periodics=periodics,
             ponctuals=ponctuals,
             modify_periodic_occurences=modify_periodic_occurences,
+            rates=rates,
+            holidays=holidays,
         )
 
         theoretical_delta = aggregated_period["amount"].sum()
@@ -307,7 +407,7 @@ def build_checkpoint_adjustments(
                     f"{period_start.date()} → {period_end.date()}"
                 ),
                 "amount": adjustment,
-                "id": str(uuid.uuid4())
+                "id": str(uuid.uuid5(ADJUSTMENTS_NAMESPACE, f"{period_start.date()}|{period_end.date()}|0"))
             })
             continue
         
@@ -326,19 +426,25 @@ def build_checkpoint_adjustments(
                     f"{period_start.date()} → {period_end.date()}"
                 ),
                 "amount": splitted_adjustment[i],
-                "id": str(uuid.uuid4())
+                "id": str(uuid.uuid5(ADJUSTMENTS_NAMESPACE, f"{period_start.date()}|{period_end.date()}|{i}"))
             })
 
-    return pd.DataFrame(synthetic_rows)
+    return compact_frame(pd.DataFrame(synthetic_rows))
 
 # endregion
 
+@timed
 def get_provisions(
         period_start: datetime,
         period_end: datetime,
         periodics: pd.DataFrame,
-        modify_periodic_occurences: dict[str, dict[str, float|None]]
+        modify_periodic_occurences: dict[str, dict[str, float|None]],
+        rates: pd.DataFrame|None=None,
+        holidays: pd.DataFrame|None=None
 ) -> pd.DataFrame :
+    """
+    With rates (see convert_amounts), the occurences in other currencies are converted before being summed.
+    """
     
     period_duration_days = (period_end - period_start).days
     period_duration_months = round(period_duration_days/30)
@@ -347,21 +453,33 @@ def get_provisions(
         period_start=period_start,
         period_end=period_end,
         data=periodics,
+        holidays=holidays,
     )
+    if has_rates(rates) :
+        periodics_this_period = add_occurences_currency(periodics_this_period, periodics)
     periodics_this_period = apply_modifs_to_period(
         period=periodics_this_period,
         modify_periodic_occurences=modify_periodic_occurences,
     )
+    # After the modifications, which are in the currency of the periodic
+    if has_rates(rates) :
+        periodics_this_period = convert_amounts(periodics_this_period, rates)
 
     periodics_this_year = get_all_periodics_in_period(
         period_start=period_start,
         period_end=period_start + relativedelta(years=1),
         data=periodics,
+        holidays=holidays,
     )
+    if has_rates(rates) :
+        periodics_this_year = add_occurences_currency(periodics_this_year, periodics)
     periodics_this_year = apply_modifs_to_period(
         period=periodics_this_year,
         modify_periodic_occurences=modify_periodic_occurences,
     )
+    # After the modifications, which are in the currency of the periodic
+    if has_rates(rates) :
+        periodics_this_year = convert_amounts(periodics_this_year, rates)
 
     periodics_this_period_grouped = periodics_this_period[["amount", "periodic_id", "description"]].groupby(["periodic_id", "description"]).sum()
     periodics_this_year_grouped = periodics_this_year[["amount", "periodic_id", "description"]].groupby(["periodic_id", "description"]).sum()
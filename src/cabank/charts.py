@@ -0,0 +1,738 @@
+from __future__ import annotations
+from collections import OrderedDict
+from datetime import datetime
+from typing import (
+    Callable,
+    TYPE_CHECKING,
+)
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+from cabank.utils import hex_to_rgba
+
+# Plotly takes a large share of the startup time, it is only imported once a figure is built
+if TYPE_CHECKING :
+    import plotly.graph_objects as go
+
+
+# region CACHE
+
+class FigureCache :
+    """
+    Bounded LRU cache of plotly figures, keyed on a fingerprint of the chart inputs.
+    """
+
+    def __init__(self, max_size: int=32) :
+        self.max_size = max_size
+        self._figures: OrderedDict[str, go.Figure] = OrderedDict()
+
+    def __len__(self) -> int :
+        return len(self._figures)
+
+    def get_or_build(
+            self,
+            key: str,
+            build: Callable[[], go.Figure]) -> go.Figure :
+
+        if key in self._figures :
+            self._figures.move_to_end(key)
+            return self._figures[key]
+
+        fig = build()
+        self._figures[key] = fig
+
+        while len(self._figures) > self.max_size :
+            self._figures.popitem(last=False)
+
+        return fig
+
+    def clear(self) :
+        self._figures.clear()
+
+# endregion
+
+
+# region WATERFALL
+
+def plot_custom_waterfall(
+        fig: go.Figure,
+        categories: list[str],
+        amounts: list[float],
+        colors: list[str],
+        amounts_budget: list[float]|None=None) :
+    import plotly.graph_objects as go
+
+    # Style parameters
+    if amounts_budget is None :
+        bar_width = 0.8
+        offset = 0
+    else :
+        bar_width = 0.35
+        offset = bar_width/2 +0.05
+
+    # Cumulative heights
+    y_base = []
+    current = 0
+    for amt in amounts[:-1]:
+        y_base.append(current)
+        current += amt
+    
+    # Last bar is a total => base at 0
+    y_base.append(0)
+
+    # First bar is shared
+    fig.add_trace(go.Bar(
+        x=[0],
+        y=[amounts[0]],
+        base=[0],
+        width=0.8,
+        marker=dict(color=colors[0]),
+        name=categories[0],
+        hovertemplate=f"{categories[0]}: {amounts[0]:,.0f}<extra></extra>"
+    ))
+    fig.add_shape(
+        type="line",
+        x0= 0.4,
+        x1= offset + bar_width/2 + (1-bar_width),
+        y0=y_base[0] + amounts[0],
+        y1=y_base[1],
+        line=dict(color="black", width=1)
+    )
+
+    # Draw the rest of the bars
+    for i in range(1, len(categories)):
+        fig.add_trace(go.Bar(
+            x=[i - offset],
+            y=[amounts[i]],
+            base=[y_base[i]],
+            width=bar_width,
+            marker=dict(color=colors[i]),
+            name=categories[i],
+            hovertemplate=f"{categories[i]}: {amounts[i]:,.0f}<extra></extra>"
+        ))
+
+    # Draw connectors
+    for i in range(1, len(categories) - 2):
+        fig.add_shape(
+            type="line",
+            x0=i - offset + bar_width/2,
+            x1=i - offset + bar_width/2 + (1-bar_width),
+            y0=y_base[i] + amounts[i],
+            y1=y_base[i + 1],
+            line=dict(color="black", width=1)
+        )
+
+    # Draw last connector
+    fig.add_shape(
+        type="line",
+        x0=len(categories)-2 - offset + bar_width/2,
+        x1=len(categories)-2 - offset + bar_width/2 + (1-bar_width),
+        y0=y_base[-2] + amounts[-2],
+        y1=amounts[-1],
+        line=dict(color="black", width=1)
+    )
+
+    if amounts_budget is None :
+        return
+    
+    # Cumulative heights
+    y_base_budget = []
+    current_budget = 0
+    for amt_b in amounts_budget[:-1]:
+        y_base_budget.append(current_budget)
+        current_budget += amt_b
+    
+    # Last bar is a total => base at 0
+    y_base_budget.append(0)
+
+    # Draw every bar (except the first one which is shared)
+    for i in range(1, len(categories)):
+        fig.add_trace(go.Bar(
+            x=[i + offset],
+            y=[amounts_budget[i]],
+            width=bar_width,
+            base=[y_base_budget[i]],
+            marker=dict(color=colors[i]),
+            name=categories[i],
+            hovertemplate=f"{categories[i]}: {amounts_budget[i]:,.0f}<extra></extra>",
+            opacity=0.3
+        ))
+
+    # Draw first connector
+    fig.add_shape(
+        type="line",
+        x0= 0.4,
+        x1= offset + bar_width/2 + (1-bar_width),
+        y0=y_base_budget[0] + amounts_budget[0],
+        y1=y_base_budget[1],
+        line=dict(color="gray", width=1, dash="dot")
+    )
+
+    # Draw other connectors
+    for i in range(1, len(categories) - 2):
+        fig.add_shape(
+            type="line",
+            x0= i + offset + bar_width/2,
+            x1= i + offset + bar_width/2 + (1-bar_width),
+            y0=y_base_budget[i] + amounts_budget[i],
+            y1=y_base_budget[i + 1],
+            line=dict(color="gray", width=1, dash="dot")
+        )
+
+    # Draw last connector
+    fig.add_shape(
+        type="line",
+        x0=len(categories)-2 + offset + bar_width/2,
+        x1=len(categories)-2 + offset + bar_width/2 + (1-bar_width),
+        y0=y_base_budget[-2] + amounts_budget[-2],
+        y1=amounts_budget[-1],
+        line=dict(color="gray", width=1, dash="dot")
+    )
+
+# endregion
+
+
+# region DAILY BALANCE
+
+def build_daily_balance_figure(
+        daily_balance: pd.DataFrame,
+        period: pd.DataFrame,
+        today: datetime,
+        offset: float,
+        categories_colors: dict[str, str],
+        money_symbol: str,
+        budget_name: str|None=None,
+        budget_balance: pd.DataFrame|None=None,
+        budget_period: pd.DataFrame|None=None,
+        forecast_bands: pd.DataFrame|None=None) -> go.Figure :
+    """
+    today is expected at midnight, so that the figure only changes once a day.
+    forecast_bands are the percentiles of the stochastic forecast (see cabank.forecast), drawn as 5-95 and 25-75 bands.
+    """
+    import plotly.graph_objects as go
+
+    past_balance = daily_balance[daily_balance["date"] <= today]
+    future_balance = daily_balance[daily_balance["date"] > (today - relativedelta(days=1))]
+
+    fig = go.Figure()
+
+    if not forecast_bands is None :
+        for low, high, opacity in [("p5", "p95", 0.15), ("p25", "p75", 0.3)] :
+            fig.add_trace(go.Scatter(
+                x=forecast_bands["date"],
+                y=forecast_bands[low],
+                mode='lines',
+                line=dict(width=0),
+                showlegend=False,
+                hoverinfo='skip',
+            ))
+            fig.add_trace(go.Scatter(
+                x=forecast_bands["date"],
+                y=forecast_bands[high],
+                mode='lines',
+                line=dict(width=0),
+                fill='tonexty',
+                fillcolor=f'rgba(0, 0, 0, {opacity})',
+                name=f'Prévision {low[1:]}-{high[1:]} %',
+                hoverinfo='skip',
+            ))
+
+        fig.add_trace(go.Scatter(
+            x=forecast_bands["date"],
+            y=forecast_bands["p50"],
+            mode='lines',
+            name='Prévision médiane',
+            line=dict(color='gray', width=1),
+            hovertemplate=(
+                "Date : %{x}<br>"
+                "Médiane : %{y:.2f} " + money_symbol + "<extra></extra>"
+            )
+        ))
+
+    fig.add_trace(go.Scatter(
+        x=past_balance["date"],
+        y=past_balance["balance"],
+        mode='lines',
+        name='Réel',
+        line=dict(color='black'),
+        hovertemplate=(
+            "Date : %{x}<br>"
+            "Balance : %{y} " + money_symbol + "<extra></extra>"
+        )
+    ))
+
+    fig.add_trace(go.Scatter(
+        x=future_balance["date"],
+        y=future_balance["balance"],
+        mode='lines',
+        name='Prévisionnel',
+        line=dict(color='black', dash='dot'),
+        hovertemplate=(
+            "Date : %{x}<br>"
+            "Prévision : %{y} " + money_symbol + "<extra></extra>"
+        )
+    ))
+
+    if not budget_balance is None :
+        fig.add_trace(go.Scatter(
+            x=budget_balance["date"],
+            y=budget_balance["balance"],
+            mode='lines',
+            name=f'Budget {budget_name}',
+            line=dict(color='gray', dash='dash'),
+            hovertemplate=(
+                "Date : %{x}<br>"
+                "Budget : %{y} " + money_symbol + "<extra></extra>"
+            )
+        ))
+
+        fig.add_trace(go.Bar(
+            x=budget_period["date"],
+            y=budget_period["amount"],
+            name=f'Budget {budget_name}',
+            marker=dict(color=budget_period["category"].map(categories_colors), pattern=dict(shape="/")),
+            opacity=0.4,
+            yaxis='y2',
+            showlegend=False,
+            customdata=budget_period["description"],
+            hovertemplate=(
+                "<b>%{customdata}</b><br>"
+                "Date : %{x}<br>"
+                "Montant : %{y} " + money_symbol + "<br>"
+            )
+        ))
+
+    fig.add_trace(go.Bar(
+        x=period["date"],
+        y=period["amount"],
+        name='Dépenses',
+        marker=dict(color=period["category"].map(categories_colors)),
+        opacity=0.8,
+        yaxis='y2',
+        showlegend=False,
+        customdata=period["description"],
+        hovertemplate=(
+            "<b>%{customdata}</b><br>"
+            "Date : %{x}<br>"
+            "Montant : %{y} " + money_symbol + "<br>"
+        )
+    ))
+
+    fig.update_xaxes(showgrid=True)
+    fig.update_layout(
+        xaxis=dict(title="Date"),
+        yaxis=dict(title="Balance", showgrid=True, side='right'), # Axe principal
+        yaxis2=dict(title="Dépenses", overlaying='y', side='left', showgrid=False), # Axe secondaire
+        title=f"Balance de la période : {daily_balance.iloc[-1]['balance'] - offset:+.2f} {money_symbol}",
+        legend=dict(
+            orientation="h",
+            yanchor="top",
+            y=-0.25,
+            xanchor="center",
+            x=0.5
+        ),
+        margin=dict(b=100),
+        barmode='group'
+    )
+
+    return fig
+
+# endregion
+
+
+# region SANKEY
+
+def build_sankey_figure(
+        period: pd.DataFrame,
+        categories_colors: dict[str, str],
+        money_symbol: str) -> go.Figure :
+    import plotly.graph_objects as go
+
+    node_opacity = 0.6
+    link_opacity = 0.3
+    tag_color = "gray"
+    total_node = ""
+    total_node_color = "white"
+
+# region |---| Build Sankey
+    def _build_sankey_diagram(
+            period: pd.DataFrame
+    ) -> tuple[list[str], list[int], list[int], list[int], list[str], list[str]] :
+
+        # Init nodes
+        nodes_idx = {total_node: 0}
+        node_colors = [total_node_color]
+        labels = [total_node]
+
+        for _, row in period.iterrows() :
+            cat = row["category"]
+            tags = row["tags"]
+
+            amount = row["amount"]
+            suffix = "in" if amount > 0 else "out"
+
+            if not f"{cat}_{suffix}" in nodes_idx :
+                nodes_idx[f"{cat}_{suffix}"] = len(nodes_idx)
+                labels.append(cat)
+                node_colors.append(hex_to_rgba(categories_colors[cat], alpha=node_opacity))
+
+            for tag in tags :
+                if not f"{tag}_{suffix}" in nodes_idx :
+                    nodes_idx[f"{tag}_{suffix}"] = len(nodes_idx)
+                    labels.append(tag)
+                    node_colors.append(tag_color)
+
+        # Build links
+        sources = []
+        targets = []
+        values = []
+        link_colors = []
+        links_idx = {}
+
+        def __add_link(
+                node1: int,
+                node2: int,
+                amount: float,
+                cat: str|None=None,
+                color: str|None=None) -> None :
+
+            link = (node1, node2, cat)
+
+            if not link in links_idx :
+                links_idx[link] = len(links_idx)
+                sources.append(node1)
+                targets.append(node2)
+                values.append(0)
+
+                if color is None :
+                    assert not cat is None
+                    link_colors.append(hex_to_rgba(categories_colors[cat], alpha=link_opacity))
+                else :
+                    link_colors.append(color)
+
+            link_idx = links_idx[link]
+            values[link_idx] += abs(amount)
+
+            return
+
+
+        for _, row in period.iterrows() :
+
+            cat = row["category"]
+            tags = row["tags"]
+            amount = row["amount"]
+
+            if amount >= 0 :
+
+                current_node = nodes_idx[f"{cat}_in"]
+                for t in tags :
+                    next_node = nodes_idx[f"{t}_in"]
+                    __add_link(current_node, next_node, amount, cat=cat)
+                    current_node = next_node
+                __add_link(current_node, nodes_idx[total_node], amount, cat=cat)
+
+            else :
+                current_node = nodes_idx[total_node]
+                for t in tags :
+                    next_node = nodes_idx[f"{t}_out"]
+                    __add_link(current_node, next_node, amount, cat=cat)
+                    current_node = next_node
+                __add_link(current_node, nodes_idx[f"{cat}_out"], amount, cat=cat)
+
+        # Excedent/Deficit
+        balance = period["amount"].sum()
+
+        if balance < 0 :
+            nodes_idx["Déficit"] = len(nodes_idx)
+            node_colors.append(f"rgba(200,0,0,{node_opacity})")
+            labels.append("Déficit")
+            __add_link(nodes_idx["Déficit"], nodes_idx[total_node], abs(balance), color=f"rgba(200,0,0,{link_opacity})")
+
+        elif balance > 0 :
+            nodes_idx["Excédent"] = len(nodes_idx)
+            node_colors.append(f"rgba(0,160,0,{node_opacity})")
+            labels.append("Excédent")
+            __add_link(nodes_idx[total_node], nodes_idx["Excédent"], abs(balance), color=f"rgba(0,160,0,{link_opacity})")
+
+        return labels, sources, targets, values, node_colors, link_colors
+# endregion
+
+    # Mise en forme
+    period_real = period[( period["is_ignored"] == False ) & ( period["category"].isin(categories_colors) )]
+    period_real = period_real[["category", "tags", "amount"]]
+
+    (labels,
+     sources,
+     targets,
+     values,
+     node_colors,
+     link_colors) = _build_sankey_diagram(period_real)
+
+    fig = go.Figure(data=[go.Sankey(
+        valueformat = ".0f",
+        valuesuffix = money_symbol,
+        arrangement="snap",
+        node=dict(
+            pad=40,
+            thickness=10,
+            line=dict(color="black", width=0.5),
+            label=labels,
+            color=node_colors
+        ),
+        link=dict(
+            source=sources,
+            target=targets,
+            value=values,
+            color=link_colors,
+            hovertemplate='%{source.label} → %{target.label}<br>%{value}<extra></extra>'
+        )
+    )])
+
+    fig.update_layout(
+        font_family="Courier New",
+        font_size=12,
+        font_shadow="",
+        paper_bgcolor ="white"
+    )
+
+    return fig
+
+# endregion
+
+
+# region AMOUNT BY CATEGORY
+
+def build_amount_by_cat_figure(
+        period: pd.DataFrame,
+        categories_colors: dict[str, str],
+        money_symbol: str,
+        budget_name: str|None=None,
+        budget_period: pd.DataFrame|None=None) -> go.Figure :
+    import plotly.graph_objects as go
+
+    title = "Dépenses par catégories"
+
+    spent_real = period[( period["is_ignored"] == False ) & ( period["category"].isin(categories_colors) )]
+    spent_real_output = spent_real[spent_real["amount"] < 0]
+
+    spent_real_stats = spent_real_output[["category", "amount"]].groupby(["category"]).sum().abs().sort_values("amount", ascending=False)
+
+    colors = [categories_colors[cat] for cat in spent_real_stats.index]
+
+    fig = go.Figure()
+
+    if not budget_period is None :
+
+        title += f" vs budget {budget_name}"
+
+        spent_budget = budget_period[( budget_period["amount"] < 0 ) & ( budget_period["category"].isin(categories_colors) )]
+        spent_budget_stats = spent_budget[["category", "amount"]].groupby(["category"]).sum().abs().sort_index()
+
+        ordered_cat = list(spent_real_stats.index)
+        ordered_cat.extend([c for c in spent_budget_stats.index if c not in ordered_cat])
+        spent_budget_stats = spent_budget_stats.reindex(ordered_cat)
+
+        fig.add_trace(go.Bar(
+            x=spent_budget_stats.index,
+            y=spent_budget_stats["amount"],
+            name=f"Budget {budget_name}",
+            orientation='v',
+            marker=dict(color='lightgray'),
+            width=0.6,
+            hovertemplate=f'Budget {budget_name}'+': %{y}' + money_symbol +'<extra></extra>',
+        ))
+
+    fig.add_trace(go.Bar(
+        x=spent_real_stats.index,
+        y=spent_real_stats["amount"],
+        name='Dépenses réelles',
+        orientation='v',
+        marker=dict(color=colors),
+        width=0.3,
+        hovertemplate='Réel: %{y}' + money_symbol +'<extra></extra>',
+    ))
+
+    fig.update_layout(
+        barmode='overlay',
+        title=title,
+        xaxis_title='Montant',
+        yaxis_title='Catégorie',
+        height=400,
+        showlegend=False,
+    )
+
+    return fig
+
+# endregion
+
+
+# region PROVISIONS
+
+def build_provisions_figure(
+        provisions: pd.DataFrame,
+        total_provision: float,
+        money_symbol: str) -> go.Figure :
+    import plotly.graph_objects as go
+
+    labels = provisions.index
+    values = abs(provisions["provision"])
+    colors = provisions["provision"].apply(lambda x: "#7BC8A4" if x >= 0 else "#ff7f7f")
+
+    fig = go.Figure(
+        data=[
+            go.Pie(
+                labels=labels,
+                values=values,
+                hole=0.6,
+                marker_colors=colors,
+                textinfo="percent",
+                customdata=-provisions["provision"],
+                hovertemplate="<b>%{label}</b><br>%{customdata:+,.2f}" + f" {money_symbol}<extra></extra>",
+                showlegend=False,
+                marker=dict(
+                    colors=colors,
+                    line=dict(color="white", width=2)  # séparation entre les sections
+                ),
+            )
+        ]
+    )
+
+    fig.update_layout(
+        showlegend=True,
+        annotations=[
+            dict(
+                text=f"{total_provision:,.0f} {money_symbol}",
+                x=0.5,
+                y=0.5,
+                font_size=28,
+                showarrow=False,
+            )
+        ],
+        margin=dict(t=20, b=20, l=20, r=20),
+        title="Provisions conseillées pour la période",
+    )
+
+    return fig
+
+# endregion
+
+
+# region MONTHLY STATS
+
+def build_monthly_stats_figure(
+        monthly_series: pd.DataFrame,
+        categories_colors: dict[str, str],
+        money_symbol: str,
+        title: str) -> go.Figure :
+    """
+    monthly_series has one row per month and one column per category.
+    """
+    import plotly.graph_objects as go
+
+    fig = go.Figure()
+
+    for cat in monthly_series.columns :
+        fig.add_trace(go.Scatter(
+            x=monthly_series.index,
+            y=monthly_series[cat].abs(),
+            mode='lines+markers',
+            name=cat,
+            line=dict(color=categories_colors.get(cat, "gray")),
+            hovertemplate=f"{cat}<br>" + "%{x|%m/%Y} : %{y:,.2f} " + money_symbol + "<extra></extra>",
+        ))
+
+    fig.update_layout(
+        title=title,
+        xaxis=dict(title="Mois"),
+        yaxis=dict(title="Montant"),
+        legend=dict(
+            orientation="h",
+            yanchor="top",
+            y=-0.2,
+            xanchor="center",
+            x=0.5
+        ),
+        height=450,
+    )
+
+    return fig
+
+# endregion
+
+
+# region BUDGETS COMPARISON
+
+def build_budgets_comparison_figure(
+        differences: pd.DataFrame,
+        money_symbol: str) -> go.Figure :
+    """
+    differences has one row per category (and the final balance), one column per budget.
+    """
+    import plotly.graph_objects as go
+
+    fig = go.Figure()
+
+    for budget in differences.columns :
+        fig.add_trace(go.Bar(
+            x=differences.index,
+            y=differences[budget],
+            name=budget,
+            hovertemplate=f"{budget}<br>" + "%{x} : %{y:+,.2f} " + money_symbol + "<extra></extra>",
+        ))
+
+    fig.update_layout(
+        title="Écarts des budgets au réel",
+        yaxis=dict(title="Écart"),
+        barmode='group',
+        legend=dict(
+            orientation="h",
+            yanchor="top",
+            y=-0.2,
+            xanchor="center",
+            x=0.5
+        ),
+    )
+
+    return fig
+
+# endregion
+
+
+# region CONSOLIDATED BALANCE
+
+def build_consolidated_balance_figure(
+        consolidated: pd.DataFrame,
+        total_column: str,
+        money_symbol: str) -> go.Figure :
+    """
+    consolidated has a date column, one balance column per account and the total.
+    """
+    import plotly.graph_objects as go
+
+    fig = go.Figure()
+
+    for account in consolidated.columns.drop("date") :
+        is_total = account == total_column
+        fig.add_trace(go.Scatter(
+            x=consolidated["date"],
+            y=consolidated[account],
+            name=account,
+            mode="lines",
+            line=dict(width=3 if is_total else 1.5, color="black" if is_total else None),
+            hovertemplate=f"{account}<br>" + "%{x|%d/%m/%Y} : %{y:,.2f} " + money_symbol + "<extra></extra>",
+        ))
+
+    fig.update_layout(
+        title="Solde consolidé des comptes",
+        yaxis=dict(title="Solde"),
+        legend=dict(
+            orientation="h",
+            yanchor="top",
+            y=-0.2,
+            xanchor="center",
+            x=0.5
+        ),
+    )
+
+    return fig
+
+# endregion
@@ -1,8 +1,22 @@
 from pathlib import Path
-import streamlit.web.bootstrap
+from contextlib import contextmanager
 from importlib import resources
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+import argparse
+import ast
+import json
+import subprocess
+import sys
+
+# Headless commands must not import streamlit nor plotly, keep heavy imports inside the commands
+
+
+# region APP
+
+def run_app() :
+    import streamlit.web.bootstrap
 
-def run():
     src_dir = Path(__file__).absolute().parent
     main_path = src_dir / "main.py"
     with resources.as_file(resources.files("cabank") / "main.py") as app_path:
@@ -11,4 +25,556 @@ def run():
             is_hello=False,
             args=[],
             flag_options={}
-        )
\ No newline at end of file
+        )
+
+# endregion
+
+
+# region HEADLESS
+
+def _parse_date(value: str) -> datetime :
+    return datetime.strptime(value, "%Y-%m-%d")
+
+
+def _get_default_user() -> str :
+    from cabank.storage import DATA_PATH
+
+    all_users = sorted(
+        p.name
+        for p in DATA_PATH.iterdir()
+        if p.is_dir() and p.name != "default"
+    ) if DATA_PATH.exists() else []
+
+    return all_users[0] if all_users else "default"
+
+
+def _get_store(args: argparse.Namespace) :
+    from cabank.storage import get_user_store
+
+    return get_user_store(args.user or _get_default_user())
+
+
+def _get_user_config(args: argparse.Namespace) -> dict :
+    """
+    The default config until the user opened the app once.
+    """
+    from cabank.storage import CONFIG_ROOT_PATH
+
+    config_path = CONFIG_ROOT_PATH / f"{args.user or _get_default_user()}.json"
+    if not config_path.exists() :
+        return json.loads(resources.files("cabank").joinpath("data/default_config.json").read_text(encoding="utf-8"))
+
+    with config_path.open("r", encoding="utf-8") as f :
+        return json.load(f)
+
+
+@contextmanager
+def _open_output(args: argparse.Namespace) :
+
+    output = sys.stdout if args.output is None else open(args.output, "w", encoding="utf-8", newline="")
+
+    try :
+        yield output
+    finally :
+        if not args.output is None :
+            output.close()
+
+
+def _write_frame(
+        df,
+        args: argparse.Namespace) :
+
+    with _open_output(args) as output :
+        if args.format == "json" :
+            df.to_json(output, orient="records", lines=True, date_format="iso", force_ascii=False)
+        else :
+            df.to_csv(output, index=False, date_format="%Y-%m-%d")
+
+
+def run_balance(args: argparse.Namespace) :
+    """
+    Balance at the start of the given day.
+    """
+    from cabank.pipeline import compute_user_period_results
+
+    results = compute_user_period_results(
+        store=_get_store(args),
+        period_start=args.date,
+        period_end=args.date + relativedelta(days=1),
+    )
+    print(f"{results.offset:.2f}")
+
+
+def run_forecast(args: argparse.Namespace) :
+    from cabank.pipeline import compute_user_period_results
+
+    results = compute_user_period_results(
+        store=_get_store(args),
+        period_start=args.start,
+        period_end=args.start + relativedelta(months=args.months),
+        budget=args.budget,
+    )
+
+    forecast = results.daily_balance.copy()
+    forecast["balance"] = forecast["balance"].astype(float).round(2)
+    if not results.budget_balance is None :
+        forecast["budget_balance"] = results.budget_balance["balance"].astype(float).round(2).values
+
+    _write_frame(forecast, args)
+
+
+def run_period(args: argparse.Namespace) :
+    from cabank.pipeline import compute_user_period_results
+
+    results = compute_user_period_results(
+        store=_get_store(args),
+        period_start=args.start,
+        period_end=args.end,
+    )
+
+    period = results.period.sort_values("date", kind="stable")
+    period["tags"] = period["tags"].map(json.dumps)
+
+    _write_frame(period, args)
+
+
+def run_export(args: argparse.Namespace) :
+    """
+    Streamed one month at a time : memory doesn't grow with the range.
+    """
+    from cabank.export import iter_real_transactions, write_transactions
+
+    chunks = iter_real_transactions(
+        store=_get_store(args),
+        start=args.start,
+        end=args.end,
+        account=args.account,
+    )
+
+    with _open_output(args) as output :
+        write_transactions(chunks, output, args.format)
+
+
+def run_archive(args: argparse.Namespace) :
+    """
+    Archives the closed years before --before, then writes the summary of every archived year, one row per category.
+    """
+    import pandas as pd
+    from cabank.archive import compact_years, get_archive_summaries
+
+    from cabank.storage import SaveConflictError
+
+    store = _get_store(args)
+    if not args.list :
+        try :
+            compact_years(store, args.before, args.account)
+        except SaveConflictError as e :
+            print(e)
+            sys.exit(1)
+
+    rows = [
+        {
+            "year": summary["year"],
+            "closing_date": summary["closing_date"],
+            "closing_balance": summary["closing_balance"],
+            "category": category,
+            "total": total,
+        }
+        for summary in get_archive_summaries(store, args.account)
+        for category, total in summary["categories"].items()
+    ]
+
+    _write_frame(pd.DataFrame(rows, columns=["year", "closing_date", "closing_balance", "category", "total"]), args)
+
+
+def run_provisions(args: argparse.Namespace) :
+    from cabank.balance import get_provisions
+
+    store = _get_store(args)
+    provisions = get_provisions(
+        period_start=args.start,
+        period_end=args.end,
+        periodics=store.get("periodics.csv"),
+        modify_periodic_occurences=store.get("periodic_occurences_modifications.json"),
+        rates=store.get("rates.csv"),
+        holidays=store.get("holidays.csv"),
+    )
+
+    _write_frame(provisions.reset_index(), args)
+
+
+def run_report(args: argparse.Namespace) :
+    """
+    Opening and closing balances, then income and expenses per category.
+    """
+    import pandas as pd
+    from cabank.pipeline import compute_user_period_results
+
+    results = compute_user_period_results(
+        store=_get_store(args),
+        period_start=args.start,
+        period_end=args.end,
+        budget=args.budget,
+    )
+
+    def _summarize(period: pd.DataFrame) -> pd.DataFrame :
+        spent = period[period["is_ignored"] == False]
+        return pd.DataFrame({
+            "income": spent["amount"].where(spent["amount"] > 0, 0.).groupby(spent["category"]).sum(),
+            "expense": spent["amount"].where(spent["amount"] < 0, 0.).groupby(spent["category"]).sum(),
+        })
+
+    report = _summarize(results.period)
+    if not results.budget_period is None :
+        report = report.join(_summarize(results.budget_period).add_prefix("budget_"), how="outer").fillna(0.)
+
+    closing_balance = float(results.daily_balance["balance"].iloc[-1])
+    balances = pd.DataFrame(
+        {"income": [results.offset, closing_balance], "expense": [0., 0.]},
+        index=["Solde initial", "Solde final"],
+    )
+
+    report = pd.concat([balances, report.sort_index()]).fillna(0.).round(2)
+    report.index.name = "category"
+
+    _write_frame(report.reset_index(), args)
+
+def run_alert(args: argparse.Namespace) :
+    """
+    Prints a warning and exits with status 1 if the projected balance goes under the threshold, for cron jobs.
+    """
+    from cabank.pipeline import get_low_balance_alert
+
+    config = _get_user_config(args)
+    threshold = config.get("low_balance_threshold", 0.) if args.threshold is None else args.threshold
+    months = config.get("low_balance_horizon_months", 24) if args.months is None else args.months
+
+    alert = get_low_balance_alert(
+        store=_get_store(args),
+        scan_start=args.start,
+        scan_end=args.start + relativedelta(months=months),
+        threshold=threshold,
+    )
+
+    if alert is None :
+        return
+
+    print(
+        f"Solde sous {threshold:.2f} le {alert.first_date:%d/%m/%Y} ({alert.first_balance:.2f}), "
+        f"au plus bas le {alert.min_date:%d/%m/%Y} ({alert.min_balance:.2f})"
+    )
+    sys.exit(1)
+
+
+def run_accounts(args: argparse.Namespace) :
+    """
+    Daily balance of every account and their total.
+    """
+    from cabank.accounts import get_consolidated_balance
+
+    consolidated = get_consolidated_balance(
+        store=_get_store(args),
+        period_start=args.start,
+        period_end=args.start + relativedelta(months=args.months),
+        accounts=args.accounts or None,
+    )
+
+    _write_frame(consolidated.set_index("date").round(2).reset_index(), args)
+
+
+def run_memory(args: argparse.Namespace) :
+    """
+    Memory of the frames of a session, compact against plain columns.
+    """
+    from cabank.memory import run_memory_benchmark
+
+    benchmark = run_memory_benchmark(
+        store=_get_store(args),
+        period_start=args.start,
+        period_end=args.start + relativedelta(months=args.months),
+        budget=args.budget,
+    )
+
+    _write_frame(benchmark, args)
+
+
+def run_reports(args: argparse.Namespace) :
+    """
+    One html report per period (balance, Sankey, categories, provisions), written by a pool of processes.
+    """
+    from time import perf_counter
+    from cabank.report import get_report_periods, write_period_reports
+
+    config = _get_user_config(args)
+    periods = get_report_periods(args.start, args.end, args.months)
+
+    start = perf_counter()
+    paths = write_period_reports(
+        user=args.user or _get_default_user(),
+        periods=periods,
+        output_dir=Path(args.output_dir),
+        categories_colors=config.get("categories", {}),
+        money_symbol=config.get("money_symbol", ""),
+        budget=args.budget,
+        workers=args.workers,
+        plotlyjs=args.plotlyjs,
+    )
+
+    print(f"{len(paths)} rapports en {perf_counter() - start:.1f} s dans {args.output_dir}")
+
+# endregion
+
+
+# region STARTUP
+
+# (modules, import time budget in ms, modules that must not be imported)
+STARTUP_TARGETS = {
+    "cli": (["cabank.cli"], 250, ["pandas", "streamlit", "plotly", "streamlit_calendar"]),
+    "headless": (["cabank.pipeline", "cabank.rollup"], 1500, ["streamlit", "plotly", "streamlit_calendar"]),
+    # streamlit imports plotly.graph_objects itself, which is lazy and cheap
+    "app": (None, 2500, ["streamlit_calendar", "plotly.express"]),
+}
+
+
+def get_top_level_imports(path: Path) -> list[str] :
+    """
+    Modules imported at the top of a script, ie. before its first line runs.
+    Imports inside functions or `if TYPE_CHECKING` are deferred, so they are not listed.
+    """
+
+    tree = ast.parse(path.read_text(encoding="utf-8"))
+
+    modules = []
+    for node in tree.body :
+        if isinstance(node, ast.Import) :
+            modules += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module != "__future__" :
+            modules.append(node.module)
+
+    return modules
+
+
+def measure_import_time(modules: list[str]) -> tuple[float, dict[str, float], set[str]] :
+    """
+    Cold import of the modules in a fresh interpreter, with `python -X importtime`.
+    Returns the total time in ms, the cumulative time in ms of every top level import, and every imported module.
+    """
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {', '.join(modules)}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    total = 0.
+    top_level = {}
+    imported = set()
+
+    for line in result.stderr.splitlines() :
+        if not line.startswith("import time:") :
+            continue
+
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit() :
+            continue
+
+        imported.add(name.strip())
+        total += int(self_us) / 1000
+
+        # Nested imports are indented by two spaces per level
+        if not name[1:].startswith(" ") :
+            top_level[name.strip()] = int(cumulative_us) / 1000
+
+    return total, top_level, imported
+
+
+def run_startup(args: argparse.Namespace) :
+    """
+    Fails if a cold start goes over its budget, or imports a module that should be deferred.
+    """
+
+    failed = False
+
+    for target in args.targets or STARTUP_TARGETS :
+        modules, budget, forbidden = STARTUP_TARGETS[target]
+        if modules is None :
+            modules = get_top_level_imports(Path(__file__).absolute().parent / "main.py")
+
+        budget = budget if args.budget is None else args.budget
+        total, top_level, imported = measure_import_time(modules)
+        leaks = sorted(m for m in forbidden if m in imported)
+
+        status = "OK" if ( total <= budget ) and ( not leaks ) else "ÉCHEC"
+        failed = failed or status != "OK"
+
+        print(f"{target} : {total:.0f} ms / {budget} ms {status}")
+        for name, cumulative in sorted(top_level.items(), key=lambda x: -x[1])[:args.top] :
+            print(f"    {cumulative:8.1f} ms  {name}")
+        if leaks :
+            print(f"    Modules à différer : {', '.join(leaks)}")
+
+    if failed :
+        sys.exit(1)
+
+# endregion
+
+
+# region EQUIVALENCE
+
+def run_equivalence_check(args: argparse.Namespace) :
+    """
+    Fails if balance.py gives a different result than its frozen reference on any case.
+    """
+    from cabank.equivalence import EQUIVALENCE_CHECKS, run_equivalence
+
+    if unknown := sorted(set(args.functions) - set(EQUIVALENCE_CHECKS)) :
+        print(f"Fonctions inconnues : {', '.join(unknown)}")
+        sys.exit(2)
+
+    checked, mismatches = run_equivalence(
+        n_cases=args.cases,
+        seed=args.seed,
+        functions=args.functions or None,
+    )
+
+    for name, count in checked.items() :
+        failed = sum(1 for m in mismatches if m.function == name)
+        print(f"{name} : {count - failed}/{count} cas équivalents")
+
+    for m in mismatches[:args.top] :
+        print(f"    {m.function} ({m.case}) : {m.message}")
+
+    if mismatches :
+        sys.exit(1)
+
+# endregion
+
+
+# region PARSER
+
+def get_parser() -> argparse.ArgumentParser :
+
+    parser = argparse.ArgumentParser(prog="cabank", description="Outil pour faire ses comptes")
+    subparsers = parser.add_subparsers(dest="command")
+
+    subparsers.add_parser("app", help="Lancer l'application (par défaut)")
+
+    def _add_common(
+            subparser: argparse.ArgumentParser,
+            with_output: bool=True) :
+
+        subparser.add_argument("--user", help="Compte (par défaut le premier)")
+        if not with_output :
+            return
+
+        subparser.add_argument("--format", choices=["csv", "json"], default="csv", help="json = une ligne JSON par élément")
+        subparser.add_argument("--output", help="Fichier de sortie (par défaut la sortie standard)")
+
+    balance_parser = subparsers.add_parser("balance", help="Solde au début d'un jour")
+    _add_common(balance_parser, with_output=False)
+    balance_parser.add_argument("--date", type=_parse_date, default=datetime.now().replace(hour=0, minute=0, second=0, microsecond=0))
+
+    forecast_parser = subparsers.add_parser("forecast", help="Solde quotidien prévisionnel")
+    _add_common(forecast_parser)
+    forecast_parser.add_argument("--start", type=_parse_date, default=datetime.now().replace(hour=0, minute=0, second=0, microsecond=0))
+    forecast_parser.add_argument("--months", type=int, default=1)
+    forecast_parser.add_argument("--budget", help="Budget à comparer")
+
+    period_parser = subparsers.add_parser("period", help="Toutes les dépenses d'une période")
+    _add_common(period_parser)
+    period_parser.add_argument("--start", type=_parse_date, required=True)
+    period_parser.add_argument("--end", type=_parse_date, required=True, help="Exclu")
+
+    export_parser = subparsers.add_parser("export", help="Toutes les transactions réelles entre deux dates (périodiques, ajustements des checkpoints...), écrites au fil de l'eau")
+    _add_common(export_parser)
+    export_parser.add_argument("--start", type=_parse_date, required=True)
+    export_parser.add_argument("--end", type=_parse_date, required=True, help="Exclu")
+    export_parser.add_argument("--account", default="principal", help="Compte (principal = le dossier de l'utilisateur)")
+
+    archive_parser = subparsers.add_parser("archive", help="Archive les années closes (ponctuels et checkpoints compressés, solde de clôture gardé en checkpoint)")
+    _add_common(archive_parser)
+    archive_parser.add_argument("--before", type=int, default=datetime.now().year - 1, help="Archive les années strictement antérieures (par défaut l'année dernière reste vivante)")
+    archive_parser.add_argument("--list", action="store_true", help="Liste les archives sans rien archiver")
+    archive_parser.add_argument("--account", default="principal", help="Compte (principal = le dossier de l'utilisateur)")
+
+    provisions_parser = subparsers.add_parser("provisions", help="Provisions conseillées pour une période")
+    _add_common(provisions_parser)
+    provisions_parser.add_argument("--start", type=_parse_date, required=True)
+    provisions_parser.add_argument("--end", type=_parse_date, required=True, help="Exclu")
+
+    report_parser = subparsers.add_parser("report", help="Bilan par catégorie d'une période")
+    _add_common(report_parser)
+    report_parser.add_argument("--start", type=_parse_date, required=True)
+    report_parser.add_argument("--end", type=_parse_date, required=True, help="Exclu")
+    report_parser.add_argument("--budget", help="Budget à comparer")
+
+    alert_parser = subparsers.add_parser("alert", help="Alerte si le solde prévisionnel passe sous un seuil (code de sortie 1)")
+    _add_common(alert_parser, with_output=False)
+    alert_parser.add_argument("--start", type=_parse_date, default=datetime.now().replace(hour=0, minute=0, second=0, microsecond=0))
+    alert_parser.add_argument("--months", type=int, help="Horizon en mois (par défaut celui de la configuration)")
+    alert_parser.add_argument("--threshold", type=float, help="Seuil (par défaut celui de la configuration)")
+
+    accounts_parser = subparsers.add_parser("accounts", help="Solde quotidien consolidé de plusieurs comptes")
+    _add_common(accounts_parser)
+    accounts_parser.add_argument("accounts", nargs="*", help="Comptes (tous par défaut, principal = le dossier de l'utilisateur)")
+    accounts_parser.add_argument("--start", type=_parse_date, default=datetime.now().replace(hour=0, minute=0, second=0, microsecond=0))
+    accounts_parser.add_argument("--months", type=int, default=1)
+
+    memory_parser = subparsers.add_parser("memory", help="Mémoire des tableaux d'une session (compacts et non compacts)")
+    _add_common(memory_parser)
+    memory_parser.add_argument("--start", type=_parse_date, default=datetime.now().replace(hour=0, minute=0, second=0, microsecond=0))
+    memory_parser.add_argument("--months", type=int, default=12)
+    memory_parser.add_argument("--budget", help="Budget à inclure")
+
+    reports_parser = subparsers.add_parser("reports", help="Un rapport html par période (graphiques du solde, Sankey, catégories, provisions)")
+    _add_common(reports_parser, with_output=False)
+    reports_parser.add_argument("--start", type=_parse_date, required=True)
+    reports_parser.add_argument("--end", type=_parse_date, required=True, help="Exclu")
+    reports_parser.add_argument("--months", type=int, default=1, help="Durée de chaque période")
+    reports_parser.add_argument("--budget", help="Budget à comparer")
+    reports_parser.add_argument("--output-dir", default="reports", help="Dossier des rapports")
+    reports_parser.add_argument("--workers", type=int, help="Nombre de processus (par défaut un par coeur, 1 = sans pool)")
+    reports_parser.add_argument("--plotlyjs", choices=["inline", "directory", "cdn"], default="inline", help="inline = rapports autonomes, directory = un plotly.min.js partagé")
+
+    startup_parser = subparsers.add_parser("startup", help="Vérifier le temps de démarrage (python -X importtime)")
+    startup_parser.add_argument("targets", nargs="*", choices=list(STARTUP_TARGETS), help="Toutes par défaut")
+    startup_parser.add_argument("--budget", type=float, help="Budget en ms (remplace celui de chaque cible)")
+    startup_parser.add_argument("--top", type=int, default=5, help="Nombre d'imports les plus lents affichés")
+
+    equivalence_parser = subparsers.add_parser("equivalence", help="Comparer balance.py à sa copie de référence sur des cas aléatoires")
+    equivalence_parser.add_argument("functions", nargs="*", help="Fonctions à comparer (toutes par défaut)")
+    equivalence_parser.add_argument("--cases", type=int, default=50, help="Nombre de cas aléatoires, en plus des cas limites")
+    equivalence_parser.add_argument("--seed", type=int, default=0, help="Graine du premier cas (un cas en échec se rejoue avec sa graine et --cases 1)")
+    equivalence_parser.add_argument("--top", type=int, default=20, help="Nombre d'écarts affichés")
+
+    return parser
+
+
+COMMANDS = {
+    "balance": run_balance,
+    "forecast": run_forecast,
+    "period": run_period,
+    "export": run_export,
+    "archive": run_archive,
+    "provisions": run_provisions,
+    "report": run_report,
+    "alert": run_alert,
+    "accounts": run_accounts,
+    "memory": run_memory,
+    "reports": run_reports,
+    "startup": run_startup,
+    "equivalence": run_equivalence_check,
+}
+
+def run() :
+
+    args = get_parser().parse_args()
+
+    if args.command in [None, "app"] :
+        run_app()
+        return
+
+    COMMANDS[args.command](args)
+
+# endregion
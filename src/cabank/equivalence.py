@@ -0,0 +1,469 @@
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+from typing import (
+    Any,
+    Callable,
+    NamedTuple,
+)
+from types import ModuleType
+import copy
+import inspect
+import math
+import numpy as np
+import pandas as pd
+from cabank import balance
+from cabank import _reference_balance
+from cabank.utils import compact_frame
+from cabank.storage import (
+    CHECKPOINTS_COLUMNS,
+    PERIODICS_COLUMNS,
+    PONCTUALS_COLUMNS,
+    get_empty_frame,
+)
+
+EQUIVALENCE_CATEGORIES = ["Salaire", "Logement", "Courses", "Service"]
+# (days, months) of the generated periodics, (0, 0) never occurs
+EQUIVALENCE_INTERVALS = [(0, 1), (0, 1), (0, 2), (0, 3), (0, 12), (7, 0), (14, 0), (1, 0), (3, 1), (0, 0)]
+EQUIVALENCE_STEP_DAYS = [None, 1, 7, 30]
+
+
+class EquivalenceCase(NamedTuple) :
+    """
+    Inputs of every public function of balance.py, typed like the loaders of storage.py.
+    """
+    label: str
+    period_start: datetime
+    period_end: datetime
+    periodics: pd.DataFrame
+    ponctuals: pd.DataFrame
+    modifications: dict[str, dict[str, float|None]]
+    checkpoints: pd.DataFrame
+    budget_periodics: pd.DataFrame
+    budget_ponctuals: pd.DataFrame
+    ref_day: datetime
+    ref_balance: float
+    target_day: datetime
+    adjustments_step_days: int|None
+
+
+class EquivalenceMismatch(NamedTuple) :
+    function: str
+    case: str
+    message: str
+
+
+# region GENERATION
+
+def _get_frame(
+        rows: list[dict[str, Any]],
+        columns: dict[str, str]) -> pd.DataFrame :
+
+    if len(rows) == 0 :
+        return get_empty_frame(columns)
+
+    frame = pd.DataFrame(rows, columns=list(columns))
+
+    return compact_frame(frame.astype({c: t for c, t in columns.items() if t != "object"}))
+
+
+def _random_day(
+        rng: np.random.Generator,
+        around_start: datetime,
+        around_end: datetime) -> datetime :
+    """
+    Mostly uniform, but often on a month end or on a boundary of the period, where the rules are subtle.
+    """
+
+    draw = rng.random()
+
+    if draw < 0.2 :
+        month_start = datetime(around_start.year, around_start.month, 1) + relativedelta(months=int(rng.integers(-2, 14)))
+        return month_start + relativedelta(months=1) - relativedelta(days=1)
+
+    if draw < 0.35 :
+        boundary = [around_start, around_end][int(rng.integers(0, 2))]
+        return boundary + relativedelta(days=int(rng.integers(-1, 2)))
+
+    span_days = max(( around_end - around_start ).days, 1)
+    return around_start + relativedelta(days=int(rng.integers(-60, span_days + 60)))
+
+
+def _random_periodics(
+        rng: np.random.Generator,
+        period_start: datetime,
+        period_end: datetime,
+        prefix: str) -> pd.DataFrame :
+
+    rows = []
+    for i in range(int(rng.choice([0, 1, 3, 6]))) :
+
+        days, months = EQUIVALENCE_INTERVALS[int(rng.integers(0, len(EQUIVALENCE_INTERVALS)))]
+        first = _random_day(rng, period_start - relativedelta(months=6), period_end)
+        last = None if rng.random() < 0.5 else _random_day(rng, first, period_end + relativedelta(months=6))
+
+        rows.append({
+            "category": EQUIVALENCE_CATEGORIES[int(rng.integers(0, len(EQUIVALENCE_CATEGORIES)))],
+            "tags": [] if rng.random() < 0.7 else ["tag"],
+            "description": f"{prefix} {i}",
+            "amount": round(float(rng.normal(0, 300)), 2),
+            "first": first,
+            "last": last,
+            "days": days,
+            "months": months,
+            "id": f"{prefix}-{i}",
+        })
+
+    return _get_frame(rows, PERIODICS_COLUMNS)
+
+
+def _random_ponctuals(
+        rng: np.random.Generator,
+        period_start: datetime,
+        period_end: datetime,
+        prefix: str) -> pd.DataFrame :
+
+    rows = [
+        {
+            "date": _random_day(rng, period_start, period_end),
+            "category": EQUIVALENCE_CATEGORIES[int(rng.integers(0, len(EQUIVALENCE_CATEGORIES)))],
+            "tags": [] if rng.random() < 0.7 else ["tag"],
+            "description": f"{prefix} {i}",
+            "amount": round(float(rng.exponential(40)) * ( 1 if rng.random() < 0.9 else -1 ), 2),
+            "id": f"{prefix}-{i}",
+        }
+        for i in range(int(rng.choice([0, 1, 5, 30])))
+    ]
+
+    return _get_frame(rows, PONCTUALS_COLUMNS)
+
+
+def _random_modifications(
+        rng: np.random.Generator,
+        periodics: pd.DataFrame,
+        period_start: datetime,
+        period_end: datetime) -> dict[str, dict[str, float|None]] :
+    """
+    Ignored (None) and modified occurences, plus a few that don't match any occurence.
+    """
+
+    modifications = {}
+    for _, periodic in periodics.iterrows() :
+
+        occurences = _reference_balance.get_all_occurences_in_period(periodic, period_start - relativedelta(months=2), period_end + relativedelta(months=2))
+        chosen = [o for o in occurences if rng.random() < 0.3]
+        if rng.random() < 0.2 :
+            chosen.append(periodic["first"] + relativedelta(days=1))
+
+        if chosen :
+            modifications[periodic["id"]] = {
+                o.strftime("%Y-%m-%d"): None if rng.random() < 0.5 else round(float(rng.normal(0, 300)), 2)
+                for o in chosen
+            }
+
+    if rng.random() < 0.2 :
+        modifications["unknown"] = {period_start.strftime("%Y-%m-%d"): None}
+
+    return modifications
+
+
+def generate_case(seed: int) -> EquivalenceCase :
+
+    rng = np.random.default_rng(seed)
+
+    period_start = datetime(int(rng.integers(2019, 2027)), int(rng.integers(1, 13)), int(rng.integers(1, 29)))
+    if rng.random() < 0.2 :
+        period_start = period_start.replace(day=1) + relativedelta(months=1) - relativedelta(days=1)
+    period_end = period_start + relativedelta(days=int(rng.choice([1, 2, 30, 31, 92, 200])))
+
+    periodics = _random_periodics(rng, period_start, period_end, "periodic")
+    checkpoints_dates = sorted({_random_day(rng, period_start, period_end) for _ in range(int(rng.choice([0, 1, 2, 4])))})
+
+    return EquivalenceCase(
+        label=f"seed={seed}",
+        period_start=period_start,
+        period_end=period_end,
+        periodics=periodics,
+        ponctuals=_random_ponctuals(rng, period_start, period_end, "ponctual"),
+        modifications=_random_modifications(rng, periodics, period_start, period_end),
+        checkpoints=_get_frame(
+            [{"date": d, "net_position": round(float(rng.normal(1000, 500)), 2)} for d in checkpoints_dates],
+            CHECKPOINTS_COLUMNS,
+        ),
+        budget_periodics=_random_periodics(rng, period_start, period_end, "budget"),
+        budget_ponctuals=_random_ponctuals(rng, period_start, period_end, "budget"),
+        ref_day=_random_day(rng, period_start, period_end),
+        ref_balance=round(float(rng.normal(1000, 500)), 2),
+        target_day=period_start if rng.random() < 0.1 else _random_day(rng, period_start, period_end),
+        adjustments_step_days=EQUIVALENCE_STEP_DAYS[int(rng.integers(0, len(EQUIVALENCE_STEP_DAYS)))],
+    )
+
+
+def get_edge_cases() -> list[EquivalenceCase] :
+    """
+    Always checked before the random cases.
+    """
+
+    empty = EquivalenceCase(
+        label="empty",
+        period_start=datetime(2024, 1, 1),
+        period_end=datetime(2024, 2, 1),
+        periodics=get_empty_frame(PERIODICS_COLUMNS),
+        ponctuals=get_empty_frame(PONCTUALS_COLUMNS),
+        modifications={},
+        checkpoints=get_empty_frame(CHECKPOINTS_COLUMNS),
+        budget_periodics=get_empty_frame(PERIODICS_COLUMNS),
+        budget_ponctuals=get_empty_frame(PONCTUALS_COLUMNS),
+        ref_day=datetime(2024, 1, 15),
+        ref_balance=100.,
+        target_day=datetime(2024, 1, 1),
+        adjustments_step_days=7,
+    )
+
+    # Monthly from a 31st : Feb 29 in a leap year, then the 29th for good (relativedelta is applied step by step)
+    month_end_periodics = _get_frame(
+        [
+            {"category": "Logement", "tags": [], "description": "31", "amount": -800., "first": datetime(2024, 1, 31), "last": None, "days": 0, "months": 1, "id": "month-end"},
+            {"category": "Service", "tags": [], "description": "29/02", "amount": -50., "first": datetime(2024, 2, 29), "last": datetime(2026, 2, 28), "days": 0, "months": 12, "id": "leap-day"},
+            {"category": "Salaire", "tags": [], "description": "30", "amount": 2000., "first": datetime(2023, 11, 30), "last": datetime(2024, 4, 30), "days": 0, "months": 1, "id": "last-included"},
+            {"category": "Courses", "tags": [], "description": "never", "amount": -10., "first": datetime(2024, 1, 1), "last": None, "days": 0, "months": 0, "id": "never"},
+        ],
+        PERIODICS_COLUMNS,
+    )
+    month_end_ponctuals = _get_frame(
+        [
+            {"date": datetime(2024, 1, 31), "category": "Courses", "tags": [], "description": "a", "amount": 20., "id": "p-1"},
+            {"date": datetime(2024, 3, 1), "category": "Courses", "tags": ["x"], "description": "b", "amount": -5.5, "id": "p-2"},
+        ],
+        PONCTUALS_COLUMNS,
+    )
+    month_end = EquivalenceCase(
+        label="month_end",
+        period_start=datetime(2024, 1, 31),
+        period_end=datetime(2025, 3, 1),
+        periodics=month_end_periodics,
+        ponctuals=month_end_ponctuals,
+        modifications={"month-end": {"2024-02-29": None, "2024-03-29": -900.}, "last-included": {"2024-04-30": None}},
+        checkpoints=_get_frame(
+            [{"date": datetime(2024, 1, 31), "net_position": 1000.}, {"date": datetime(2024, 3, 31), "net_position": 1500.}],
+            CHECKPOINTS_COLUMNS,
+        ),
+        budget_periodics=month_end_periodics.iloc[:1],
+        budget_ponctuals=get_empty_frame(PONCTUALS_COLUMNS),
+        ref_day=datetime(2024, 2, 29),
+        ref_balance=1234.56,
+        target_day=datetime(2024, 1, 31),
+        adjustments_step_days=7,
+    )
+
+    single_day = month_end._replace(
+        label="single_day",
+        period_start=datetime(2024, 2, 29),
+        period_end=datetime(2024, 3, 1),
+        ref_day=datetime(2024, 2, 28),
+        target_day=datetime(2024, 3, 1),
+        adjustments_step_days=None,
+    )
+
+    return [empty, month_end, single_day]
+
+# endregion
+
+
+# region CHECKS
+
+def _check_get_aggregated_period(
+        module: ModuleType,
+        case: EquivalenceCase) -> pd.DataFrame :
+
+    return module.get_aggregated_period(
+        period_start=case.period_start,
+        period_end=case.period_end,
+        periodics=case.budget_periodics,
+        ponctuals=case.ponctuals,
+        modify_periodic_occurences=case.modifications,
+        expanded_periodics=_reference_balance.get_all_periodics_in_period(case.period_start, case.period_end, case.periodics),
+    )
+
+
+def _check_get_daily_balance(
+        module: ModuleType,
+        case: EquivalenceCase) -> pd.DataFrame :
+
+    return module.get_daily_balance(
+        period_start=case.period_start,
+        period_end=case.period_end,
+        aggregated_period=_reference_balance.get_real_period(case.period_start, case.period_end, case.periodics, case.ponctuals, case.modifications),
+        start_offset=case.ref_balance,
+    )
+
+
+# Every public function of balance.py, called the same way on both modules
+EQUIVALENCE_CHECKS: dict[str, Callable[[ModuleType, EquivalenceCase], Any]] = {
+    "get_all_occurences_in_period": lambda m, c: [
+        m.get_all_occurences_in_period(periodic, c.period_start, c.period_end)
+        for _, periodic in c.periodics.iterrows()
+    ],
+    "get_all_periodics_in_period": lambda m, c: m.get_all_periodics_in_period(c.period_start, c.period_end, c.periodics),
+    "get_aggregated_period": _check_get_aggregated_period,
+    "get_real_period": lambda m, c: m.get_real_period(c.period_start, c.period_end, c.periodics, c.ponctuals, c.modifications),
+    "get_budget_period": lambda m, c: m.get_budget_period(c.period_start, c.period_end, c.periodics, c.budget_periodics, c.budget_ponctuals),
+    "get_budget_periods": lambda m, c: m.get_budget_periods(
+        c.period_start,
+        c.period_end,
+        c.periodics,
+        {"budget": (c.budget_periodics, c.budget_ponctuals), "empty": (get_empty_frame(PERIODICS_COLUMNS), get_empty_frame(PONCTUALS_COLUMNS))},
+    ),
+    "get_daily_balance": _check_get_daily_balance,
+    "get_offset": lambda m, c: m.get_offset(c.ref_day, c.ref_balance, c.target_day, c.periodics, c.ponctuals, c.modifications),
+    # Ids are random uuids
+    "build_checkpoint_adjustments": lambda m, c: m.build_checkpoint_adjustments(
+        checkpoints=c.checkpoints,
+        periodics=c.periodics,
+        ponctuals=c.ponctuals,
+        modify_periodic_occurences=c.modifications,
+        adjustments_step_days=c.adjustments_step_days,
+    ).drop(columns="id", errors="ignore"),
+    "get_provisions": lambda m, c: m.get_provisions(c.period_start, c.period_end, c.periodics, c.modifications),
+}
+
+
+def get_public_functions(module: ModuleType) -> list[str] :
+
+    return [
+        name
+        for name, f in inspect.getmembers(module, inspect.isfunction)
+        if f.__module__ == module.__name__ and not name.startswith("_")
+    ]
+
+# endregion
+
+
+# region COMPARISON
+
+def _normalize_frame(df: pd.DataFrame) -> pd.DataFrame :
+    """
+    Row order and storage (categoricals, string dtypes) are not part of the semantics :
+    rows are sorted on their scalar columns, which are compared as plain objects.
+    """
+
+    df = df.copy()
+    for c in df.columns :
+        if isinstance(df[c].dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(df[c].dtype) :
+            df[c] = df[c].astype(object).map(lambda v: None if v is None or ( isinstance(v, float) and math.isnan(v) ) else v)
+
+    if isinstance(df.index, pd.CategoricalIndex) :
+        df.index = df.index.astype(object)
+
+    keys = [c for c in ["date", "category", "description", "amount", "periodic_id", "is_ignored"] if c in df.columns]
+    if len(keys) == 0 :
+        return df.sort_index()
+
+    return df.sort_values(keys, kind="stable", na_position="first").reset_index(drop=True)
+
+
+def get_difference(
+        expected: Any,
+        actual: Any) -> str|None :
+    """
+    None if both results are equivalent, else a short description of the first difference.
+    Amounts are compared to the micro unit, datetimes whatever their resolution.
+    """
+
+    if isinstance(expected, pd.DataFrame) :
+        if not isinstance(actual, pd.DataFrame) :
+            return f"DataFrame attendu, {type(actual).__name__} obtenu"
+        if sorted(expected.columns) != sorted(actual.columns) :
+            return f"colonnes {list(expected.columns)} != {list(actual.columns)}"
+        if len(expected) != len(actual) :
+            return f"{len(expected)} lignes != {len(actual)}"
+        try :
+            pd.testing.assert_frame_equal(
+                _normalize_frame(expected),
+                _normalize_frame(actual[expected.columns]),
+                check_dtype=False,
+                check_index_type=False,
+                check_column_type=False,
+                check_exact=False,
+                atol=1e-6,
+            )
+        except AssertionError as e :
+            return str(e).strip().splitlines()[0]
+        return None
+
+    if isinstance(expected, dict) :
+        if not isinstance(actual, dict) or expected.keys() != actual.keys() :
+            return "clés différentes"
+        for key in expected :
+            if not ( difference := get_difference(expected[key], actual[key]) ) is None :
+                return f"[{key}] {difference}"
+        return None
+
+    if isinstance(expected, list) :
+        if not isinstance(actual, list) or len(expected) != len(actual) :
+            return f"{len(expected)} éléments != {len(actual) if isinstance(actual, list) else actual}"
+        for i, (e, a) in enumerate(zip(expected, actual)) :
+            if not ( difference := get_difference(e, a) ) is None :
+                return f"[{i}] {difference}"
+        return None
+
+    if isinstance(expected, datetime) :
+        return None if pd.Timestamp(expected) == pd.Timestamp(actual) else f"{expected} != {actual}"
+
+    if isinstance(expected, (float, int, np.number)) :
+        return None if math.isclose(float(expected), float(actual), rel_tol=0, abs_tol=1e-6) else f"{expected} != {actual}"
+
+    return None if expected == actual else f"{expected!r} != {actual!r}"
+
+
+def _call(
+        check: Callable[[ModuleType, EquivalenceCase], Any],
+        module: ModuleType,
+        case: EquivalenceCase) -> Any :
+    """
+    Each module gets its own copy of the inputs, an exception is a result like any other.
+    """
+
+    try :
+        return check(module, copy.deepcopy(case))
+    except Exception as e :
+        return f"{type(e).__name__} levée"
+
+# endregion
+
+
+# region RUN
+
+def run_equivalence(
+        n_cases: int,
+        seed: int=0,
+        functions: list[str]|None=None,
+        candidate: ModuleType=balance) -> tuple[dict[str, int], list[EquivalenceMismatch]] :
+    """
+    Compares candidate with the frozen reference on the edge cases, then on n_cases random cases (seeds seed, seed+1...).
+    Returns the number of cases checked per function, and the mismatches.
+    A public function of the candidate without check is a mismatch too, so that it can't be forgotten.
+    """
+
+    mismatches = [
+        EquivalenceMismatch(name, "-", "pas de vérification d'équivalence")
+        for name in get_public_functions(candidate)
+        if name not in EQUIVALENCE_CHECKS
+    ]
+
+    names = functions or list(EQUIVALENCE_CHECKS)
+    checked = {name: 0 for name in names}
+
+    cases = get_edge_cases() + [generate_case(seed + i) for i in range(n_cases)]
+
+    for case in cases :
+        for name in names :
+            expected = _call(EQUIVALENCE_CHECKS[name], _reference_balance, case)
+            actual = _call(EQUIVALENCE_CHECKS[name], candidate, case)
+
+            checked[name] += 1
+            if not ( difference := get_difference(expected, actual) ) is None :
+                mismatches.append(EquivalenceMismatch(name, case.label, difference))
+
+    return checked, mismatches
+
+# endregion
@@ -0,0 +1,113 @@
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+from typing import (
+    Iterator,
+    TextIO,
+)
+import json
+import pandas as pd
+from cabank.balance import get_real_period
+from cabank.utils import safe_concat
+from cabank.storage import (
+    MAIN_ACCOUNT,
+    UserStore,
+    get_account_dataset,
+)
+from cabank.pipeline import (
+    get_account_ponctuals,
+    get_user_adjustments,
+)
+from cabank.archive import get_archived_ponctuals
+
+# Same columns for every chunk, so that the csv header is written once. Amounts are signed like in a period
+EXPORT_COLUMNS = ["date", "category", "tags", "description", "amount", "id", "periodic_id"]
+EXPORT_FORMATS = ["csv", "json"]
+
+
+def get_month_chunks(
+        start: datetime,
+        end: datetime) -> Iterator[tuple[datetime, datetime]] :
+    """
+    [start, end) cut on the first day of every month.
+    """
+
+    chunk_start = start
+    while chunk_start < end :
+        chunk_end = min(datetime(chunk_start.year, chunk_start.month, 1) + relativedelta(months=1), end)
+        yield chunk_start, chunk_end
+        chunk_start = chunk_end
+
+
+def iter_real_transactions(
+        store: UserStore,
+        start: datetime,
+        end: datetime,
+        account: str=MAIN_ACCOUNT) -> Iterator[pd.DataFrame] :
+    """
+    Every real transaction of an account over [start, end), one month at a time, sorted by date :
+    ponctuals (archived ones included), transfers and checkpoint adjustments, and the occurences of the periodics with their modifications
+    (ignored occurences are left out). Like get_real_period, amounts in other currencies are converted.
+    Only one month of occurences is held at a time, whatever the length of the range.
+    """
+
+    periodics = store.get(get_account_dataset(account, "periodics.csv"))
+    modifications = store.get(get_account_dataset(account, "periodic_occurences_modifications.json"))
+    rates = store.get("rates.csv")
+    holidays = store.get("holidays.csv")
+
+    # Sorted once, so that the ponctuals of a month are a slice. Closed years are read from their archives
+    ponctuals = safe_concat(
+        get_archived_ponctuals(store, start, end, account),
+        safe_concat(get_account_ponctuals(store, account), get_user_adjustments(store, account)),
+    )
+    ponctuals = ponctuals.sort_values("date", kind="stable").reset_index(drop=True)
+    dates = ponctuals["date"].to_numpy()
+
+    for chunk_start, chunk_end in get_month_chunks(start, end) :
+
+        lo, hi = dates.searchsorted(pd.Timestamp(chunk_start).to_datetime64()), dates.searchsorted(pd.Timestamp(chunk_end).to_datetime64())
+        # Same mask as the app, periodics outside the month have no occurence in it
+        chunk_periodics = periodics[( periodics["first"] < chunk_end ) & ( periodics["last"] >= chunk_start )]
+
+        period = get_real_period(
+            period_start=chunk_start,
+            period_end=chunk_end,
+            periodics=chunk_periodics,
+            ponctuals=ponctuals.iloc[lo:hi],
+            modify_periodic_occurences=modifications,
+            rates=rates,
+            holidays=holidays,
+        )
+
+        if len(period) == 0 :
+            continue
+
+        period = period[period["is_ignored"] != True].sort_values("date", kind="stable")
+
+        yield period.reindex(columns=EXPORT_COLUMNS)
+
+
+def write_transactions(
+        chunks: Iterator[pd.DataFrame],
+        output: TextIO,
+        format: str="csv") -> int :
+    """
+    Writes the chunks as they come, csv with one header or one JSON line per transaction. Returns the number of rows.
+    """
+
+    count = 0
+    for chunk in chunks :
+
+        if format == "json" :
+            chunk.to_json(output, orient="records", lines=True, date_format="iso", force_ascii=False)
+        else :
+            chunk = chunk.assign(tags=chunk["tags"].map(lambda tags: json.dumps(tags if isinstance(tags, list) else [])))
+            chunk.to_csv(output, index=False, header=count == 0, date_format="%Y-%m-%d")
+
+        count += len(chunk)
+        output.flush()
+
+    if format == "csv" and count == 0 :
+        output.write(",".join(EXPORT_COLUMNS) + "\n")
+
+    return count
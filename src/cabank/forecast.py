@@ -0,0 +1,158 @@
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+from typing import NamedTuple
+import numpy as np
+import pandas as pd
+from cabank.utils import (
+    has_rates,
+    convert_amounts,
+)
+
+FORECAST_PERCENTILES = [5, 25, 50, 75, 95]
+FORECAST_MIN_FIT_DAYS = 28
+
+
+class ForecastModel(NamedTuple) :
+    """
+    Daily variability of the unplanned flows (ponctuals and checkpoint adjustments) over a fit window.
+    categories holds the daily mean of each category, residuals the daily totals of every category
+    minus their mean, one value per day of the window.
+    """
+    categories: pd.DataFrame
+    residuals: np.ndarray
+
+
+# region FIT
+
+def fit_forecast_model(
+        ponctuals: pd.DataFrame,
+        fit_start: datetime,
+        fit_end: datetime,
+        rates: pd.DataFrame|None=None) -> ForecastModel|None :
+    """
+    ponctuals are entered like in the app (expenses are positive), adjustments included.
+    With rates, amounts in other currencies are converted first (see convert_amounts).
+    Returns None if the window is too short to say anything.
+    """
+
+    in_window = ponctuals[( ponctuals["date"] >= fit_start ) & ( ponctuals["date"] < fit_end )]
+    if has_rates(rates) :
+        in_window = convert_amounts(in_window, rates)
+    if len(in_window) > 0 :
+        fit_start = max(fit_start, in_window["date"].min().replace(hour=0, minute=0, second=0, microsecond=0))
+
+    all_days = pd.date_range(fit_start, fit_end, freq="D", inclusive="left")
+    if len(all_days) < FORECAST_MIN_FIT_DAYS :
+        return None
+
+    # One row per day, one column per category, days without expenses count as 0
+    daily = (
+        pd.DataFrame({
+            "day": in_window["date"].dt.normalize(),
+            "category": in_window["category"].astype(str),
+            "amount": -in_window["amount"].astype(float),
+        })
+        .pivot_table(index="day", columns="category", values="amount", aggfunc="sum", fill_value=0.)
+        .reindex(all_days, fill_value=0.)
+    )
+
+    categories = pd.DataFrame({
+        "mean": daily.mean(),
+    })
+
+    residuals = ( daily - categories["mean"] ).sum(axis=1).to_numpy()
+
+    return ForecastModel(categories=categories, residuals=residuals)
+
+
+def get_forecast_drift(
+        model: ForecastModel,
+        planned_ponctuals: pd.DataFrame,
+        horizon_days: int) -> float :
+    """
+    Expected daily unplanned flow over the horizon.
+    Ponctuals already entered in the future count towards the expected flow of their category,
+    so that they are not counted twice.
+    """
+
+    expected = model.categories["mean"] * horizon_days
+    planned = (
+        (-planned_ponctuals["amount"].astype(float))
+        .groupby(planned_ponctuals["category"].astype(str))
+        .sum()
+        .reindex(expected.index, fill_value=0.)
+    )
+
+    # Whatever is left of the expected flow, without changing its sign
+    remaining = np.where(expected < 0, np.minimum(expected - planned, 0.), np.maximum(expected - planned, 0.))
+
+    return float(remaining.sum() / horizon_days)
+
+# endregion
+
+
+# region SIMULATION
+
+def simulate_balance_paths(
+        start_balance: float,
+        increments: np.ndarray,
+        residuals: np.ndarray,
+        drift: float,
+        n_paths: int,
+        seed: int|None=0) -> np.ndarray :
+    """
+    Every path adds to the deterministic daily increments the drift and a historical day drawn at random.
+    Returns an array of shape (n_paths, len(increments) + 1), starting with start_balance.
+    """
+
+    rng = np.random.default_rng(seed)
+
+    draws = residuals[rng.integers(0, len(residuals), size=(n_paths, len(increments)))]
+    draws += increments + drift
+
+    paths = np.empty((n_paths, len(increments) + 1))
+    paths[:, 0] = start_balance
+    np.cumsum(draws, axis=1, out=paths[:, 1:])
+    paths[:, 1:] += start_balance
+
+    return paths
+
+
+def get_forecast_bands(
+        daily_balance: pd.DataFrame,
+        model: ForecastModel,
+        planned_ponctuals: pd.DataFrame,
+        today: datetime,
+        n_paths: int,
+        percentiles: list[int]=FORECAST_PERCENTILES,
+        seed: int|None=0) -> pd.DataFrame|None :
+    """
+    Percentiles of the simulated balance for every day from today, one column per percentile (ex: "p5").
+    The deterministic part of each day comes from daily_balance.
+    planned_ponctuals are the ponctuals of the simulated days.
+    """
+
+    future_balance = daily_balance[daily_balance["date"] > (today - relativedelta(days=1))]
+    if len(future_balance) < 2 :
+        return None
+
+    balance = future_balance["balance"].astype(float).to_numpy()
+    increments = np.diff(balance)
+
+    paths = simulate_balance_paths(
+        start_balance=balance[0],
+        increments=increments,
+        residuals=model.residuals,
+        drift=get_forecast_drift(model, planned_ponctuals, len(increments)),
+        n_paths=n_paths,
+        seed=seed,
+    )
+
+    bands = np.percentile(paths, percentiles, axis=0)
+
+    return pd.DataFrame(
+        {f"p{p}": band for p, band in zip(percentiles, bands)},
+        index=future_balance["date"].to_numpy(),
+    ).rename_axis("date").reset_index()
+
+# endregion
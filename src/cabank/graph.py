@@ -0,0 +1,380 @@
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    wait,
+)
+from collections import OrderedDict
+from contextvars import copy_context
+from threading import (
+    Event,
+    Lock,
+    Thread,
+)
+from time import perf_counter
+from typing import (
+    Any,
+    Callable,
+    Hashable,
+    NamedTuple,
+)
+import pandas as pd
+from cabank.utils import get_fingerprint
+from cabank.timing import span
+
+
+class GraphNode(NamedTuple) :
+    name: str
+    inputs: list[str]
+    compute: Callable[..., Any]
+
+
+class _Memo(NamedTuple) :
+    input_versions: tuple
+    value: Any
+    version: str
+
+
+class _Prefetch(NamedTuple) :
+    thread: Thread
+    cancelled: Event
+    # Sources given other values by the prefetch, their changes don't cancel it
+    overridden: set[str]
+
+
+# region GRAPH
+
+class ComputationGraph :
+    """
+    Small dataflow graph : sources are set from outside with a version, nodes are computed from their inputs.
+
+    A node is memoized on the versions of its inputs : it is only recomputed when one of them changed,
+    and then gets a new version, so that only what is downstream of a change is recomputed.
+    Nodes are computed on demand, independent stale nodes run concurrently when workers > 1.
+
+    The version of a node is a fingerprint of its name and input versions, so that with max_cached > 0
+    the last computed values are kept in a LRU cache, found again when the inputs come back
+    (ex: back to a previous period), or computed ahead of time by start_prefetch.
+    """
+
+    def __init__(self, max_cached: int=0) :
+        self._sources: dict[str, tuple[Any, Hashable]] = {}
+        self._nodes: dict[str, GraphNode] = {}
+        self._memo: dict[str, _Memo] = {}
+        self._stats: dict[str, dict[str, float]] = {}
+        self._max_cached = max_cached
+        self._cache: OrderedDict[str, Any] = OrderedDict()
+        self._cache_lock = Lock()
+        self._prefetch: _Prefetch|None = None
+
+    def add_node(
+            self,
+            name: str,
+            inputs: list[str],
+            compute: Callable[..., Any]) :
+        """
+        compute receives the values of the inputs as keyword arguments.
+        """
+
+        assert name not in self._nodes, f"Noeud déjà défini : {name}"
+        self._nodes[name] = GraphNode(name, inputs, compute)
+        self._stats[name] = {"computed": 0, "reused": 0, "cached": 0, "last_ms": 0.}
+
+    def set_source(
+            self,
+            name: str,
+            value: Any,
+            version: Hashable|None=None) :
+        """
+        Without a version, the source is versioned on a fingerprint of its value.
+        A change of a source that the running prefetch doesn't override cancels it.
+        """
+
+        if version is None :
+            version = get_fingerprint(value)
+
+        if (
+            not self._prefetch is None and
+            name not in self._prefetch.overridden and
+            self.get_version(name) != version
+        ) :
+            self.cancel_prefetch()
+
+        self._sources[name] = ( value, version )
+
+    def get_version(self, name: str) -> Hashable|None :
+
+        if name in self._sources :
+            return self._sources[name][1]
+
+        return self._memo[name].version if name in self._memo else None
+
+    def _get_value(self, name: str) -> Any :
+        return self._sources[name][0] if name in self._sources else self._memo[name].value
+
+    def _get_input_versions(self, node: GraphNode) -> tuple :
+        return tuple(self.get_version(i) for i in node.inputs)
+
+    def is_stale(self, name: str) -> bool :
+        """
+        Only meaningful once the inputs of the node are up to date.
+        """
+
+        return ( name not in self._memo ) or ( self._memo[name].input_versions != self._get_input_versions(self._nodes[name]) )
+
+    def _get_upstream_nodes(self, targets: list[str]) -> list[str] :
+        """
+        Nodes needed by the targets, inputs first.
+        """
+
+        ordered = []
+        visiting = set()
+
+        def _visit(name: str) :
+            if name in ordered or name in self._sources :
+                return
+            if name not in self._nodes :
+                raise KeyError(f"Source ou noeud inconnu : {name}")
+            assert name not in visiting, f"Cycle sur le noeud {name}"
+
+            visiting.add(name)
+            for i in self._nodes[name].inputs :
+                _visit(i)
+            visiting.discard(name)
+            ordered.append(name)
+
+        for target in targets :
+            _visit(target)
+
+        return ordered
+
+    def _run(self, node: GraphNode) -> tuple[Any, float] :
+
+        start = perf_counter()
+        with span(f"graph.{node.name}") :
+            value = node.compute(**{i: self._get_value(i) for i in node.inputs})
+
+        return value, ( perf_counter() - start ) * 1000
+
+    def _get_cached(self, version: str) -> tuple[bool, Any] :
+
+        with self._cache_lock :
+            if version not in self._cache :
+                return False, None
+            self._cache.move_to_end(version)
+            return True, self._cache[version]
+
+    def _put_cached(
+            self,
+            version: str,
+            value: Any) :
+
+        if self._max_cached <= 0 :
+            return
+
+        with self._cache_lock :
+            self._cache[version] = value
+            self._cache.move_to_end(version)
+            while len(self._cache) > self._max_cached :
+                self._cache.popitem(last=False)
+
+    def _store(
+            self,
+            node: GraphNode,
+            input_versions: tuple,
+            value: Any,
+            duration_ms: float) :
+
+        version = get_fingerprint(node.name, input_versions)
+        self._memo[node.name] = _Memo(input_versions, value, version)
+        self._put_cached(version, value)
+        self._stats[node.name]["computed"] += 1
+        self._stats[node.name]["last_ms"] = round(duration_ms, 3)
+
+    def _restore(
+            self,
+            node: GraphNode,
+            input_versions: tuple) -> bool :
+        """
+        Takes the value of the node from the cache, if it was computed for these inputs.
+        """
+
+        version = get_fingerprint(node.name, input_versions)
+        found, value = self._get_cached(version)
+        if found :
+            self._memo[node.name] = _Memo(input_versions, value, version)
+            self._stats[node.name]["cached"] += 1
+
+        return found
+
+    def evaluate(
+            self,
+            targets: list[str],
+            workers: int=1,
+            cancelled: Event|None=None) -> dict[str, Any] :
+        """
+        Values of the targets, recomputing the stale nodes they depend on.
+        When cancelled is set, stops before the next node and returns an empty dict.
+        """
+
+        pending = self._get_upstream_nodes(targets)
+        done: set[str] = set()
+        running: dict[Future, tuple[GraphNode, tuple]] = {}
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cabank_graph") if workers > 1 else None
+
+        try :
+            while pending or running :
+
+                if not cancelled is None and cancelled.is_set() :
+                    return {}
+
+                ready = [
+                    name for name in pending
+                    if all(( i in self._sources ) or ( i in done ) for i in self._nodes[name].inputs)
+                ]
+
+                for name in ready :
+                    pending.remove(name)
+                    node = self._nodes[name]
+
+                    if not self.is_stale(name) :
+                        self._stats[name]["reused"] += 1
+                        done.add(name)
+                        continue
+
+                    input_versions = self._get_input_versions(node)
+                    if self._restore(node, input_versions) :
+                        done.add(name)
+                    elif executor is None :
+                        self._store(node, input_versions, *self._run(node))
+                        done.add(name)
+                    else :
+                        # Threads run in a copy of the context, so that their timing spans are recorded
+                        running[executor.submit(copy_context().run, self._run, node)] = ( node, input_versions )
+
+                if not running :
+                    continue
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished :
+                    node, input_versions = running.pop(future)
+                    self._store(node, input_versions, *future.result())
+                    done.add(node.name)
+
+        finally :
+            if not executor is None :
+                executor.shutdown(wait=True, cancel_futures=True)
+
+        return {t: self._get_value(t) for t in targets}
+
+    def get(self, name: str) -> Any :
+        return self.evaluate([name])[name]
+
+    def _get_shadow(self, sources: dict[str, tuple[Any, Hashable]]) -> "ComputationGraph" :
+        """
+        Graph with the same nodes and cache, the current memo, and some sources given other values.
+        """
+
+        shadow = ComputationGraph(self._max_cached)
+        shadow._nodes = self._nodes
+        shadow._cache = self._cache
+        shadow._cache_lock = self._cache_lock
+        shadow._sources = {**self._sources, **sources}
+        shadow._memo = dict(self._memo)
+        shadow._stats = {name: dict(stats) for name, stats in self._stats.items()}
+
+        return shadow
+
+    def start_prefetch(
+            self,
+            alternatives: list[dict[str, tuple[Any, Hashable]]],
+            targets: list[str]) :
+        """
+        Computes the targets in a background thread for each alternative (sources given other ( value, version )),
+        so that their values are in the cache when these sources are set. The running prefetch is cancelled first.
+        Memory is bounded by max_cached, nothing is prefetched without a cache.
+        """
+
+        self.cancel_prefetch()
+
+        if self._max_cached <= 0 or not alternatives :
+            return
+
+        # Shadows are built here, so that the thread never sees the sources of a later rerun
+        shadows = [self._get_shadow(sources) for sources in alternatives]
+        cancelled = Event()
+
+        def _prefetch() :
+            for shadow in shadows :
+                try :
+                    shadow.evaluate(targets, cancelled=cancelled)
+                except Exception :
+                    # Speculative : the error shows up again if these sources are really set
+                    pass
+
+        thread = Thread(target=_prefetch, name="cabank_prefetch", daemon=True)
+        self._prefetch = _Prefetch(thread, cancelled, set().union(*alternatives))
+        thread.start()
+
+    def cancel_prefetch(self) :
+
+        if not self._prefetch is None :
+            self._prefetch.cancelled.set()
+            self._prefetch = None
+
+    def is_prefetching(self) -> bool :
+        return ( not self._prefetch is None ) and self._prefetch.thread.is_alive()
+
+    def wait_prefetch(self, timeout: float|None=None) :
+
+        if not self._prefetch is None :
+            self._prefetch.thread.join(timeout)
+
+    def describe(self) -> pd.DataFrame :
+        """
+        One row per source and node : inputs, version, and for nodes whether they are stale,
+        how many times they were computed, reused or taken from the cache, and their last computation time.
+        """
+
+        rows = [
+            {"name": name, "kind": "source", "inputs": "", "version": str(version)[:12], "stale": False, "computed": 0, "reused": 0, "cached": 0, "last_ms": 0.}
+            for name, (_, version) in self._sources.items()
+        ]
+
+        for name, node in self._nodes.items() :
+            inputs_known = all(( i in self._sources ) or ( i in self._memo ) for i in node.inputs)
+            rows.append({
+                "name": name,
+                "kind": "node",
+                "inputs": ", ".join(node.inputs),
+                "version": str(self.get_version(name))[:12],
+                "stale": self.is_stale(name) if inputs_known else True,
+                **self._stats[name],
+            })
+
+        return pd.DataFrame(rows)
+
+    def to_dot(self) -> str :
+        """
+        Graphviz description of the graph, stale nodes in orange.
+        """
+
+        lines = ["digraph {", "    rankdir=LR;", "    node [shape=box, style=rounded, fontsize=10];"]
+
+        for name in self._sources :
+            lines.append(f'    "{name}" [shape=ellipse];')
+
+        for row in self.describe().itertuples() :
+            if row.kind == "node" :
+                color = "orange" if row.stale else "black"
+                lines.append(f'    "{row.name}" [color={color}, label="{row.name}\\n{row.computed:.0f} calculs, {row.reused:.0f} réutilisations, {row.cached:.0f} en cache"];')
+
+        for name, node in self._nodes.items() :
+            for i in node.inputs :
+                lines.append(f'    "{i}" -> "{name}";')
+
+        lines.append("}")
+
+        return "\n".join(lines)
+
+# endregion
@@ -1,64 +1,168 @@
-from platformdirs import user_data_dir, user_config_dir
-import importlib.resources as resources
+from __future__ import annotations
 from datetime import (
     datetime,
     time,
 )
 import uuid
+import copy
 import math
+from time import perf_counter
 from dateutil.relativedelta import relativedelta
 import pandas as pd
 from enum import Enum
-import plotly.graph_objects as go
 import streamlit as st
-from typing import Any
+from typing import (
+    Any,
+    Callable,
+    TYPE_CHECKING,
+)
 import os
 import shutil
 import json
-from pathlib import Path
 from cabank.utils import (
-    format_datetime,
-    combine_and_save_csv,
     is_periodic_occurence_ignored,
+    safe_concat,
+    open_file_edition,
+    fill_missing_ids,
+    get_fingerprint,
+    get_ponctuals_filter_mask,
+    compact_frame,
+    expand_frame,
+)
+from cabank.pipeline import (
+    COMPARISON_REAL,
+    ADJUSTMENTS_DATASETS,
+    build_period_graph,
+    get_store_version,
+    get_budgets_version,
+    get_ledger_version,
+    get_adjacent_period_sources,
+    get_user_adjustments,
+    get_transfer_ponctuals,
+    get_low_balance_alert,
+)
+from cabank.graph import ComputationGraph
+from cabank.accounts import (
+    CONSOLIDATED_TOTAL,
+    get_consolidated_balance,
+)
+from cabank.storage import (
+    DATA_PATH,
+    CONFIG_ROOT_PATH,
+    DEFAULT_CONFIG_PATH,
+    MAIN_ACCOUNT,
+    init_app_directories,
+    PERIODICS_COLUMNS,
+    PONCTUALS_COLUMNS,
+    RATES_COLUMNS,
+    HOLIDAYS_COLUMNS,
+    get_empty_frame,
+    SaveConflictError,
     update_category_name,
+    get_user_path,
+    get_user_store,
+)
+from cabank.charts import (
+    FigureCache,
     plot_custom_waterfall,
-    hex_to_rgba,
-    safe_concat,
-    open_file_edition
+    build_daily_balance_figure,
+    build_sankey_figure,
+    build_amount_by_cat_figure,
+    build_provisions_figure,
+    build_consolidated_balance_figure,
+    build_monthly_stats_figure,
+    build_budgets_comparison_figure,
+)
+from cabank.rollup import (
+    ALL_TAGS,
+    SCENARIO_REAL,
+    FLOW_INCOME,
+    FLOW_EXPENSE,
+    get_user_rollup,
 )
-from cabank.balance import (
-    get_real_period,
-    get_budget_period,
-    get_daily_balance,
-    get_offset,
-    build_checkpoint_adjustments,
-    get_provisions,
+from cabank.recurring import (
+    detect_recurring_ponctuals,
+    accept_recurring_proposals,
+)
+from cabank.recurrence import (
+    RULE_EXAMPLES,
+    ON_HOLIDAY_OPTIONS,
+    get_invalid_rules,
+)
+from cabank.search import (
+    get_user_search_index,
+    get_cumulative_balance,
+)
+from cabank.timing import (
+    TimingRun,
+    start_run,
+    finish_run,
+    begin_span,
+    end_span,
+    span,
+)
+from cabank.forecast import (
+    fit_forecast_model,
+    get_forecast_bands,
 )
-from streamlit_calendar import calendar
 
-# region INIT
+# Plotly and streamlit_calendar are only imported by the views that need them
+if TYPE_CHECKING :
+    import plotly.graph_objects as go
+
 
-APP_NAME = "cabank"
-APP_AUTHOR = "ArthurCabon"
+# region SHELL
 
-# region |---| Base directories
+def display_shell() :
+    """
+    Custom streamlit display, painted before any data is loaded.
+    """
 
-DATA_PATH = Path(user_data_dir(APP_NAME, APP_AUTHOR))
-CONFIG_ROOT_PATH = Path(user_config_dir(APP_NAME, APP_AUTHOR))
+    st.set_page_config(layout="wide")
 
-DATA_PATH.mkdir(parents=True, exist_ok=True)
-CONFIG_ROOT_PATH.mkdir(parents=True, exist_ok=True)
+    st.markdown("""
+        <style>
+            [data-testid="stSidebarHeader"] {
+                display: none;
+            }
+        </style>
+    """, unsafe_allow_html=True)
+
+    st.markdown("""
+        <style>
+            [data-testid="stToolbar"] {
+                display: none;
+            }
+        </style>
+    """, unsafe_allow_html=True)
+    
+    st.markdown("""
+        <style>
+            [data-testid="stMainBlockContainer"] {
+                padding-top: 0rem;
+            }
+        </style>
+    """, unsafe_allow_html=True)
+
+    st.markdown("""
+        <style>
+            [data-testid="stSidebar"] {
+                background-color: white;
+            }   
+        </style>
+    """, unsafe_allow_html=True)
+
+if __name__ == '__main__' :
+    display_shell()
 
 # endregion
 
-# region |---| Default config
 
-DEFAULT_CONFIG_PATH = CONFIG_ROOT_PATH / "default.json"
+# region INIT
+
+# region |---| Base directories and default config
 
-if not DEFAULT_CONFIG_PATH.exists():
-    with resources.files("cabank").joinpath("data/default_config.json").open("rb") as src:
-        with DEFAULT_CONFIG_PATH.open("wb") as dst:
-            shutil.copyfileobj(src, dst)
+init_app_directories()
 
 # endregion
 
@@ -73,9 +177,14 @@ ALL_USERS = [
 if "user" not in st.session_state:
     st.session_state.user = ALL_USERS[0] if ALL_USERS else "default"
 
-USER_PATH = DATA_PATH / st.session_state.user
+USER_PATH = get_user_path(st.session_state.user)
 USER_PATH.mkdir(parents=True, exist_ok=True)
 
+# Datasets and computations shared by every session of this user
+USER_STORE = get_user_store(st.session_state.user)
+# Datasets saved by another process (cli, other server) since they were loaded
+USER_STORE.refresh()
+
 if st.session_state.user not in ALL_USERS:
     ALL_USERS.append(st.session_state.user)
 
@@ -94,6 +203,23 @@ with USER_CONFIG_PATH.open("r", encoding="utf-8") as f:
 MONEY_FORMAT = CONFIG.get("money_format", "")
 MONEY_SYMBOL = CONFIG.get("money_symbol", "")
 
+# Concurrency of the offset, real and budget computations (1 worker = serial)
+PIPELINE_WORKERS = CONFIG.get("pipeline_workers", 3)
+PIPELINE_PROCESSES = CONFIG.get("pipeline_processes", False)
+# Graph values kept in memory, for the prefetched previous and next periods (0 = no prefetch)
+PREFETCH_CACHE_NODES = CONFIG.get("prefetch_cache_nodes", 40)
+
+# Stochastic forecast
+FORECAST_PATHS = CONFIG.get("forecast_paths", 10000)
+FORECAST_FIT_MONTHS = CONFIG.get("forecast_fit_months", 12)
+
+# Low balance warning, scanned up to this many months past the end of the period
+LOW_BALANCE_THRESHOLD = CONFIG.get("low_balance_threshold", 0.)
+LOW_BALANCE_HORIZON_MONTHS = CONFIG.get("low_balance_horizon_months", 24)
+
+# Seconds between two checks for saves of other sessions (0 = only on interaction)
+SYNC_INTERVAL_SECONDS = CONFIG.get("sync_interval_seconds", 10)
+
 if "all_categories" not in st.session_state:
     st.session_state.all_categories = CONFIG.get("categories", {})
 
@@ -108,6 +234,16 @@ if "first_day" not in st.session_state:
 
 # endregion
 
+# region |---| Timing
+
+# Hidden debug panel : "debug_timing" in the config, or ?debug=timing in the url
+DEBUG_TIMING = CONFIG.get("debug_timing", False) or st.query_params.get("debug") == "timing"
+TIMING_LOG_PATH = CONFIG_ROOT_PATH / "timings.jsonl"
+
+TIMING_RUN = start_run(st.session_state.user, enabled=DEBUG_TIMING)
+
+# endregion
+
 # region |---| Period
 
 TODAY = datetime.now()
@@ -127,24 +263,96 @@ st.session_state.period_end = st.session_state.period_start + relativedelta(mont
 
 # endregion
 
-# region |---| Checkpoints
+# region |---| Concurrent edition
 
-CHECKPOINTS_PATH = USER_PATH / "checkpoints.csv"
+def has_pending_edits(editor_prefix: str) -> bool :
+    """
+    Unsaved edits in the data editors whose key starts with editor_prefix.
+    """
 
-if CHECKPOINTS_PATH.exists() :
-    FULL_CHECKPOINTS = pd.read_csv(CHECKPOINTS_PATH)
+    return any(
+        str(key).startswith(editor_prefix) and any(state.get(k) for k in ["edited_rows", "added_rows", "deleted_rows"])
+        for key, state in st.session_state.items()
+        if isinstance(state, dict)
+    )
 
-    FULL_CHECKPOINTS["date"] = format_datetime(FULL_CHECKPOINTS["date"])
-    FULL_CHECKPOINTS["net_position"] = FULL_CHECKPOINTS["net_position"].astype(float)
 
-else :
-    columns = {
-        "date": "datetime64[ns]",
-        "net_position": "float64",
-    }
-    FULL_CHECKPOINTS = pd.DataFrame({col: pd.Series(dtype=col_type) for col, col_type in columns.items()})
+def clear_editors(editor_prefix: str) :
+
+    for key in [k for k in st.session_state if str(k).startswith(editor_prefix)] :
+        st.session_state.pop(key, None)
+
+
+def get_session_base(
+        name: str,
+        editor_prefix: str) -> tuple[int, Any] :
+    """
+    Version and content of a dataset that the editors of this session start from. They follow the saved dataset
+    while nothing is pending. Unsaved edits keep their base when another session saves : the editors apply them
+    by row position, and the save merges them by id with the saved rows.
+    """
+
+    bases = st.session_state.setdefault("dataset_bases", {})
+    key = (st.session_state.user, name)
 
-FULL_CHECKPOINTS = FULL_CHECKPOINTS.sort_values("date").reset_index(drop=True)
+    saved = USER_STORE.get(name)
+    version = USER_STORE.get_version(name)
+
+    if key not in bases or ( bases[key][0] != version and not has_pending_edits(editor_prefix) ) :
+        bases[key] = (version, saved)
+
+    return bases[key]
+
+
+def display_outdated_base_warning(
+        name: str,
+        base_version: int) :
+
+    if USER_STORE.get_version(name) != base_version :
+        st.warning("Ces données ont été modifiées dans une autre session : vos modifications y seront fusionnées à la sauvegarde.")
+
+
+def save_edits(
+        save: Callable[[], Any],
+        editor_prefix: str|None=None) :
+    """
+    Saves, then starts the editors over from the saved data. A conflict with another session is shown, the edits are kept.
+    """
+
+    try :
+        save()
+    except SaveConflictError as e :
+        st.error(e)
+        return
+
+    if not editor_prefix is None :
+        clear_editors(editor_prefix)
+
+    st.rerun()
+
+
+@st.fragment(run_every=SYNC_INTERVAL_SECONDS or None)
+def watch_saved_versions(
+        names: list[str],
+        versions: tuple) :
+    """
+    Reruns the app when another session or process saved one of the datasets shown, only those are reloaded.
+    """
+
+    USER_STORE.refresh()
+
+    if get_store_version(USER_STORE, *names) != versions :
+        st.rerun()
+
+# endregion
+
+_load_data_span = begin_span("init.load_data")
+
+# region |---| Checkpoints
+
+CHECKPOINTS_PATH = USER_STORE.get_path("checkpoints.csv")
+FULL_CHECKPOINTS = USER_STORE.get("checkpoints.csv")
+CHECKPOINTS_VERSION = USER_STORE.get_version("checkpoints.csv")
 
 # Infer offset and ref_day
 REF_DAY, REF_BALANCE = None, None
@@ -183,7 +391,7 @@ if not "budget" in st.session_state :
 
 if not st.session_state.budget is None :
 
-    CURRENT_BUDGET_PATH = BUDGETS_PATH / st.session_state.budget
+    CURRENT_BUDGET_PATH = USER_STORE.get_path(f"budgets/{st.session_state.budget}")
     if not CURRENT_BUDGET_PATH.exists() :
         os.mkdir(CURRENT_BUDGET_PATH)
         ALL_BUDGETS.append(st.session_state.budget)
@@ -198,44 +406,19 @@ else :
 
 # region |---|---| Periodics
 
-PERIODICS_PATH = USER_PATH / "periodics.csv"
-if PERIODICS_PATH.exists() :
-    FULL_PERIODICS = pd.read_csv(PERIODICS_PATH)
-
-    # Typing
-    FULL_PERIODICS["category"] = FULL_PERIODICS["category"].astype(str)
-    FULL_PERIODICS["tags"] = FULL_PERIODICS["tags"].astype(str).apply(json.loads)
-    FULL_PERIODICS["description"] = FULL_PERIODICS["description"].fillna("").astype(str)
-    FULL_PERIODICS["amount"] = FULL_PERIODICS["amount"].astype(float)
-    FULL_PERIODICS["first"] = format_datetime(FULL_PERIODICS["first"])
-    FULL_PERIODICS["last"] = format_datetime(FULL_PERIODICS["last"])
-    FULL_PERIODICS["days"] = FULL_PERIODICS["days"].fillna(0).astype(int)
-    FULL_PERIODICS["months"] = FULL_PERIODICS["months"].fillna(0).astype(int)
-    FULL_PERIODICS["id"] = FULL_PERIODICS["id"].fillna(uuid.uuid4()).astype(str)
-
-    periodics_in_period_mask =  (
-        ( format_datetime(FULL_PERIODICS["first"]) < st.session_state.period_end ) &
-        ( format_datetime(FULL_PERIODICS["last"])  >= st.session_state.period_start )
-    )
+FULL_PERIODICS = USER_STORE.get("periodics.csv")
+FULL_PERIODICS_VERSION = USER_STORE.get_version("periodics.csv")
 
-    PERIODICS = FULL_PERIODICS[periodics_in_period_mask].reset_index(drop=True)
-    ISOLATED_PERIODICS = FULL_PERIODICS[~periodics_in_period_mask].reset_index(drop=True)
+# The editor starts from the base of the session, FULL_PERIODICS is the saved dataset
+PERIODICS_BASE_VERSION, BASE_PERIODICS = get_session_base("periodics.csv", "edited_periodics")
 
-else :
-    columns = {
-        "category": "str",
-        "tags": "object",
-        "description": "str", 
-        "amount": "float64", 
-        "first": "datetime64[ns]", 
-        "last": "datetime64[ns]", 
-        "days": "int64", 
-        "months": "int64", 
-        "id": "str"
-    }
-    FULL_PERIODICS = pd.DataFrame({col: pd.Series(dtype=col_type) for col, col_type in columns.items()})
-    PERIODICS = pd.DataFrame({col: pd.Series(dtype=col_type) for col, col_type in columns.items()})
-    ISOLATED_PERIODICS = pd.DataFrame({col: pd.Series(dtype=col_type) for col, col_type in columns.items()})
+periodics_in_period_mask =  (
+    ( BASE_PERIODICS["first"] < st.session_state.period_end ) &
+    ( BASE_PERIODICS["last"]  >= st.session_state.period_start )
+)
+
+PERIODICS = BASE_PERIODICS[periodics_in_period_mask].reset_index(drop=True)
+ISOLATED_PERIODICS = BASE_PERIODICS[~periodics_in_period_mask].reset_index(drop=True)
 
 if "periodics" not in st.session_state :
     st.session_state.periodics = PERIODICS
@@ -244,54 +427,31 @@ if "periodics" not in st.session_state :
 
 # region |---|---| Ignore periodic
 
-PERIODIC_OCCURENCES_MODIFICATIONS_PATH = USER_PATH / "periodic_occurences_modifications.json"
-if PERIODIC_OCCURENCES_MODIFICATIONS_PATH.exists() :
+PERIODIC_OCCURENCES_MODIFICATIONS = USER_STORE.get("periodic_occurences_modifications.json")
 
-    with open(PERIODIC_OCCURENCES_MODIFICATIONS_PATH, "r") as f :
-        PERIODIC_OCCURENCES_MODIFICATIONS = json.load(f)
-    
-else :
-    PERIODIC_OCCURENCES_MODIFICATIONS = {}
+# Modified in place by the calendar, so each session works on its own copy, refreshed when any session saves
+MODIFICATIONS_VERSION = (st.session_state.user, USER_STORE.get_version("periodic_occurences_modifications.json"))
 
-if "modify_periodic_occurences" not in st.session_state :
-    st.session_state.modify_periodic_occurences = PERIODIC_OCCURENCES_MODIFICATIONS
+if st.session_state.get("modify_periodic_occurences_version") != MODIFICATIONS_VERSION :
+    st.session_state.modify_periodic_occurences = copy.deepcopy(PERIODIC_OCCURENCES_MODIFICATIONS)
+    st.session_state.modify_periodic_occurences_base = PERIODIC_OCCURENCES_MODIFICATIONS
+    st.session_state.modify_periodic_occurences_version = MODIFICATIONS_VERSION
 
 # endregion
 
 # region |---|---| Ponctuals
 
-PONCTUALS_PATH = USER_PATH / "ponctuals.csv"
-if PONCTUALS_PATH.exists() :
-    FULL_PONCTUALS = pd.read_csv(PONCTUALS_PATH)
-
-    # Typing
-    FULL_PONCTUALS["category"] = FULL_PONCTUALS["category"].astype(str)
-    FULL_PONCTUALS["tags"] = FULL_PONCTUALS["tags"].astype(str).apply(json.loads)
-    FULL_PONCTUALS["description"] = FULL_PONCTUALS["description"].fillna("").astype(str)
-    FULL_PONCTUALS["amount"] = FULL_PONCTUALS["amount"].astype(float)
-    FULL_PONCTUALS["date"] = format_datetime(FULL_PONCTUALS["date"])
-    FULL_PONCTUALS["id"] = FULL_PONCTUALS["id"].astype(str)
-
-    ponctuals_in_period_mask =  (
-        ( format_datetime(FULL_PONCTUALS["date"]) >= st.session_state.period_start ) &
-        ( format_datetime(FULL_PONCTUALS["date"]) < st.session_state.period_end )
-    )
+FULL_PONCTUALS = USER_STORE.get("ponctuals.csv")
+FULL_PONCTUALS_VERSION = USER_STORE.get_version("ponctuals.csv")
 
-    PONCTUALS = FULL_PONCTUALS[ponctuals_in_period_mask].reset_index(drop=True) 
-    ISOLATED_PONCTUALS = FULL_PONCTUALS[~ponctuals_in_period_mask].reset_index(drop=True) 
+PONCTUALS_BASE_VERSION, BASE_PONCTUALS = get_session_base("ponctuals.csv", "edited_ponctuals_")
 
-else :
-    columns = {
-        "date": "datetime64[ns]", 
-        "category": "str",
-        "tags": "object",
-        "description": "str", 
-        "amount": "float64", 
-        "id": "str"
-    }
-    FULL_PONCTUALS = pd.DataFrame({col: pd.Series(dtype=col_type) for col, col_type in columns.items()})
-    PONCTUALS = pd.DataFrame({col: pd.Series(dtype=col_type) for col, col_type in columns.items()})
-    ISOLATED_PONCTUALS = pd.DataFrame({col: pd.Series(dtype=col_type) for col, col_type in columns.items()})
+ponctuals_in_period_mask =  (
+    ( BASE_PONCTUALS["date"] >= st.session_state.period_start ) &
+    ( BASE_PONCTUALS["date"] < st.session_state.period_end )
+)
+
+PONCTUALS = BASE_PONCTUALS[ponctuals_in_period_mask].reset_index(drop=True) 
 
 if "ponctuals" not in st.session_state :
     st.session_state.ponctuals = PONCTUALS
@@ -302,23 +462,11 @@ if "ponctuals" not in st.session_state :
 
 # region |---|---|---| Periodics
 
-BUDGET_PERIODICS = pd.DataFrame(columns=["category", "tags", "description", "amount", "first", "last", "days", "months", "id"])
+BUDGET_PERIODICS = get_empty_frame(PERIODICS_COLUMNS)
 
 if not CURRENT_BUDGET_PATH is None :
-    BUDGET_PERIODICS_PATH = CURRENT_BUDGET_PATH / "periodics.csv"
-    if BUDGET_PERIODICS_PATH.exists() :
-        BUDGET_PERIODICS = pd.read_csv(BUDGET_PERIODICS_PATH)
-
-# Typing
-BUDGET_PERIODICS["category"] = BUDGET_PERIODICS["category"].astype(str)
-BUDGET_PERIODICS["tags"] = BUDGET_PERIODICS["tags"].astype(str).apply(json.loads)
-BUDGET_PERIODICS["description"] = BUDGET_PERIODICS["description"].fillna("").astype(str)
-BUDGET_PERIODICS["amount"] = BUDGET_PERIODICS["amount"].astype(float)
-BUDGET_PERIODICS["first"] = format_datetime(BUDGET_PERIODICS["first"])
-BUDGET_PERIODICS["last"] = format_datetime(BUDGET_PERIODICS["last"])
-BUDGET_PERIODICS["days"] = BUDGET_PERIODICS["days"].fillna(0).astype(int)
-BUDGET_PERIODICS["months"] = BUDGET_PERIODICS["months"].fillna(0).astype(int)
-BUDGET_PERIODICS["id"] = BUDGET_PERIODICS["id"].astype(str)
+    BUDGET_PERIODICS_NAME = f"budgets/{st.session_state.budget}/periodics.csv"
+    BUDGET_PERIODICS_BASE_VERSION, BUDGET_PERIODICS = get_session_base(BUDGET_PERIODICS_NAME, "edited_budget_periodics")
 
 if "budget_periodics" not in st.session_state :
     st.session_state.budget_periodics = BUDGET_PERIODICS
@@ -327,19 +475,11 @@ if "budget_periodics" not in st.session_state :
 
 # region |---|---|---| Ponctuals
 
-BUDGET_PONCTUALS = pd.DataFrame(columns=["date", "category", "tags", "description", "amount", "id"])
+BUDGET_PONCTUALS = get_empty_frame(PONCTUALS_COLUMNS)
+
 if not CURRENT_BUDGET_PATH is None :
-    BUDGET_PONCTUALS_PATH = CURRENT_BUDGET_PATH / "ponctuals.csv"
-    if BUDGET_PONCTUALS_PATH.exists() :
-        BUDGET_PONCTUALS = pd.read_csv(BUDGET_PONCTUALS_PATH)
-
-# Typing
-BUDGET_PONCTUALS["category"] = BUDGET_PONCTUALS["category"].astype(str)
-BUDGET_PONCTUALS["tags"] = BUDGET_PONCTUALS["tags"].astype(str).apply(json.loads)
-BUDGET_PONCTUALS["description"] = BUDGET_PONCTUALS["description"].fillna("").astype(str)
-BUDGET_PONCTUALS["amount"] = BUDGET_PONCTUALS["amount"].astype(float)
-BUDGET_PONCTUALS["date"] = format_datetime(BUDGET_PONCTUALS["date"])
-BUDGET_PONCTUALS["id"] = BUDGET_PONCTUALS["id"].astype(str)
+    BUDGET_PONCTUALS_NAME = f"budgets/{st.session_state.budget}/ponctuals.csv"
+    BUDGET_PONCTUALS_BASE_VERSION, BUDGET_PONCTUALS = get_session_base(BUDGET_PONCTUALS_NAME, "edited_budget_ponctuals")
 
 if "budget_ponctuals" not in st.session_state :
     st.session_state.budget_ponctuals = BUDGET_PONCTUALS
@@ -348,6 +488,26 @@ if "budget_ponctuals" not in st.session_state :
 
 # endregion
 
+# region |---|---| Exchange rates
+
+RATES_PATH = USER_STORE.get_path("rates.csv")
+RATES = USER_STORE.get("rates.csv")
+
+# Empty for the display currency, then every currency with rates or already used
+CURRENCIES = [""] + sorted(
+    set(RATES["currency"]) |
+    { c for df in [FULL_PERIODICS, FULL_PONCTUALS, BUDGET_PERIODICS, BUDGET_PONCTUALS] for c in df["currency"].dropna().astype(str) if c != "" }
+)
+
+# endregion
+
+# region |---|---| Holidays
+
+HOLIDAYS_PATH = USER_STORE.get_path("holidays.csv")
+HOLIDAYS = USER_STORE.get("holidays.csv")
+
+# endregion
+
 # region |---|---| Tags
 
 # TODO -> BUG
@@ -370,14 +530,18 @@ st.session_state.all_tags = []
 
 # endregion
 
+end_span(_load_data_span)
+
 # region |---| Apply checkpoints
-ADJUSTMENTS = build_checkpoint_adjustments(
-    checkpoints=st.session_state.checkpoints,
-    periodics=FULL_PERIODICS,
-    ponctuals=FULL_PONCTUALS,
-    modify_periodic_occurences=st.session_state.modify_periodic_occurences,
+_adjustments_span = begin_span("init.adjustments")
+# Persisted with the fingerprint of each checkpoint interval, only changed intervals are recomputed
+# Transfers with the other accounts are not editable here, so they come along with the adjustments
+ADJUSTMENTS = safe_concat(
+    get_user_adjustments(USER_STORE),
+    get_transfer_ponctuals(USER_STORE.get("transfers.csv"), MAIN_ACCOUNT),
 )
 st.session_state.adjustments = ADJUSTMENTS
+end_span(_adjustments_span)
 # endregion
 
 # region |---| Calendars tweaks
@@ -391,6 +555,26 @@ if "calendar_events" not in st.session_state :
 
 # endregion
 
+# region |---| Figures cache
+
+FIGURE_CACHE_SIZE = 32
+
+if "figure_cache" not in st.session_state :
+    st.session_state.figure_cache = FigureCache(max_size=FIGURE_CACHE_SIZE)
+
+def get_cached_figure(
+        build: Callable[..., go.Figure],
+        **inputs: Any) -> go.Figure :
+    """
+    The figure is only rebuilt when the fingerprint of its inputs changes.
+    """
+
+    key = get_fingerprint(build.__name__, list(inputs), *inputs.values())
+
+    return st.session_state.figure_cache.get_or_build(key, lambda: build(**inputs))
+
+# endregion
+
 # endregion
 
 
@@ -415,8 +599,13 @@ def display_settings() :
     )
 
     if st.session_state.user != user_input :
-        st.session_state.user = user_input
-        st.rerun()
+        try :
+            get_user_path(user_input)
+        except ValueError as e :
+            st.error(e)
+        else :
+            st.session_state.user = user_input
+            st.rerun()
      
 # endregion
 
@@ -447,6 +636,16 @@ def display_settings() :
         on_change=_update_period,
     )
 
+    # Archived years left the live files : their rows and balances aren't computed anymore
+    archive_years = USER_STORE.get_archive_years()
+    if archive_years and st.session_state.period_start < datetime(archive_years[-1] + 1, 1, 1) :
+        st.warning(
+            f"Les années jusqu'à {archive_years[-1]} sont archivées : la période n'en contient plus les dépenses "
+            f"et ses soldes avant le 01/01/{archive_years[-1] + 1} sont faux. "
+            f"Leurs totaux sont dans les résumés d'archive (cabank archive --list).",
+            icon="⚠️",
+        )
+
 # endregion
 
 # endregion
@@ -477,12 +676,18 @@ def display_checkpoint_form() :
         )
 
         if ref_submit_button :
-            st.session_state.checkpoints.loc[len(st.session_state.checkpoints)] = {
+            new_checkpoint = pd.DataFrame([{
                 "date": pd.to_datetime(TODAY).normalize(), 
-                "net_position": f"{acount_balance_input - credit_balance_input:.2f}"
-            }
-            st.session_state.checkpoints.to_csv(CHECKPOINTS_PATH, index=False)
-            st.rerun()
+                "net_position": round(acount_balance_input - credit_balance_input, 2)
+            }])
+            # FULL_CHECKPOINTS is shared between sessions, never append in place
+            save_edits(lambda: USER_STORE.save_csv(
+                "checkpoints.csv",
+                safe_concat(FULL_CHECKPOINTS, new_checkpoint),
+                base_version=CHECKPOINTS_VERSION,
+                base_df=FULL_CHECKPOINTS,
+                key="date",
+            ))
 
 # endregion
 
@@ -506,13 +711,18 @@ def display_config() :
             if old_name != new_name
         }
         for c_id, (old_name, new_name) in cat_name_modifications.items() :
-            st.session_state.categories_id[c_id] = new_name
+            try :
+                update_category_name(
+                    store=USER_STORE,
+                    old_name=old_name,
+                    new_name=new_name,
+                )
+            except SaveConflictError as e :
+                # The datasets already saved keep the new name, applying again renames the others
+                st.error(e)
+                return
             
-            update_category_name(
-                old_name=old_name,
-                new_name=new_name,
-                user_folder=USER_PATH
-            )
+            st.session_state.categories_id[c_id] = new_name
 
         # New
         for c_id, (cat, _) in new_categories.items() :
@@ -617,7 +827,8 @@ def display_config() :
 
 @st.fragment
 def display_calendar(period: pd.DataFrame) :
-    
+    from streamlit_calendar import calendar
+
 # region |---|---| Pop-up
 
     @st.dialog("Détails de la dépense")
@@ -633,7 +844,7 @@ def display_calendar(period: pd.DataFrame) :
         st.write(" ".join(f"#{t}" for t in tags))
 
         # Periodic => Possibility to ignore/modify
-        if ( p_id := expense["periodic_id"] ) is not None :
+        if not pd.isna(p_id := expense["periodic_id"]) :
             
             # Display periodic details
             periodic_search = st.session_state.periodics[st.session_state.periodics["id"] == p_id]
@@ -684,11 +895,21 @@ def display_calendar(period: pd.DataFrame) :
                         if is_periodic_occurence_ignored(date, p_id, st.session_state.modify_periodic_occurences) :
                             st.session_state.modify_periodic_occurences[p_id].pop(date)
                     
-                    with open(PERIODIC_OCCURENCES_MODIFICATIONS_PATH, "w") as f :
-                        json.dump(st.session_state.modify_periodic_occurences, f, indent=4)
-
-                    st.session_state.calendar_state += 1
-                    st.rerun()
+                    try :
+                        USER_STORE.save_json(
+                            "periodic_occurences_modifications.json",
+                            st.session_state.modify_periodic_occurences,
+                            changed_range=(expense["date"], expense["date"] + relativedelta(days=1)),
+                            base_version=st.session_state.modify_periodic_occurences_version[1],
+                            base_obj=st.session_state.modify_periodic_occurences_base,
+                        )
+                    except SaveConflictError as e :
+                        # The next run starts over from the saved modifications
+                        st.session_state.pop("modify_periodic_occurences_version", None)
+                        st.error(e)
+                    else :
+                        st.session_state.calendar_state += 1
+                        st.rerun()
 
         else :
             if st.button("Fermer", width="stretch") :
@@ -725,7 +946,7 @@ def display_calendar(period: pd.DataFrame) :
             "color": bg_color,
             "borderColor": st.session_state.all_categories.get(row["category"], "white"),
             "absolute_amount": abs(row["amount"]),
-            "display": "list-item" if row["periodic_id"] is None else "block" 
+            "display": "list-item" if pd.isna(row["periodic_id"]) else "block" 
         })
     
     if events != st.session_state.calendar_events :
@@ -777,18 +998,159 @@ def display_calendar(period: pd.DataFrame) :
 
 # region |---|---| Ponctuals
 
+PONCTUALS_PAGE_SIZES = [50, 100, 250, 500]
+
+# Edits of the pages and filters left without saving, by id : an editor only keeps the edits of its own rows, by position
+PONCTUALS_PENDING_KEY = "edited_ponctuals__pending"
+PONCTUALS_LAST_EDITOR_KEY = "edited_ponctuals__last"
+
+
+def get_empty_edits() -> dict[str, Any] :
+    return {"edited_rows": {}, "added_rows": [], "deleted_rows": []}
+
+
+def fold_editor_edits(
+        pending: dict[str, Any],
+        ids: list[str],
+        state: dict[str, Any]) -> dict[str, Any] :
+    """
+    Edits of a data editor, by position of its rows, added to the pending edits by id.
+    """
+
+    pending = copy.deepcopy(pending)
+
+    # Added rows first : the later edits and deletions of a folded row refer to its id
+    pending["added_rows"] += [{**row, "id": str(uuid.uuid4())} for row in state.get("added_rows", [])]
+
+    for position, changes in state.get("edited_rows", {}).items() :
+        pending["edited_rows"].setdefault(ids[int(position)], {}).update(changes)
+
+    pending["deleted_rows"] += [ids[int(position)] for position in state.get("deleted_rows", [])]
+
+    return pending
+
+
+def apply_pending_edits(
+        ponctuals: pd.DataFrame,
+        pending: dict[str, Any]) -> pd.DataFrame :
+
+    if not any(pending.values()) :
+        return ponctuals
+
+    parse = lambda col, value: pd.to_datetime(value) if col == "date" else value
+
+    added = pd.DataFrame([{col: parse(col, value) for col, value in row.items()} for row in pending["added_rows"]])
+    edited = safe_concat(expand_frame(ponctuals), added).reset_index(drop=True)
+
+    positions = pd.Index(edited["id"])
+    for row_id, changes in pending["edited_rows"].items() :
+        if row_id in positions :
+            for col, value in changes.items() :
+                edited.at[positions.get_loc(row_id), col] = parse(col, value)
+
+    edited = edited[~edited["id"].isin(pending["deleted_rows"])]
+    edited["tags"] = edited["tags"].apply(lambda x : x if isinstance(x, list) else [])
+
+    return compact_frame(edited.reset_index(drop=True))
+
 def display_real_ponctuals_editor() :
 
     st.subheader("Dépenses ponctuelles")
 
-    ponctuals_ids = PONCTUALS["id"]
-    ponctuals_to_edit = PONCTUALS[["date", "category", "tags", "description", "amount"]]
+# region |---|---|---| Filters
+
+    with st.expander("Filtres") :
+
+        col_filters = st.columns([2, 2, 2, 1, 1], vertical_alignment="bottom")
+
+        # No key on purpose : the widgets are reset when the period changes
+        input_dates = col_filters[0].date_input(
+            "Dates",
+            format="DD/MM/YYYY",
+            value=(st.session_state.period_start, st.session_state.period_end - relativedelta(days=1)),
+            min_value=st.session_state.period_start,
+            max_value=st.session_state.period_end - relativedelta(days=1),
+        )
+        input_categories = col_filters[1].multiselect(
+            "Catégories",
+            options=st.session_state.all_categories.keys(),
+        )
+        input_search = col_filters[2].text_input("Recherche")
+        input_amount_min = col_filters[3].number_input("Montant min", value=None, format="%.2f")
+        input_amount_max = col_filters[4].number_input("Montant max", value=None, format="%.2f")
+
+    # The end date is missing while the user is picking the range
+    date_min = input_dates[0] if len(input_dates) > 0 else None
+    date_max = input_dates[1] if len(input_dates) > 1 else None
+
+    def _get_period_and_filtered(pending: dict[str, Any]) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame] :
+
+        draft = apply_pending_edits(BASE_PONCTUALS, pending)
+        in_period = ( draft["date"] >= st.session_state.period_start ) & ( draft["date"] < st.session_state.period_end )
+        period_ponctuals = draft[in_period].reset_index(drop=True)
+
+        filter_mask = get_ponctuals_filter_mask(
+            ponctuals=period_ponctuals,
+            date_min=date_min,
+            date_max=date_max,
+            categories=input_categories,
+            search=input_search,
+            amount_min=input_amount_min,
+            amount_max=input_amount_max,
+        )
+
+        return draft[~in_period].reset_index(drop=True), period_ponctuals, period_ponctuals[filter_mask]
+
+    pending = st.session_state.get(PONCTUALS_PENDING_KEY, get_empty_edits())
+    isolated_ponctuals, period_ponctuals, filtered_ponctuals = _get_period_and_filtered(pending)
+
+# endregion
+
+# region |---|---|---| Pagination
+
+    col_pagination = st.columns([1, 1, 4], vertical_alignment="bottom")
+
+    page_size = col_pagination[0].selectbox(
+        "Lignes par page",
+        options=PONCTUALS_PAGE_SIZES,
+        index=1,
+        key="ponctuals_page_size",
+    )
+    number_of_pages = max(1, math.ceil(len(filtered_ponctuals) / page_size))
+    page = col_pagination[1].number_input(
+        "Page",
+        min_value=1,
+        max_value=number_of_pages,
+        step=1,
+    )
+    page_key = "|".join(str(x) for x in [date_min, date_max, input_categories, input_search, input_amount_min, input_amount_max, page_size, page])
+    editor_key = f"edited_ponctuals_{page_key}"
+
+    # Another page or filter : the edits of the previous editor are kept by id, and shown again in any editor of their rows
+    last_editor = st.session_state.get(PONCTUALS_LAST_EDITOR_KEY)
+    if ( not last_editor is None ) and last_editor["key"] != editor_key :
+        pending = fold_editor_edits(pending, last_editor["ids"], last_editor["state"])
+        st.session_state[PONCTUALS_PENDING_KEY] = pending
+        st.session_state.pop(PONCTUALS_LAST_EDITOR_KEY)
+        isolated_ponctuals, period_ponctuals, filtered_ponctuals = _get_period_and_filtered(pending)
+
+    col_pagination[2].caption(f"{len(filtered_ponctuals)} dépenses filtrées sur {len(period_ponctuals)}")
+
+    page_ponctuals = filtered_ponctuals.iloc[(page - 1) * page_size : page * page_size]
+
+    # Only the page goes to the editor, other rows are kept as they are
+    hidden_ponctuals = period_ponctuals[~period_ponctuals.index.isin(page_ponctuals.index)]
+
+# endregion
+
+    ponctuals_ids = page_ponctuals["id"].reset_index(drop=True)
+    ponctuals_to_edit = expand_frame(page_ponctuals[["date", "category", "tags", "description", "amount", "currency"]].reset_index(drop=True))
 
     edited = st.data_editor(
         ponctuals_to_edit,
         num_rows="dynamic",
         width="stretch",
-        key="edited_ponctuals",
+        key=editor_key,
         column_config={
             "date": st.column_config.DateColumn(
                 "Date", 
@@ -819,38 +1181,65 @@ def display_real_ponctuals_editor() :
                 required=True,
                 format=MONEY_FORMAT,
             ),
+            "currency": st.column_config.SelectboxColumn(
+                "Devise", 
+                options=CURRENCIES, 
+                width="small",
+                required=False,
+            ),
         },
         hide_index=True,
     )
 
     edited["tags"] = edited["tags"].apply(lambda x : x if isinstance(x, list) else [])
 
-    edited_with_id = edited.join(ponctuals_ids, how="left")
-    for i, row in edited_with_id.iterrows() :
-        if pd.isna(row["id"]) :
-            edited_with_id.loc[i, "id"] = str(uuid.uuid4())
+    edited_with_id = compact_frame(fill_missing_ids(edited.join(ponctuals_ids, how="left")))
 
-    st.session_state.ponctuals = edited_with_id
+    st.session_state.ponctuals = safe_concat(edited_with_id, hidden_ponctuals)
+    st.session_state[PONCTUALS_LAST_EDITOR_KEY] = {
+        "key": editor_key,
+        "ids": ponctuals_ids.tolist(),
+        "state": copy.deepcopy(dict(st.session_state.get(editor_key, get_empty_edits()))),
+    }
     
+    display_outdated_base_warning("ponctuals.csv", PONCTUALS_BASE_VERSION)
+
     button_save_ponctuals = st.button("Sauvegarder", key="button_save_ponctuals")
     if button_save_ponctuals :
-        combine_and_save_csv(
-            modified_df=edited_with_id, 
-            isolated_df=ISOLATED_PONCTUALS, 
-            path=PONCTUALS_PATH
-        )
-        st.rerun()
+        save_edits(lambda: USER_STORE.save_csv(
+            "ponctuals.csv",
+            modified_df=st.session_state.ponctuals, 
+            isolated_df=isolated_ponctuals, 
+            changed_range=(st.session_state.period_start, st.session_state.period_end),
+            base_version=PONCTUALS_BASE_VERSION,
+            base_df=BASE_PONCTUALS,
+        ), "edited_ponctuals_")
 
 # endregion
 
 # region |---|---| Periodics
 
+def ignore_invalid_rules(edited: pd.DataFrame) -> pd.DataFrame :
+    """
+    Invalid recurrence rules are reported and emptied, the periodic falls back to its days and months.
+    """
+
+    edited["rule"] = edited["rule"].fillna("").astype(str).str.strip()
+    edited["on_holiday"] = edited["on_holiday"].fillna("").astype(str)
+
+    if invalid := get_invalid_rules(edited["rule"]) :
+        st.error(f"Règles de récurrence invalides, ignorées : {', '.join(invalid)}. Exemples : {' ; '.join(RULE_EXAMPLES)}")
+        edited["rule"] = edited["rule"].where(~edited["rule"].isin(invalid), "")
+
+    return edited
+
+
 def display_real_periodics_editor() :
 
     st.subheader("Virements/Prélèvements périodiques")
 
     periodics_ids = PERIODICS["id"]
-    periodics_to_edit = PERIODICS[["category", "tags", "description", "amount", "first", "last", "days", "months"]]
+    periodics_to_edit = expand_frame(PERIODICS[["category", "tags", "description", "amount", "currency", "first", "last", "days", "months", "rule", "on_holiday"]])
 
     edited = st.data_editor(
         periodics_to_edit,
@@ -881,6 +1270,12 @@ def display_real_periodics_editor() :
                 required=True,
                 format=MONEY_FORMAT,
             ),
+            "currency": st.column_config.SelectboxColumn(
+                "Devise", 
+                options=CURRENCIES, 
+                width="small",
+                required=False,
+            ),
             "first": st.column_config.DateColumn(
                 "Premier paiement", 
                 format="DD-MM-YYYY", 
@@ -910,31 +1305,124 @@ def display_real_periodics_editor() :
                 required=False,
                 step=1,
             ),
+            "rule": st.column_config.TextColumn(
+                "Règle", 
+                width="small",
+                required=False,
+                help="Remplace les jours et mois. Exemples : " + " ; ".join(RULE_EXAMPLES),
+            ),
+            "on_holiday": st.column_config.SelectboxColumn(
+                "Jour non ouvré", 
+                options=ON_HOLIDAY_OPTIONS, 
+                width="small",
+                required=False,
+                help="skip : pas de paiement, next / previous : jour ouvré suivant / précédent",
+            ),
         },
         hide_index=True,
     )
 
     edited["tags"] = edited["tags"].apply(lambda x : x if isinstance(x, list) else [])
+    edited = ignore_invalid_rules(edited)
 
-    edited_with_id = edited.join(periodics_ids, how="left")
-    for i, row in edited_with_id.iterrows() :
-        if pd.isna(row["id"]) :
-            edited_with_id.loc[i, "id"] = str(uuid.uuid4())
+    edited_with_id = compact_frame(fill_missing_ids(edited.join(periodics_ids, how="left")))
     
     st.session_state.periodics = edited_with_id
     
+    display_outdated_base_warning("periodics.csv", PERIODICS_BASE_VERSION)
+
     button_save_periodics = st.button("Sauvegarder", key="button_save_periodics")
     if button_save_periodics :
-        combine_and_save_csv(
+        save_edits(lambda: USER_STORE.save_csv(
+            "periodics.csv",
             modified_df=edited_with_id, 
             isolated_df=ISOLATED_PERIODICS, 
-            path=PERIODICS_PATH
-        )
-        st.rerun()
+            base_version=PERIODICS_BASE_VERSION,
+            base_df=BASE_PERIODICS,
+        ), "edited_periodics")
 
 
 # endregion    
 
+# region |---|---| Recurring
+
+def display_recurring_proposals() :
+
+    # Only depends on saved data, so it is shared by every session of the user
+    proposals = USER_STORE.get_computed(
+        ("recurring_proposals", None),
+        lambda: detect_recurring_ponctuals(FULL_PONCTUALS),
+    )
+
+    if len(proposals) == 0 :
+        st.caption("Aucune dépense ponctuelle récurrente détectée.")
+        return
+
+    st.caption(f"{len(proposals)} dépenses ponctuelles récurrentes détectées, qui remplacent {proposals['count'].sum()} dépenses ponctuelles.")
+
+    selected = st.data_editor(
+        proposals[["category", "tags", "description", "amount", "first", "last", "days", "months", "count"]].assign(accept=False),
+        width="stretch",
+        key="edited_recurring_proposals",
+        disabled=["category", "tags", "description", "amount", "first", "last", "days", "months", "count"],
+        column_config={
+            "accept": st.column_config.CheckboxColumn("Accepter", width="small"),
+            "category": st.column_config.TextColumn("Catégorie", width="small"),
+            "tags": st.column_config.ListColumn("Tags", width="small"),
+            "description": st.column_config.TextColumn("Description", width="medium"),
+            "amount": st.column_config.NumberColumn("Montant", width="small", format=MONEY_FORMAT),
+            "first": st.column_config.DateColumn("Premier paiement", format="DD-MM-YYYY", width="small"),
+            "last": st.column_config.DateColumn("Dernier paiement", format="DD-MM-YYYY", width="small"),
+            "days": st.column_config.NumberColumn("Jours", width="small"),
+            "months": st.column_config.NumberColumn("Mois", width="small"),
+            "count": st.column_config.NumberColumn("Ponctuelles", width="small"),
+        },
+        hide_index=True,
+    )
+
+    accepted = proposals[selected["accept"].to_numpy(dtype=bool)]
+
+    if st.button(f"Remplacer par {len(accepted)} périodiques", key="button_accept_recurring", disabled=len(accepted) == 0) :
+
+        new_periodics, new_ponctuals = accept_recurring_proposals(
+            periodics=FULL_PERIODICS,
+            ponctuals=FULL_PONCTUALS,
+            proposals=accepted,
+        )
+        def save() :
+
+            # Two saves : the matched ponctuals leave first, and are put back if the periodics can't be saved,
+            # so that a failure leaves both files as they were
+            ponctuals_version = USER_STORE.save_csv(
+                "ponctuals.csv",
+                modified_df=new_ponctuals,
+                base_version=FULL_PONCTUALS_VERSION,
+                base_df=FULL_PONCTUALS,
+            )
+            try :
+                USER_STORE.save_csv(
+                    "periodics.csv",
+                    modified_df=new_periodics,
+                    base_version=FULL_PERIODICS_VERSION,
+                    base_df=FULL_PERIODICS,
+                )
+            except Exception :
+                USER_STORE.save_csv(
+                    "ponctuals.csv",
+                    modified_df=FULL_PONCTUALS,
+                    base_version=ponctuals_version,
+                    base_df=new_ponctuals,
+                )
+                raise
+
+            # The editors hold rows that may not exist anymore
+            for key in ["periodics", "ponctuals", "edited_periodics", "edited_recurring_proposals"] :
+                st.session_state.pop(key, None)
+
+        save_edits(save, "edited_ponctuals_")
+
+# endregion
+
 # endregion
 
 # region |---| Budget
@@ -966,7 +1454,7 @@ def display_budget_ponctuals_editor() :
     st.subheader("Dépenses ponctuelles budgettisées")
 
     budget_ponctuals_ids = BUDGET_PONCTUALS["id"]
-    budget_ponctuals_to_edit = BUDGET_PONCTUALS[["date", "category", "tags", "description", "amount"]]
+    budget_ponctuals_to_edit = expand_frame(BUDGET_PONCTUALS[["date", "category", "tags", "description", "amount", "currency"]])
 
     edited = st.data_editor(
         budget_ponctuals_to_edit,
@@ -1003,26 +1491,32 @@ def display_budget_ponctuals_editor() :
                 required=True,
                 format=MONEY_FORMAT,
             ),
+            "currency": st.column_config.SelectboxColumn(
+                "Devise", 
+                options=CURRENCIES, 
+                width="small",
+                required=False,
+            ),
         },
         hide_index=True,
     )
 
     edited["tags"] = edited["tags"].apply(lambda x : x if isinstance(x, list) else [])
 
-    edited_with_id = edited.join(budget_ponctuals_ids, how="left")
-    for i, row in edited_with_id.iterrows() :
-        if pd.isna(row["id"]) :
-            edited_with_id.loc[i, "id"] = str(uuid.uuid4())
+    edited_with_id = compact_frame(fill_missing_ids(edited.join(budget_ponctuals_ids, how="left")))
 
     st.session_state.budget_ponctuals = edited_with_id
 
+    display_outdated_base_warning(BUDGET_PONCTUALS_NAME, BUDGET_PONCTUALS_BASE_VERSION)
+
     button_save_budget_ponctuals = st.button("Sauvegarder", key="button_save_budget_ponctuals")
     if button_save_budget_ponctuals :
-        combine_and_save_csv(
+        save_edits(lambda: USER_STORE.save_csv(
+            BUDGET_PONCTUALS_NAME,
             modified_df=edited_with_id, 
-            path=BUDGET_PONCTUALS_PATH,
-        )
-        st.rerun()
+            base_version=BUDGET_PONCTUALS_BASE_VERSION,
+            base_df=BUDGET_PONCTUALS,
+        ), "edited_budget_ponctuals")
 
 # endregion
 
@@ -1033,7 +1527,7 @@ def display_budget_periodics_editor() :
     st.subheader("Budget")
 
     budget_periodics_ids = BUDGET_PERIODICS["id"]
-    budget_periodics_to_edit = BUDGET_PERIODICS[["category", "tags", "description", "amount", "first", "last", "days", "months"]]
+    budget_periodics_to_edit = expand_frame(BUDGET_PERIODICS[["category", "tags", "description", "amount", "currency", "first", "last", "days", "months", "rule", "on_holiday"]])
 
     edited = st.data_editor(
         budget_periodics_to_edit,
@@ -1064,6 +1558,12 @@ def display_budget_periodics_editor() :
                 required=True,
                 format=MONEY_FORMAT,
             ),
+            "currency": st.column_config.SelectboxColumn(
+                "Devise", 
+                options=CURRENCIES, 
+                width="small",
+                required=False,
+            ),
             "first": st.column_config.DateColumn(
                 "Premier paiement", 
                 format="DD-MM-YYYY", 
@@ -1093,30 +1593,148 @@ def display_budget_periodics_editor() :
                 required=False,
                 step=1,
             ),
+            "rule": st.column_config.TextColumn(
+                "Règle", 
+                width="small",
+                required=False,
+                help="Remplace les jours et mois. Exemples : " + " ; ".join(RULE_EXAMPLES),
+            ),
+            "on_holiday": st.column_config.SelectboxColumn(
+                "Jour non ouvré", 
+                options=ON_HOLIDAY_OPTIONS, 
+                width="small",
+                required=False,
+                help="skip : pas de paiement, next / previous : jour ouvré suivant / précédent",
+            ),
         },
         hide_index=True,
     )
 
     edited["tags"] = edited["tags"].apply(lambda x : x if isinstance(x, list) else [])
+    edited = ignore_invalid_rules(edited)
 
-    edited_with_id = edited.join(budget_periodics_ids, how="left")
-    for i, row in edited_with_id.iterrows() :
-        if pd.isna(row["id"]) :
-            edited_with_id.loc[i, "id"] = str(uuid.uuid4())
+    edited_with_id = compact_frame(fill_missing_ids(edited.join(budget_periodics_ids, how="left")))
 
     st.session_state.budget_periodics = edited_with_id
 
+    display_outdated_base_warning(BUDGET_PERIODICS_NAME, BUDGET_PERIODICS_BASE_VERSION)
+
     button_save_budget_periodics = st.button("Sauvegarder", key="button_save_budget_periodics")
     if button_save_budget_periodics :
-        combine_and_save_csv(
+        save_edits(lambda: USER_STORE.save_csv(
+            BUDGET_PERIODICS_NAME,
             modified_df=edited_with_id, 
             isolated_df=None, 
-            path=BUDGET_PERIODICS_PATH
-        )
-        st.rerun()
+            base_version=BUDGET_PERIODICS_BASE_VERSION,
+            base_df=BUDGET_PERIODICS,
+        ), "edited_budget_periodics")
 
 # endregion
 
+# region |---|---| Comparison
+
+def display_budgets_comparison() :
+
+    if not st.toggle("Comparer tous les budgets", key="budgets_comparison") :
+        return
+
+    # The selected budget is compared with its unsaved edits
+    comparison = st.session_state.period_graph.get("budgets_comparison")
+
+    if comparison is None :
+        st.caption("Aucun budget à comparer.")
+        return
+
+    differences = comparison.drop(columns=COMPARISON_REAL).sub(comparison[COMPARISON_REAL], axis=0)
+
+    st.dataframe(
+        comparison.join(differences.add_suffix(" (écart)")),
+        column_config={
+            col: st.column_config.NumberColumn(format=MONEY_FORMAT)
+            for col in list(comparison.columns) + [f"{budget} (écart)" for budget in differences.columns]
+        },
+    )
+
+    fig = get_cached_figure(
+        build_budgets_comparison_figure,
+        differences=differences,
+        money_symbol=MONEY_SYMBOL,
+    )
+
+    st.plotly_chart(fig, width="stretch")
+
+# endregion
+
+# endregion
+
+# region |---| Search
+
+@st.fragment
+def display_search() :
+
+    # Saved data only, shared by every session of the user
+    index = get_user_search_index(USER_STORE, TODAY)
+
+    col_search = st.columns([3, 2, 2, 2, 1, 1], vertical_alignment="bottom")
+
+    input_text = col_search[0].text_input("Rechercher", key="search_text", placeholder="Description, ex : amazon")
+    input_tags = col_search[1].multiselect("Tags", options=index.tags, key="search_tags")
+    input_categories = col_search[2].multiselect("Catégories", options=st.session_state.all_categories.keys(), key="search_categories")
+    input_dates = col_search[3].date_input("Dates", value=(), format="DD/MM/YYYY", key="search_dates")
+    input_amount_min = col_search[4].number_input("Montant min", value=None, format="%.2f", key="search_amount_min")
+    input_amount_max = col_search[5].number_input("Montant max", value=None, format="%.2f", key="search_amount_max")
+
+    search_start = perf_counter()
+    results = index.search(
+        text=input_text,
+        tags=input_tags,
+        categories=input_categories,
+        date_min=input_dates[0] if len(input_dates) > 0 else None,
+        date_max=input_dates[1] if len(input_dates) > 1 else None,
+        amount_min=input_amount_min,
+        amount_max=input_amount_max,
+    )
+    search_duration = perf_counter() - search_start
+
+    st.caption(f"{len(results)} résultats sur {len(index)} en {search_duration * 1000:.1f} ms")
+
+    if len(results) == 0 :
+        return
+
+    st.dataframe(
+        results[["date", "category", "tags", "description", "amount"]],
+        column_config={
+            "date": st.column_config.DateColumn("Date", format="DD/MM/YYYY"),
+            "category": st.column_config.TextColumn("Catégorie"),
+            "tags": st.column_config.ListColumn("Tags"),
+            "description": st.column_config.TextColumn("Description"),
+            "amount": st.column_config.NumberColumn("Montant", format=MONEY_FORMAT),
+        },
+        hide_index=True,
+        height=300,
+    )
+
+    col_charts = st.columns(2)
+
+    fig = get_cached_figure(
+        build_daily_balance_figure,
+        daily_balance=get_cumulative_balance(results),
+        period=results,
+        today=TODAY.replace(hour=0, minute=0, second=0, microsecond=0),
+        offset=0.,
+        categories_colors=st.session_state.all_categories,
+        money_symbol=MONEY_SYMBOL,
+    )
+    col_charts[0].plotly_chart(fig, key="search_balance")
+
+    fig = get_cached_figure(
+        build_amount_by_cat_figure,
+        period=results,
+        categories_colors=st.session_state.all_categories,
+        money_symbol=MONEY_SYMBOL,
+    )
+    col_charts[1].plotly_chart(fig, key="search_amount_by_cat")
+
 # endregion
 
 # region |---| Stats
@@ -1127,62 +1745,145 @@ def display_monthly_stats() :
 
 # region |---|---| Provision
 
-    provisions = get_provisions(
-        period_start=st.session_state.period_start,
-        period_end=st.session_state.period_end,
-        periodics=FULL_PERIODICS,
-        modify_periodic_occurences=st.session_state.modify_periodic_occurences
-    )
+    provisions = st.session_state.period_graph.get("provisions")
     total_provision = math.ceil(-provisions["provision"].sum())
 
-    labels = provisions.index
-    values = abs(provisions["provision"])
-    colors = provisions["provision"].apply(lambda x: "#7BC8A4" if x >= 0 else "#ff7f7f")
-
-    fig = go.Figure(
-        data=[
-            go.Pie(
-                labels=labels,
-                values=values,
-                hole=0.6,
-                marker_colors=colors,
-                textinfo="percent",
-                customdata=-provisions["provision"],
-                hovertemplate="<b>%{label}</b><br>%{customdata:+,.2f}" + f" {MONEY_SYMBOL}<extra></extra>",
-                showlegend=False,
-                marker=dict(
-                    colors=colors,
-                    line=dict(color="white", width=2)  # séparation entre les sections
-                ),
-            )
-        ]
+    fig = get_cached_figure(
+        build_provisions_figure,
+        provisions=provisions,
+        total_provision=total_provision,
+        money_symbol=MONEY_SYMBOL,
     )
 
-    fig.update_layout(
-        showlegend=True,
-        annotations=[
-            dict(
-                text=f"{total_provision:,.0f} {MONEY_SYMBOL}",
-                x=0.5,
-                y=0.5,
-                font_size=28,
-                showarrow=False,
-            )
-        ],
-        margin=dict(t=20, b=20, l=20, r=20),
-        title="Provisions conseillées pour la période",
-    )
     with col_provisions :
         st.plotly_chart(fig)
 
 # endregion
 
-    # TODO large period selector + stats by month by category (one plot per cat)
+# region |---|---| Monthly series
+
+    st.subheader("Statistiques mensuelles")
+
+    rollup = get_user_rollup(USER_STORE, TODAY)
+
+    scenario_labels = {SCENARIO_REAL: "Réel"} | {
+        scenario: f"Budget {scenario}"
+        for scenario in rollup.scenarios
+        if scenario != SCENARIO_REAL
+    }
+    flow_labels = {FLOW_EXPENSE: "Dépenses", FLOW_INCOME: "Revenus"}
+    first_year = rollup.months_start.year
+    last_year = ( rollup.months_end - relativedelta(days=1) ).year
+
+    col_stats_settings = st.columns([2, 1, 1, 1, 2], vertical_alignment="bottom")
+
+    input_years = col_stats_settings[0].slider(
+        "Années",
+        min_value=first_year,
+        max_value=max(last_year, first_year + 1),
+        value=(max(first_year, TODAY.year - 1), TODAY.year),
+        key="stats_years",
+    )
+    input_scenario = col_stats_settings[1].selectbox(
+        "Données",
+        options=list(scenario_labels),
+        format_func=scenario_labels.get,
+        key="stats_scenario",
+    )
+    input_flow = col_stats_settings[2].selectbox(
+        "Flux",
+        options=list(flow_labels),
+        format_func=flow_labels.get,
+        key="stats_flow",
+    )
+    input_tag = col_stats_settings[3].selectbox(
+        "Tag",
+        options=[ALL_TAGS] + rollup.tags,
+        format_func=lambda t: "Tous" if t == ALL_TAGS else f"#{t}",
+        key="stats_tag",
+    )
+
+    monthly_series = rollup.get_monthly_series(
+        scenario=input_scenario,
+        flow=input_flow,
+        months_start=datetime(input_years[0], 1, 1),
+        months_end=datetime(input_years[1] + 1, 1, 1),
+        tag=input_tag,
+    )
+
+    input_categories = col_stats_settings[4].multiselect(
+        "Catégories",
+        options=list(monthly_series.columns),
+        default=list(monthly_series.columns),
+        key="stats_categories",
+    )
+
+    fig = get_cached_figure(
+        build_monthly_stats_figure,
+        monthly_series=monthly_series[input_categories],
+        categories_colors=st.session_state.all_categories,
+        money_symbol=MONEY_SYMBOL,
+        title=f"{flow_labels[input_flow]} par mois - {scenario_labels[input_scenario]}",
+    )
+
+    st.plotly_chart(fig, width="stretch")
+
+# endregion
 
 # endregion
 
 # region |---| Sidebar
 
+# region |---|---| Low balance
+
+def display_low_balance_alert() :
+
+    today = TODAY.replace(hour=0, minute=0, second=0, microsecond=0)
+    scan_end = max(st.session_state.period_end, today) + relativedelta(months=LOW_BALANCE_HORIZON_MONTHS)
+
+    alert = get_low_balance_alert(
+        store=USER_STORE,
+        scan_start=today,
+        scan_end=scan_end,
+        threshold=LOW_BALANCE_THRESHOLD,
+    )
+
+    if alert is None :
+        return
+
+    st.warning(
+        f"Solde sous {LOW_BALANCE_THRESHOLD:.2f} {MONEY_SYMBOL} le {alert.first_date.strftime('%d/%m/%Y')} "
+        f"({alert.first_balance:.2f} {MONEY_SYMBOL}), "
+        f"au plus bas le {alert.min_date.strftime('%d/%m/%Y')} ({alert.min_balance:.2f} {MONEY_SYMBOL}).",
+        icon="⚠️",
+    )
+
+# endregion
+
+# region |---|---| Consolidated balance
+
+def display_consolidated_balance() :
+    """
+    Only shown when the user has other accounts than the main one.
+    """
+
+    consolidated = get_consolidated_balance(
+        store=USER_STORE,
+        period_start=st.session_state.period_start,
+        period_end=st.session_state.period_end,
+    )
+
+    fig = get_cached_figure(
+        build_consolidated_balance_figure,
+        consolidated=consolidated,
+        total_column=CONSOLIDATED_TOTAL,
+        money_symbol=MONEY_SYMBOL,
+    )
+
+    st.plotly_chart(fig)
+
+# endregion
+
 # region |---|---| Daily Balance
 
 def display_daily_balance(
@@ -1190,96 +1891,46 @@ def display_daily_balance(
         period: pd.DataFrame,
         budget_balance: pd.DataFrame|None=None,
         budget_period: pd.DataFrame|None=None) :
-    
-    past_balance = daily_balance[daily_balance["date"] <= TODAY]
-    future_balance = daily_balance[daily_balance["date"] >= (TODAY - relativedelta(days=1))]
 
-    fig = go.Figure()
+    today = TODAY.replace(hour=0, minute=0, second=0, microsecond=0)
 
-    fig.add_trace(go.Scatter(
-        x=past_balance["date"], 
-        y=past_balance["balance"], 
-        mode='lines', 
-        name='Réel', 
-        line=dict(color='black'),
-        hovertemplate=(
-            "Date : %{x}<br>"
-            "Balance : %{y} " + MONEY_SYMBOL + "<extra></extra>"
-        )
-    ))
-
-    fig.add_trace(go.Scatter(
-        x=future_balance["date"], 
-        y=future_balance["balance"], 
-        mode='lines', 
-        name='Prévisionnel', 
-        line=dict(color='black', dash='dot'),
-        hovertemplate=(
-            "Date : %{x}<br>"
-            "Prévision : %{y} " + MONEY_SYMBOL + "<extra></extra>"
-        )
-    ))
-
-    if not budget_balance is None :
-        fig.add_trace(go.Scatter(
-            x=budget_balance["date"], 
-            y=budget_balance["balance"], 
-            mode='lines', 
-            name=f'Budget {st.session_state.budget}', 
-            line=dict(color='gray', dash='dash'),
-            hovertemplate=(
-                "Date : %{x}<br>"
-                "Budget : %{y} " + MONEY_SYMBOL + "<extra></extra>"
-            )
-        ))
-
-        fig.add_trace(go.Bar(
-            x=budget_period["date"],
-            y=budget_period["amount"],
-            name=f'Budget {st.session_state.budget}',
-            marker=dict(color=budget_period["category"].map(st.session_state.all_categories), pattern=dict(shape="/")),
-            opacity=0.4,
-            yaxis='y2',
-            showlegend=False,
-            customdata=budget_period["description"],
-            hovertemplate=(
-                "<b>%{customdata}</b><br>"
-                "Date : %{x}<br>"
-                "Montant : %{y} " + MONEY_SYMBOL + "<br>"
+    forecast_bands = None
+    if st.toggle("Prévision stochastique", key="stochastic_forecast") :
+
+        # Only depends on saved data, so it is shared by every session of the user
+        model = USER_STORE.get_computed(
+            ("forecast_model", today),
+            lambda: fit_forecast_model(
+                ponctuals=safe_concat(FULL_PONCTUALS, ADJUSTMENTS),
+                fit_start=today - relativedelta(months=FORECAST_FIT_MONTHS),
+                fit_end=today,
+                rates=RATES,
             )
-        ))
-
-    fig.add_trace(go.Bar(
-        x=period["date"],
-        y=period["amount"],
-        name='Dépenses',
-        marker=dict(color=period["category"].map(st.session_state.all_categories)),
-        opacity=0.8,
-        yaxis='y2',
-        showlegend=False,
-        customdata=period["description"],
-        hovertemplate=(
-            "<b>%{customdata}</b><br>"
-            "Date : %{x}<br>"
-            "Montant : %{y} " + MONEY_SYMBOL + "<br>"
         )
-    ))
 
-    fig.update_xaxes(showgrid=True)
-    fig.update_layout(
-        xaxis=dict(title="Date"), 
-        yaxis=dict(title="Balance", showgrid=True, side='right'), # Axe principal
-        yaxis2=dict(title="Dépenses", overlaying='y', side='left', showgrid=False), # Axe secondaire
-        title=f"Balance de la période : {daily_balance.iloc[-1]['balance'] - st.session_state.offset:+.2f} {MONEY_SYMBOL}",
-        legend=dict(
-            orientation="h",
-            yanchor="top",
-            y=-0.25,
-            xanchor="center",
-            x=0.5
-        ),
-        margin=dict(b=100),
-        barmode='group'
+        if model is None :
+            st.caption("Pas assez d'historique pour une prévision stochastique.")
+        else :
+            forecast_bands = get_forecast_bands(
+                daily_balance=daily_balance,
+                model=model,
+                planned_ponctuals=st.session_state.ponctuals[st.session_state.ponctuals["date"] >= today],
+                today=today,
+                n_paths=FORECAST_PATHS,
+            )
+
+    fig = get_cached_figure(
+        build_daily_balance_figure,
+        daily_balance=daily_balance,
+        period=period,
+        today=today,
+        offset=st.session_state.offset,
+        categories_colors=st.session_state.all_categories,
+        money_symbol=MONEY_SYMBOL,
+        budget_name=st.session_state.budget,
+        budget_balance=budget_balance,
+        budget_period=budget_period,
+        forecast_bands=forecast_bands,
     )
 
     st.plotly_chart(fig)
@@ -1328,6 +1979,7 @@ def display_waterfall(
         amounts_budget.insert(0, float(st.session_state.offset))
         amounts_budget.append(sum(amounts_budget))
 
+    import plotly.graph_objects as go
     fig = go.Figure()
     
     plot_custom_waterfall(
@@ -1360,151 +2012,11 @@ def display_sankey(
         period: pd.DataFrame,
         budget_period: pd.DataFrame|None=None) :
 
-    node_opacity = 0.6
-    link_opacity = 0.3
-    tag_color = "gray"
-    total_node = ""
-    total_node_color = "white"
-
-# region |---|---|---| Build Sankey
-    def _build_sankey_diagram(
-            period: pd.DataFrame
-    ) -> tuple[list[str], list[int], list[int], list[int], list[str], list[str]] :
-        
-        # Init nodes
-        nodes_idx = {total_node: 0}
-        node_colors = [total_node_color]
-        labels = [total_node]
-
-        for _, row in period.iterrows() :
-            cat = row["category"]
-            tags = row["tags"]
-
-            amount = row["amount"]
-            suffix = "in" if amount > 0 else "out"
-
-            if not f"{cat}_{suffix}" in nodes_idx :
-                nodes_idx[f"{cat}_{suffix}"] = len(nodes_idx)
-                labels.append(cat)
-                node_colors.append(hex_to_rgba(st.session_state.all_categories[cat], alpha=node_opacity))
-
-            for tag in tags :
-                if not f"{tag}_{suffix}" in nodes_idx :
-                    nodes_idx[f"{tag}_{suffix}"] = len(nodes_idx)
-                    labels.append(tag)
-                    node_colors.append(tag_color)
-
-        # Build links
-        sources = []
-        targets = []
-        values = []
-        link_colors = []
-        links_idx = {}
-        
-        def __add_link(
-                node1: int,
-                node2: int,
-                amount: float,
-                cat: str|None=None,
-                color: str|None=None) -> None :
-
-            link = (node1, node2, cat)
-
-            if not link in links_idx :
-                links_idx[link] = len(links_idx)
-                sources.append(node1)
-                targets.append(node2)
-                values.append(0)
-
-                if color is None :
-                    assert not cat is None
-                    link_colors.append(hex_to_rgba(st.session_state.all_categories[cat], alpha=link_opacity))
-                else :
-                    link_colors.append(color)
-
-            link_idx = links_idx[link]
-            values[link_idx] += abs(amount)
-
-            return
-    
-
-        for _, row in period.iterrows() :
-            
-            cat = row["category"]
-            tags = row["tags"]
-            amount = row["amount"]
-
-            if amount >= 0 :
-
-                current_node = nodes_idx[f"{cat}_in"]
-                for t in tags :
-                    next_node = nodes_idx[f"{t}_in"]
-                    __add_link(current_node, next_node, amount, cat=cat)
-                    current_node = next_node
-                __add_link(current_node, nodes_idx[total_node], amount, cat=cat)
-            
-            else :
-                current_node = nodes_idx[total_node]
-                for t in tags :
-                    next_node = nodes_idx[f"{t}_out"]
-                    __add_link(current_node, next_node, amount, cat=cat)
-                    current_node = next_node
-                __add_link(current_node, nodes_idx[f"{cat}_out"], amount, cat=cat)
-
-        # Excedent/Deficit
-        balance = period["amount"].sum()
-        
-        if balance < 0 :
-            nodes_idx["Déficit"] = len(nodes_idx)
-            node_colors.append(f"rgba(200,0,0,{node_opacity})")
-            labels.append("Déficit")
-            __add_link(nodes_idx["Déficit"], nodes_idx[total_node], abs(balance), color=f"rgba(200,0,0,{link_opacity})")
-
-        elif balance > 0 :
-            nodes_idx["Excédent"] = len(nodes_idx)
-            node_colors.append(f"rgba(0,160,0,{node_opacity})")
-            labels.append("Excédent")
-            __add_link(nodes_idx[total_node], nodes_idx["Excédent"], abs(balance), color=f"rgba(0,160,0,{link_opacity})")
-
-        return labels, sources, targets, values, node_colors, link_colors
-# endregion
-
-    # Mise en forme
-    period_real = period[( period["is_ignored"] == False ) & ( period["category"].isin(st.session_state.all_categories) )]
-    period_real = period_real[["category", "tags", "amount"]]
-
-    (labels, 
-     sources, 
-     targets,
-     values,
-     node_colors,
-     link_colors) = _build_sankey_diagram(period_real)             
-
-    fig = go.Figure(data=[go.Sankey(
-        valueformat = ".0f",
-        valuesuffix = MONEY_SYMBOL,
-        arrangement="snap",
-        node=dict(
-            pad=40,
-            thickness=10,
-            line=dict(color="black", width=0.5),
-            label=labels,
-            color=node_colors
-        ),
-        link=dict(
-            source=sources,
-            target=targets,
-            value=values,
-            color=link_colors,
-            hovertemplate='%{source.label} → %{target.label}<br>%{value}<extra></extra>'
-        )
-    )])
-
-    fig.update_layout(
-        font_family="Courier New",
-        font_size=12,
-        font_shadow="",
-        paper_bgcolor ="white"
+    fig = get_cached_figure(
+        build_sankey_figure,
+        period=period,
+        categories_colors=st.session_state.all_categories,
+        money_symbol=MONEY_SYMBOL,
     )
 
     st.plotly_chart(fig, width="stretch")
@@ -1516,61 +2028,46 @@ def display_amount_by_cat(
         period: pd.DataFrame,
         budget_period: pd.DataFrame|None=None) :
 
+    fig = get_cached_figure(
+        build_amount_by_cat_figure,
+        period=period,
+        categories_colors=st.session_state.all_categories,
+        money_symbol=MONEY_SYMBOL,
+        budget_name=st.session_state.budget,
+        budget_period=budget_period,
+    )
 
-    title = "Dépenses par catégories"
+    st.plotly_chart(fig)
 
-    spent_real = period[( period["is_ignored"] == False ) & ( period["category"].isin(st.session_state.all_categories) )]
-    spent_real_output = spent_real[spent_real["amount"] < 0]
+# endregion
 
-    spent_real_stats = spent_real_output[["category", "amount"]].groupby(["category"]).sum().abs().sort_values("amount", ascending=False)
+# endregion
 
-    colors = [st.session_state.all_categories[cat] for cat in spent_real_stats.index]
+# region |---| Debug
 
-    fig = go.Figure()
+def display_timing_panel(run: TimingRun) :
 
-    if not budget_period is None :
+    with st.expander(f"Debug : {run.duration * 1000:.0f} ms") :
 
-        title += f" vs budget {st.session_state.budget}"
-
-        spent_budget = budget_period[( budget_period["amount"] < 0 ) & ( budget_period["category"].isin(st.session_state.all_categories) )]
-        spent_budget_stats = spent_budget[["category", "amount"]].groupby(["category"]).sum().abs().sort_index()
-
-        ordered_cat = list(spent_real_stats.index) 
-        ordered_cat.extend([c for c in spent_budget_stats.index if c not in ordered_cat])
-        spent_budget_stats = spent_budget_stats.reindex(ordered_cat)
-
-        fig.add_trace(go.Bar(
-            x=spent_budget_stats.index,
-            y=spent_budget_stats["amount"],
-            name=f"Budget {st.session_state.budget}",
-            orientation='v',
-            marker=dict(color='lightgray'),
-            width=0.6,
-            hovertemplate=f'Budget {st.session_state.budget}'+': %{y}' + MONEY_SYMBOL +'<extra></extra>',
-        ))
-
-    fig.add_trace(go.Bar(
-        x=spent_real_stats.index,
-        y=spent_real_stats["amount"],
-        name='Dépenses réelles',
-        orientation='v',
-        marker=dict(color=colors),
-        width=0.3,
-        hovertemplate='Réel: %{y}' + MONEY_SYMBOL +'<extra></extra>',
-    ))
+        stages = pd.DataFrame([s for s in run.spans if s["depth"] <= 1])
+        if len(stages) > 0 :
+            stages["name"] = stages["depth"].map(lambda d: "    " * d) + stages["name"]
+            st.dataframe(
+                stages[["name", "start_ms", "duration_ms", "thread"]].sort_values("start_ms"),
+                hide_index=True,
+            )
 
-    fig.update_layout(
-        barmode='overlay',
-        title=title,
-        xaxis_title='Montant',
-        yaxis_title='Catégorie',
-        height=400,
-        showlegend=False,
-    )
+        summary = pd.DataFrame.from_dict(run.get_summary(), orient="index").sort_values("total_ms", ascending=False)
+        st.dataframe(summary)
 
-    st.plotly_chart(fig)
+        st.caption(f"Journal : {TIMING_LOG_PATH}")
 
-# endregion
+
+def display_graph_panel(graph: ComputationGraph) :
+
+    with st.expander("Debug : graphe de calcul") :
+        st.graphviz_chart(graph.to_dot())
+        st.dataframe(graph.describe(), hide_index=True)
 
 # endregion
 
@@ -1599,12 +2096,15 @@ def run_input_ui_and_get_mixed_placeholder() :
 
     with st.container() :
 
-        tab_cash_flow, tab_real, tab_budget, tab_cal, tab_stats = st.tabs(["Cash flow", "Réel", "Budget", "Calendrier", "Statistiques"])
+        tab_cash_flow, tab_real, tab_budget, tab_cal, tab_stats, tab_search = st.tabs(["Cash flow", "Réel", "Budget", "Calendrier", "Statistiques", "Recherche"])
 
         with tab_real :
             with st.expander("Virements/Prélèvements périodiques") :
                 display_real_periodics_editor()
 
+            with st.expander("Détection des dépenses récurrentes") :
+                display_recurring_proposals()
+
             display_real_ponctuals_editor()
         
         with tab_budget :
@@ -1617,8 +2117,13 @@ def run_input_ui_and_get_mixed_placeholder() :
                     display_budget_ponctuals_editor()
 
                 display_budget_periodics_editor()
+
+            budgets_comparison = st.container()
+
+        with tab_search :
+            display_search()
     
-    return tab_cash_flow, tab_cal, tab_stats
+    return tab_cash_flow, budgets_comparison, tab_cal, tab_stats
 
 # endregion
 
@@ -1626,6 +2131,7 @@ def run_input_ui_and_get_mixed_placeholder() :
 
 def run_output_ui(
         tab_cash_flow,
+        budgets_comparison,
         tab_cal,
         tab_stats,
         period: pd.DataFrame,
@@ -1637,26 +2143,37 @@ def run_output_ui(
     Since some mixed widget are displayed alongside input widgets (calendar for instance), we take their placeholders in args.
     """
 
-    with tab_cash_flow :
+    with tab_cash_flow, span("ui.sankey") :
         display_sankey(
             period=period,
             budget_period=budget_period
         )
 
-    with tab_cal :
+    with budgets_comparison, span("ui.budgets_comparison") :
+        display_budgets_comparison()
+
+    with tab_cal, span("ui.calendar") :
         display_calendar(period)
     
-    with tab_stats : 
+    with tab_stats, span("ui.monthly_stats") : 
         display_monthly_stats()
 
     with st.sidebar :
+
+        with span("ui.low_balance_alert") :
+            display_low_balance_alert()
         
-        display_daily_balance(
-            daily_balance=daily_balance,
-            period=period,
-            budget_balance=budget_balance,   
-            budget_period=budget_period, 
-        )
+        with span("ui.daily_balance") :
+            display_daily_balance(
+                daily_balance=daily_balance,
+                period=period,
+                budget_balance=budget_balance,   
+                budget_period=budget_period, 
+            )
+
+        if len(USER_STORE.get_account_names()) > 1 :
+            with span("ui.consolidated_balance") :
+                display_consolidated_balance()
 
         col_new, col_edit = st.columns(2)
         if col_new.button("Ajouter un checkpoint", width="stretch") :
@@ -1664,15 +2181,30 @@ def run_output_ui(
         
         if col_edit.button("Editer les checkpoints", width="stretch") :
             open_file_edition(CHECKPOINTS_PATH)
+            USER_STORE.invalidate("checkpoints.csv")
+
+        col_rates, col_holidays = st.columns(2)
+        if col_rates.button("Editer les taux de change", width="stretch") :
+            if not RATES_PATH.exists() :
+                RATES_PATH.write_text(",".join(RATES_COLUMNS) + "\n", encoding="utf-8")
+            open_file_edition(RATES_PATH)
+            USER_STORE.invalidate("rates.csv")
+
+        if col_holidays.button("Editer les jours fériés", width="stretch") :
+            if not HOLIDAYS_PATH.exists() :
+                HOLIDAYS_PATH.write_text(",".join(HOLIDAYS_COLUMNS) + "\n", encoding="utf-8")
+            open_file_edition(HOLIDAYS_PATH)
+            USER_STORE.invalidate("holidays.csv")
 
         # display_waterfall(
         #     period=period,
         #     budget_period=budget_period,
         # )
-        display_amount_by_cat(
-            period=period,
-            budget_period=budget_period,
-        )
+        with span("ui.amount_by_cat") :
+            display_amount_by_cat(
+                period=period,
+                budget_period=budget_period,
+            )
         
 
 # endregion
@@ -1686,111 +2218,92 @@ def run_output_ui(
 
 if __name__ == '__main__' :
 
-# region |---| Custom streamlit display
-
-    st.set_page_config(layout="wide")
-
-    st.markdown("""
-        <style>
-            [data-testid="stSidebarHeader"] {
-                display: none;
-            }
-        </style>
-    """, unsafe_allow_html=True)
-
-    st.markdown("""
-        <style>
-            [data-testid="stToolbar"] {
-                display: none;
-            }
-        </style>
-    """, unsafe_allow_html=True)
-    
-    st.markdown("""
-        <style>
-            [data-testid="stMainBlockContainer"] {
-                padding-top: 0rem;
-            }
-        </style>
-    """, unsafe_allow_html=True)
+    with span("ui.input") :
+        tab_cash_flow, budgets_comparison, tab_cal, tab_stats = run_input_ui_and_get_mixed_placeholder()
+
+# region |---| Kernel
+
+    # Every source is versioned, only the nodes downstream of a change are recomputed
+    if not "period_graph" in st.session_state :
+        st.session_state.period_graph = build_period_graph(PREFETCH_CACHE_NODES)
+
+    graph = st.session_state.period_graph
+    graph.set_source("store", USER_STORE, version=str(USER_STORE.user_path))
+    graph.set_source("period_start", st.session_state.period_start, version=st.session_state.period_start)
+    graph.set_source("period_end", st.session_state.period_end, version=st.session_state.period_end)
+    graph.set_source("checkpoint", (st.session_state.ref_day, st.session_state.ref_balance), version=(st.session_state.ref_day, st.session_state.ref_balance))
+    graph.set_source("full_periodics", FULL_PERIODICS, version=get_store_version(USER_STORE, "periodics.csv"))
+    graph.set_source("full_ponctuals", FULL_PONCTUALS, version=get_store_version(USER_STORE, "ponctuals.csv"))
+    graph.set_source("saved_modifications", PERIODIC_OCCURENCES_MODIFICATIONS, version=get_store_version(USER_STORE, "periodic_occurences_modifications.json"))
+    graph.set_source("adjustments", st.session_state.adjustments, version=get_store_version(USER_STORE, *ADJUSTMENTS_DATASETS))
+    graph.set_source("periodics", st.session_state.periodics, version=get_ledger_version(st.session_state.periodics))
+    graph.set_source("ponctuals", st.session_state.ponctuals, version=get_ledger_version(st.session_state.ponctuals))
+    graph.set_source("modifications", st.session_state.modify_periodic_occurences)
+    graph.set_source("budget_name", st.session_state.budget, version=st.session_state.budget)
+    graph.set_source(
+        "budget",
+        None if st.session_state.budget is None else (st.session_state.budget_periodics, st.session_state.budget_ponctuals),
+        version=None if st.session_state.budget is None else get_fingerprint(st.session_state.budget_periodics, st.session_state.budget_ponctuals),
+    )
+    graph.set_source("budgets_version", get_budgets_version(USER_STORE), version=get_budgets_version(USER_STORE))
+    graph.set_source("rates", RATES, version=get_store_version(USER_STORE, "rates.csv"))
+    graph.set_source("holidays", HOLIDAYS, version=get_store_version(USER_STORE, "holidays.csv"))
+    graph.set_source("saved_versions", get_store_version(USER_STORE, *ADJUSTMENTS_DATASETS), version=get_store_version(USER_STORE, *ADJUSTMENTS_DATASETS))
+
+    with span("kernel.graph") :
+        results = graph.evaluate(
+            ["offset", "real_period", "daily_balance", "budget_period", "budget_balance"],
+            workers=PIPELINE_WORKERS,
+        )
 
-    st.markdown("""
-        <style>
-            [data-testid="stSidebar"] {
-                background-color: white;
-            }   
-        </style>
-    """, unsafe_allow_html=True)
+    st.session_state.offset = results["offset"]
+    period = results["real_period"]
+    daily_balance = results["daily_balance"]
+    budget_period = results["budget_period"]
+    budget_balance = results["budget_balance"]
 
 # endregion
+    
+    with span("ui.output") :
+        run_output_ui(
+            tab_cash_flow=tab_cash_flow,
+            budgets_comparison=budgets_comparison,
+            tab_cal=tab_cal,
+            tab_stats=tab_stats,
+            period=period,
+            daily_balance=daily_balance,
+            budget_period=budget_period,
+            budget_balance=budget_balance
+        )
 
-    tab_cash_flow, tab_cal, tab_stats = run_input_ui_and_get_mixed_placeholder()
-
-# region |---| Offset
-
-    st.session_state.offset = 0.
-    if not st.session_state.ref_balance is None :
-        st.session_state.offset = get_offset(
-            ref_day=st.session_state.ref_day,
-            ref_balance=st.session_state.ref_balance,
-            target_day=st.session_state.period_start,
-            periodics=FULL_PERIODICS,
-            ponctuals=safe_concat(FULL_PONCTUALS, st.session_state.adjustments),
-            modify_periodic_occurences=st.session_state.modify_periodic_occurences
+    # Once the period is shown, the previous and next ones are computed in the background, cancelled by any data change
+    with span("kernel.prefetch") :
+        graph.start_prefetch(
+            get_adjacent_period_sources(FULL_PERIODICS, FULL_PONCTUALS, st.session_state.period_start, st.session_state.horizon),
+            ["offset", "real_period", "daily_balance", "budget_period", "budget_balance"],
         )
 
-# endregion
+# region |---| Other sessions
 
-# region |---| Real
-
-    period = get_real_period(
-        period_start=st.session_state.period_start,
-        period_end=st.session_state.period_end,
-        periodics=st.session_state.periodics,
-        ponctuals=safe_concat(st.session_state.ponctuals, st.session_state.adjustments),
-        modify_periodic_occurences=st.session_state.modify_periodic_occurences,
-    )
-
-    daily_balance = get_daily_balance(
-        period_start=st.session_state.period_start,
-        period_end=st.session_state.period_end,
-        aggregated_period=period,
-        start_offset=st.session_state.offset
-    )
+    # Adjustments depend on every dataset shown, budgets are compared together
+    watched_datasets = [
+        *ADJUSTMENTS_DATASETS,
+        *( f"budgets/{name}/{dataset}" for name in USER_STORE.get_budget_names() for dataset in ["periodics.csv", "ponctuals.csv"] ),
+    ]
+    watch_saved_versions(watched_datasets, get_store_version(USER_STORE, *watched_datasets))
 
 # endregion
 
-# region |---| Budget
+# region |---| Timing
 
-    if not st.session_state.budget is None :
-        budget_period = get_budget_period(
-            period_start=st.session_state.period_start,
-            period_end=st.session_state.period_end,
-            periodics=st.session_state.periodics,
-            budget_periodics=st.session_state.budget_periodics,
-            budget_ponctuals=st.session_state.budget_ponctuals,
-        )
-        budget_balance = get_daily_balance(
-            period_start=st.session_state.period_start,
-            period_end=st.session_state.period_end,
-            aggregated_period=budget_period,
-            start_offset=st.session_state.offset
-        )
-    else :
-        budget_period = None
-        budget_balance = None
+    finish_run(TIMING_RUN, TIMING_LOG_PATH)
+
+    if not TIMING_RUN is None :
+        with st.sidebar :
+            display_timing_panel(TIMING_RUN)
+            display_graph_panel(graph)
 
 # endregion
-    
-    run_output_ui(
-        tab_cash_flow=tab_cash_flow,
-        tab_cal=tab_cal,
-        tab_stats=tab_stats,
-        period=period,
-        daily_balance=daily_balance,
-        budget_period=budget_period,
-        budget_balance=budget_balance
-    )
 
 # endregion
 
@@ -0,0 +1,90 @@
+from datetime import datetime
+from typing import Any
+import sys
+import pandas as pd
+from cabank.utils import expand_frame
+from cabank.storage import UserStore
+from cabank.pipeline import (
+    compute_user_period_results,
+    get_user_adjustments,
+)
+
+
+def _get_object_size(
+        value: Any,
+        seen: set[int]) -> int :
+
+    if id(value) in seen :
+        return 0
+    seen.add(id(value))
+
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)) :
+        size += sum(_get_object_size(v, seen) for v in value)
+
+    return size
+
+
+def get_frame_memory(df: pd.DataFrame) -> int :
+    """
+    Bytes held by a frame. Unlike memory_usage(deep=True), objects shared between rows (tag lists) are counted once.
+    """
+
+    seen: set[int] = set()
+    total = df.index.memory_usage(deep=True)
+
+    for col in df.columns :
+        serie = df[col]
+        if serie.dtype == object :
+            total += serie.memory_usage(index=False, deep=False) + sum(_get_object_size(v, seen) for v in serie)
+        else :
+            total += serie.memory_usage(index=False, deep=True)
+
+    return int(total)
+
+
+def run_memory_benchmark(
+        store: UserStore,
+        period_start: datetime,
+        period_end: datetime,
+        budget: str|None=None) -> pd.DataFrame :
+    """
+    Memory of the frames of a session, held compact like in the app, and held plain
+    (string columns and one tag list per row, like the loaders used to give them).
+    """
+
+    results = compute_user_period_results(
+        store=store,
+        period_start=period_start,
+        period_end=period_end,
+        budget=budget,
+    )
+
+    frames = {
+        "periodics.csv": store.get("periodics.csv"),
+        "ponctuals.csv": store.get("ponctuals.csv"),
+        "adjustments": get_user_adjustments(store),
+        "period": results.period,
+    }
+    if not results.budget_period is None :
+        frames["budget_period"] = results.budget_period
+
+    rows = [
+        {
+            "frame": name,
+            "rows": len(df),
+            "plain_kb": get_frame_memory(expand_frame(df)) / 1024,
+            "compact_kb": get_frame_memory(df) / 1024,
+        }
+        for name, df in frames.items()
+    ]
+
+    rows.append({
+        "frame": "Total",
+        **{key: sum(r[key] for r in rows) for key in ["rows", "plain_kb", "compact_kb"]},
+    })
+
+    benchmark = pd.DataFrame(rows)
+    benchmark["ratio"] = benchmark["plain_kb"] / benchmark["compact_kb"]
+
+    return benchmark.round(1)
@@ -0,0 +1,848 @@
+from concurrent.futures import (
+    Executor,
+    ThreadPoolExecutor,
+    ProcessPoolExecutor,
+)
+from contextvars import copy_context
+from datetime import datetime
+from pathlib import Path
+from dateutil.relativedelta import relativedelta
+from typing import NamedTuple
+import json
+import os
+import numpy as np
+import pandas as pd
+from cabank.utils import (
+    safe_concat,
+    compact_frame,
+    expand_frame,
+    get_fingerprint,
+)
+from cabank.balance import (
+    get_real_period,
+    get_budget_period,
+    get_budget_periods,
+    get_daily_balance,
+    get_offset,
+    get_provisions,
+    build_checkpoint_adjustments,
+)
+from cabank.storage import (
+    MAIN_ACCOUNT,
+    PONCTUALS_COLUMNS,
+    UserStore,
+    get_account_dataset,
+    get_empty_frame,
+)
+from cabank.graph import ComputationGraph
+
+COMPARISON_REAL = "Réel"
+COMPARISON_FINAL_BALANCE = "Solde final"
+
+ADJUSTMENTS_CACHE_NAME = "checkpoint_adjustments.json"
+ADJUSTMENTS_COLUMNS = ["date", "category", "tags", "description", "amount", "id"]
+# Saved datasets the adjustments depend on
+ADJUSTMENTS_DATASETS = ["checkpoints.csv", "periodics.csv", "ponctuals.csv", "periodic_occurences_modifications.json", "transfers.csv", "rates.csv", "holidays.csv"]
+
+TRANSFER_CATEGORY = "Virement"
+
+
+class PeriodResults(NamedTuple) :
+    offset: float
+    period: pd.DataFrame
+    daily_balance: pd.DataFrame
+    budget_period: pd.DataFrame|None
+    budget_balance: pd.DataFrame|None
+
+
+class LowBalanceAlert(NamedTuple) :
+    first_date: datetime
+    first_balance: float
+    min_date: datetime
+    min_balance: float
+
+
+# region PIPELINES
+
+def _compute_offset(
+        period_start: datetime,
+        ref_day: datetime|None,
+        ref_balance: float|None,
+        full_periodics: pd.DataFrame,
+        full_ponctuals: pd.DataFrame,
+        modify_periodic_occurences: dict[str, dict[str, float|None]],
+        rates: pd.DataFrame|None=None,
+        holidays: pd.DataFrame|None=None) -> float :
+
+    if ref_balance is None :
+        return 0.
+
+    return get_offset(
+        ref_day=ref_day,
+        ref_balance=ref_balance,
+        target_day=period_start,
+        periodics=full_periodics,
+        ponctuals=full_ponctuals,
+        modify_periodic_occurences=modify_periodic_occurences,
+        rates=rates,
+        holidays=holidays,
+    )
+
+
+def _compute_real(
+        period_start: datetime,
+        period_end: datetime,
+        periodics: pd.DataFrame,
+        ponctuals: pd.DataFrame,
+        modify_periodic_occurences: dict[str, dict[str, float|None]],
+        rates: pd.DataFrame|None=None,
+        holidays: pd.DataFrame|None=None) -> tuple[pd.DataFrame, pd.DataFrame] :
+
+    period = get_real_period(
+        period_start=period_start,
+        period_end=period_end,
+        periodics=periodics,
+        ponctuals=ponctuals,
+        modify_periodic_occurences=modify_periodic_occurences,
+        rates=rates,
+        holidays=holidays,
+    )
+
+    # The offset is added once every pipeline is joined
+    daily_balance = get_daily_balance(
+        period_start=period_start,
+        period_end=period_end,
+        aggregated_period=period,
+    )
+
+    return period, daily_balance
+
+
+def _compute_budget(
+        period_start: datetime,
+        period_end: datetime,
+        periodics: pd.DataFrame,
+        budget_periodics: pd.DataFrame,
+        budget_ponctuals: pd.DataFrame,
+        rates: pd.DataFrame|None=None,
+        holidays: pd.DataFrame|None=None) -> tuple[pd.DataFrame, pd.DataFrame] :
+
+    budget_period = get_budget_period(
+        period_start=period_start,
+        period_end=period_end,
+        periodics=periodics,
+        budget_periodics=budget_periodics,
+        budget_ponctuals=budget_ponctuals,
+        rates=rates,
+        holidays=holidays,
+    )
+
+    budget_balance = get_daily_balance(
+        period_start=period_start,
+        period_end=period_end,
+        aggregated_period=budget_period,
+    )
+
+    return budget_period, budget_balance
+
+# endregion
+
+
+# region COMPARISON
+
+def compare_budgets(
+        period_start: datetime,
+        period_end: datetime,
+        period: pd.DataFrame,
+        offset: float,
+        periodics: pd.DataFrame,
+        budgets: dict[str, tuple[pd.DataFrame, pd.DataFrame]],
+        rates: pd.DataFrame|None=None,
+        holidays: pd.DataFrame|None=None) -> pd.DataFrame :
+    """
+    Net amount of every category over the period, one column for the real period and one per budget,
+    with a last row for the final balance.
+    budgets are given as {name: (budget_periodics, budget_ponctuals)} and evaluated in one pass.
+    """
+
+    def _net_by_category(p: pd.DataFrame) -> pd.Series :
+        spent = p[p["is_ignored"] == False]
+        return spent["amount"].astype(float).groupby(spent["category"]).sum()
+
+    budget_periods = get_budget_periods(
+        period_start=period_start,
+        period_end=period_end,
+        periodics=periodics,
+        budgets=budgets,
+        rates=rates,
+        holidays=holidays,
+    )
+
+    comparison = pd.DataFrame({
+        COMPARISON_REAL: _net_by_category(period),
+        **{name: _net_by_category(budget_period) for name, budget_period in budget_periods.items()},
+    }).fillna(0.).sort_index()
+
+    comparison.loc[COMPARISON_FINAL_BALANCE] = offset + comparison.sum()
+
+    return comparison
+
+# endregion
+
+
+# region EXECUTION
+
+def _get_executor(
+        workers: int,
+        use_processes: bool) -> Executor :
+
+    if use_processes :
+        return ProcessPoolExecutor(max_workers=workers)
+
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cabank_pipeline")
+
+
+def compute_period_results(
+        period_start: datetime,
+        period_end: datetime,
+        full_periodics: pd.DataFrame,
+        full_ponctuals: pd.DataFrame,
+        periodics: pd.DataFrame,
+        ponctuals: pd.DataFrame,
+        adjustments: pd.DataFrame,
+        modify_periodic_occurences: dict[str, dict[str, float|None]],
+        ref_day: datetime|None=None,
+        ref_balance: float|None=None,
+        offset: float|None=None,
+        budget_periodics: pd.DataFrame|None=None,
+        budget_ponctuals: pd.DataFrame|None=None,
+        workers: int=1,
+        use_processes: bool=False,
+        rates: pd.DataFrame|None=None,
+        holidays: pd.DataFrame|None=None) -> PeriodResults :
+    """
+    The offset, real and budget pipelines are independent given the loaded data.
+    They run concurrently when workers > 1, serially otherwise, and are joined by adding the offset to the balances.
+    A precomputed offset skips the offset pipeline.
+    No budget is computed if budget_periodics is None.
+    With rates, amounts in other currencies are converted to the display currency.
+    holidays are the days off of the periodics with an on_holiday option.
+    """
+
+    offset_args = (
+        period_start,
+        ref_day,
+        ref_balance,
+        full_periodics,
+        safe_concat(full_ponctuals, adjustments),
+        modify_periodic_occurences,
+        rates,
+        holidays,
+    )
+    real_args = (
+        period_start,
+        period_end,
+        periodics,
+        safe_concat(ponctuals, adjustments),
+        modify_periodic_occurences,
+        rates,
+        holidays,
+    )
+    with_budget = not budget_periodics is None
+    budget_args = (
+        period_start,
+        period_end,
+        periodics,
+        budget_periodics,
+        budget_ponctuals,
+        rates,
+        holidays,
+    )
+
+    with_offset = offset is None
+
+    if workers <= 1 :
+        offset = _compute_offset(*offset_args) if with_offset else offset
+        period, daily_balance = _compute_real(*real_args)
+        budget_period, budget_balance = _compute_budget(*budget_args) if with_budget else (None, None)
+
+    else :
+        with _get_executor(workers, use_processes) as executor :
+
+            def _submit(fn, *args) :
+                # Threads run in a copy of the context, so that their timing spans are recorded
+                if use_processes :
+                    return executor.submit(fn, *args)
+                return executor.submit(copy_context().run, fn, *args)
+
+            offset_future = _submit(_compute_offset, *offset_args) if with_offset else None
+            real_future = _submit(_compute_real, *real_args)
+            budget_future = _submit(_compute_budget, *budget_args) if with_budget else None
+
+            offset = offset_future.result() if with_offset else offset
+            period, daily_balance = real_future.result()
+            budget_period, budget_balance = budget_future.result() if with_budget else (None, None)
+
+    daily_balance["balance"] += offset
+    if with_budget :
+        budget_balance["balance"] += offset
+
+    return PeriodResults(
+        offset=offset,
+        period=period,
+        daily_balance=daily_balance,
+        budget_period=budget_period,
+        budget_balance=budget_balance,
+    )
+
+# endregion
+
+
+# region GRAPH
+
+def get_store_version(
+        store: UserStore,
+        *names: str) -> tuple :
+    """
+    Version of saved datasets, for graph sources that come from the store.
+    """
+
+    return ( str(store.user_path), *( store.get_version(n) for n in names ) )
+
+
+def get_budgets_version(store: UserStore) -> tuple :
+
+    return get_store_version(
+        store,
+        *( f"budgets/{name}/{dataset}" for name in store.get_budget_names() for dataset in ["periodics.csv", "ponctuals.csv"] ),
+    )
+
+
+def _compare_all_budgets(
+        store: UserStore,
+        budgets_version: tuple,
+        budget_name: str|None,
+        budget: tuple[pd.DataFrame, pd.DataFrame]|None,
+        period_start: datetime,
+        period_end: datetime,
+        real_period: pd.DataFrame,
+        offset: float,
+        periodics: pd.DataFrame,
+        rates: pd.DataFrame,
+        holidays: pd.DataFrame) -> pd.DataFrame|None :
+    """
+    Every saved budget, the selected one with its unsaved edits. None if there is no budget.
+    """
+
+    budgets = {
+        name: (store.get(f"budgets/{name}/periodics.csv"), store.get(f"budgets/{name}/ponctuals.csv"))
+        for name in store.get_budget_names()
+    }
+    if budget_name in budgets and not budget is None :
+        budgets[budget_name] = budget
+
+    if not budgets :
+        return None
+
+    return compare_budgets(
+        period_start=period_start,
+        period_end=period_end,
+        period=real_period,
+        offset=offset,
+        periodics=periodics,
+        budgets=budgets,
+        rates=rates,
+        holidays=holidays,
+    )
+
+
+def _compute_graph_offset(
+        store: UserStore,
+        saved_versions: tuple,
+        period_start: datetime,
+        checkpoint: tuple[datetime|None, float|None],
+        full_periodics: pd.DataFrame,
+        full_ponctuals: pd.DataFrame,
+        adjustments: pd.DataFrame,
+        saved_modifications: dict[str, dict[str, float|None]],
+        rates: pd.DataFrame,
+        holidays: pd.DataFrame) -> float :
+
+    ref_day, ref_balance = checkpoint
+
+    # Only depends on saved data, so it is shared by every session of the user.
+    # Keyed on the versions the frames were loaded at : a prefetch that started before a save
+    # and ends after it leaves its result under the old versions, where no session looks for it
+    return store.get_computed(
+        ("offset", period_start, saved_versions),
+        lambda: _compute_offset(
+            period_start,
+            ref_day,
+            ref_balance,
+            full_periodics,
+            safe_concat(full_ponctuals, adjustments),
+            saved_modifications,
+            rates,
+            holidays,
+        ),
+    )
+
+
+def _add_offset(
+        flow: pd.DataFrame|None,
+        offset: float) -> pd.DataFrame|None :
+    """
+    Flows are memoized, so the balance is a new frame.
+    """
+
+    if flow is None :
+        return None
+
+    return flow.assign(balance=flow["balance"] + offset)
+
+
+def build_period_graph(max_cached: int=0) -> ComputationGraph :
+    """
+    The pipeline of the app as a graph, so that an edit only recomputes what depends on it
+    (ex: a budget edit never touches the offset nor the real period).
+
+    Sources, set by the app on every rerun :
+    store, period_start, period_end, checkpoint (ref_day, ref_balance), full_periodics, full_ponctuals,
+    saved_modifications, adjustments, periodics, ponctuals, modifications (with unsaved edits),
+    budget_name, budget ((budget_periodics, budget_ponctuals) or None), budgets_version, rates, holidays,
+    saved_versions (get_store_version of ADJUSTMENTS_DATASETS, when the saved sources were loaded).
+    """
+
+    graph = ComputationGraph(max_cached)
+
+    graph.add_node(
+        "offset",
+        ["store", "saved_versions", "period_start", "checkpoint", "full_periodics", "full_ponctuals", "adjustments", "saved_modifications", "rates", "holidays"],
+        _compute_graph_offset,
+    )
+
+    graph.add_node(
+        "real_ponctuals",
+        ["ponctuals", "adjustments"],
+        lambda ponctuals, adjustments: safe_concat(ponctuals, adjustments),
+    )
+    graph.add_node(
+        "real_period",
+        ["period_start", "period_end", "periodics", "real_ponctuals", "modifications", "rates", "holidays"],
+        lambda period_start, period_end, periodics, real_ponctuals, modifications, rates, holidays: get_real_period(
+            period_start=period_start,
+            period_end=period_end,
+            periodics=periodics,
+            ponctuals=real_ponctuals,
+            modify_periodic_occurences=modifications,
+            rates=rates,
+            holidays=holidays,
+        ),
+    )
+    graph.add_node(
+        "real_flow",
+        ["period_start", "period_end", "real_period"],
+        lambda period_start, period_end, real_period: get_daily_balance(period_start, period_end, real_period),
+    )
+    graph.add_node(
+        "daily_balance",
+        ["real_flow", "offset"],
+        lambda real_flow, offset: _add_offset(real_flow, offset),
+    )
+
+    graph.add_node(
+        "budget_period",
+        ["period_start", "period_end", "periodics", "budget", "rates", "holidays"],
+        lambda period_start, period_end, periodics, budget, rates, holidays: None if budget is None else get_budget_period(
+            period_start=period_start,
+            period_end=period_end,
+            periodics=periodics,
+            budget_periodics=budget[0],
+            budget_ponctuals=budget[1],
+            rates=rates,
+            holidays=holidays,
+        ),
+    )
+    graph.add_node(
+        "budget_flow",
+        ["period_start", "period_end", "budget_period"],
+        lambda period_start, period_end, budget_period: None if budget_period is None else get_daily_balance(period_start, period_end, budget_period),
+    )
+    graph.add_node(
+        "budget_balance",
+        ["budget_flow", "offset"],
+        lambda budget_flow, offset: _add_offset(budget_flow, offset),
+    )
+
+    # Chart inputs
+    graph.add_node(
+        "provisions",
+        ["period_start", "period_end", "full_periodics", "modifications", "rates", "holidays"],
+        lambda period_start, period_end, full_periodics, modifications, rates, holidays: get_provisions(
+            period_start=period_start,
+            period_end=period_end,
+            periodics=full_periodics,
+            modify_periodic_occurences=modifications,
+            rates=rates,
+            holidays=holidays,
+        ),
+    )
+    graph.add_node(
+        "budgets_comparison",
+        ["store", "budgets_version", "budget_name", "budget", "period_start", "period_end", "real_period", "offset", "periodics", "rates", "holidays"],
+        _compare_all_budgets,
+    )
+
+    return graph
+
+def get_ledger_version(df: pd.DataFrame) -> str :
+    """
+    Version of periodics or ponctuals that ignores the order of rows and columns and the dtypes,
+    so that a period subset of saved data and the same rows back from the editors get the same version.
+    """
+
+    normalized = expand_frame(df)
+    normalized = normalized[sorted(normalized.columns)].sort_values("id").reset_index(drop=True)
+
+    for col in normalized.columns :
+        if pd.api.types.is_datetime64_any_dtype(normalized[col]) :
+            normalized[col] = normalized[col].astype("datetime64[ns]")
+        elif pd.api.types.is_numeric_dtype(normalized[col]) :
+            normalized[col] = normalized[col].astype(float)
+        else :
+            normalized[col] = normalized[col].astype(str)
+
+    return get_fingerprint(normalized)
+
+
+def get_adjacent_period_sources(
+        full_periodics: pd.DataFrame,
+        full_ponctuals: pd.DataFrame,
+        period_start: datetime,
+        horizon: int) -> list[dict[str, tuple]] :
+    """
+    Graph sources of the previous and next periods, as set by the app once the period is changed
+    by one horizon and the saved periodics and ponctuals are loaded : alternatives for start_prefetch.
+    """
+
+    alternatives = []
+
+    for start in [period_start - relativedelta(months=horizon), period_start + relativedelta(months=horizon)] :
+        end = start + relativedelta(months=horizon)
+
+        # Same masks as the app
+        periodics = full_periodics[( full_periodics["first"] < end ) & ( full_periodics["last"] >= start )].reset_index(drop=True)
+        ponctuals = full_ponctuals[( full_ponctuals["date"] >= start ) & ( full_ponctuals["date"] < end )].reset_index(drop=True)
+
+        alternatives.append({
+            "period_start": ( start, start ),
+            "period_end": ( end, end ),
+            "periodics": ( periodics, get_ledger_version(periodics) ),
+            "ponctuals": ( ponctuals, get_ledger_version(ponctuals) ),
+        })
+
+    return alternatives
+
+# endregion
+
+
+# region ADJUSTMENTS
+
+def _get_interval_fingerprint(
+        start_checkpoint: pd.Series,
+        end_checkpoint: pd.Series,
+        periodics: pd.DataFrame,
+        ponctuals: pd.DataFrame,
+        modify_periodic_occurences: dict[str, dict[str, float|None]]) -> str :
+    """
+    Fingerprint of what the adjustments of one checkpoint interval depend on :
+    both checkpoints, dates and amounts of the ponctuals in the interval, the periodics that may occur in it,
+    and the modifications of their occurences in it. Descriptions, categories and tags don't change adjustments.
+    Exchange rates and holidays are in the settings of the whole cache.
+    """
+
+    # Same bounds as build_checkpoint_adjustments : from the day after the first checkpoint, to the second one included
+    window_start = start_checkpoint["date"] + relativedelta(days=1)
+    window_end = end_checkpoint["date"] + relativedelta(days=1)
+
+    in_window = ponctuals[( ponctuals["date"] >= window_start ) & ( ponctuals["date"] < window_end )]
+    in_window = in_window[["date", "amount", "currency"]].astype({"currency": str}).sort_values(["date", "amount", "currency"]).reset_index(drop=True)
+
+    may_occur = periodics[( periodics["first"] < window_end ) & ( periodics["last"].isna() | ( periodics["last"] >= start_checkpoint["date"] ) )]
+    may_occur = may_occur[["id", "amount", "first", "last", "days", "months", "currency", "rule", "on_holiday"]].astype({"currency": str, "on_holiday": str}).sort_values("id").reset_index(drop=True)
+
+    window_dates = (window_start.strftime("%Y-%m-%d"), window_end.strftime("%Y-%m-%d"))
+    modifications = {
+        periodic_id: {d: v for d, v in modify_periodic_occurences.get(periodic_id, {}).items() if window_dates[0] <= d < window_dates[1]}
+        for periodic_id in may_occur["id"]
+    }
+
+    return get_fingerprint(
+        [str(start_checkpoint["date"]), float(start_checkpoint["net_position"])],
+        [str(end_checkpoint["date"]), float(end_checkpoint["net_position"])],
+        in_window,
+        may_occur,
+        modifications,
+    )
+
+
+def _read_adjustments_cache(path: Path) -> dict :
+
+    if not path.exists() :
+        return {}
+
+    try :
+        with open(path, "r", encoding="utf-8") as f :
+            return json.load(f)
+    except (OSError, ValueError) :
+        # A damaged cache is only rebuilt
+        return {}
+
+
+def _write_adjustments_cache(
+        path: Path,
+        cache: dict) :
+    """
+    Written to a temporary file first, so that a process never reads half a cache.
+    """
+
+    temporary_path = path.with_name(path.name + ".tmp")
+    with open(temporary_path, "w", encoding="utf-8") as f :
+        json.dump(cache, f, ensure_ascii=False)
+
+    os.replace(temporary_path, path)
+
+
+def update_persisted_adjustments(
+        store: UserStore,
+        account: str=MAIN_ACCOUNT,
+        category: str="Quotidien",
+        tags: list[str]=[],
+        adjustments_step_days: int|None=7) -> pd.DataFrame :
+    """
+    build_checkpoint_adjustments, persisted in the account folder with the fingerprint of each checkpoint interval.
+    Only the intervals whose fingerprint changed are recomputed, the others are read back from the cache.
+    """
+
+    checkpoints = store.get(get_account_dataset(account, "checkpoints.csv"))
+    periodics = store.get(get_account_dataset(account, "periodics.csv"))
+    ponctuals = get_account_ponctuals(store, account)
+    modify_periodic_occurences = store.get(get_account_dataset(account, "periodic_occurences_modifications.json"))
+    rates = store.get("rates.csv")
+    holidays = store.get("holidays.csv")
+
+    path = store.get_path(get_account_dataset(account, ADJUSTMENTS_CACHE_NAME))
+    settings = get_fingerprint(category, tags, adjustments_step_days, rates, holidays)
+
+    cache = _read_adjustments_cache(path)
+    cached_intervals = cache.get("intervals", {}) if cache.get("settings") == settings else {}
+
+    intervals = {}
+    for i in range(len(checkpoints) - 1) :
+
+        start_checkpoint, end_checkpoint = checkpoints.iloc[i], checkpoints.iloc[i + 1]
+        key = f"{start_checkpoint['date']:%Y-%m-%d}|{end_checkpoint['date']:%Y-%m-%d}"
+        fingerprint = _get_interval_fingerprint(start_checkpoint, end_checkpoint, periodics, ponctuals, modify_periodic_occurences)
+
+        if cached_intervals.get(key, {}).get("fingerprint") == fingerprint :
+            intervals[key] = cached_intervals[key]
+            continue
+
+        adjustments = build_checkpoint_adjustments(
+            checkpoints=checkpoints.iloc[i:i + 2],
+            periodics=periodics,
+            ponctuals=ponctuals,
+            modify_periodic_occurences=modify_periodic_occurences,
+            category=category,
+            tags=tags,
+            adjustments_step_days=adjustments_step_days,
+            rates=rates,
+            holidays=holidays,
+        )
+
+        intervals[key] = {
+            "fingerprint": fingerprint,
+            "rows": [
+                {
+                    "date": row["date"].strftime("%Y-%m-%d"),
+                    "description": str(row["description"]),
+                    "amount": float(row["amount"]),
+                    "id": row["id"],
+                }
+                for _, row in adjustments.iterrows()
+            ],
+        }
+
+    if intervals != cached_intervals :
+        _write_adjustments_cache(path, {"settings": settings, "intervals": intervals})
+
+    rows = [row for interval in intervals.values() for row in interval["rows"]]
+    if len(rows) == 0 :
+        return pd.DataFrame(columns=ADJUSTMENTS_COLUMNS)
+
+    adjustments = pd.DataFrame(rows).assign(category=category)
+    adjustments["date"] = pd.to_datetime(adjustments["date"])
+    adjustments["tags"] = [tags] * len(adjustments)
+
+    return compact_frame(adjustments[ADJUSTMENTS_COLUMNS])
+
+# endregion
+
+
+# region USER DATA
+
+def get_transfer_ponctuals(
+        transfers: pd.DataFrame,
+        account: str) -> pd.DataFrame :
+    """
+    Transfers from and to an account as its ponctuals : an expense on the way out, an income on the way in.
+    """
+
+    outgoing = transfers[transfers["from_account"] == account]
+    incoming = transfers[transfers["to_account"] == account]
+
+    if len(outgoing) + len(incoming) == 0 :
+        return get_empty_frame(PONCTUALS_COLUMNS)
+
+    ponctuals = pd.concat([
+        pd.DataFrame({
+            "date": outgoing["date"],
+            "description": outgoing["description"].where(outgoing["description"] != "", "Virement vers " + outgoing["to_account"]),
+            "amount": outgoing["amount"],
+            "id": outgoing["id"] + "|out",
+        }),
+        pd.DataFrame({
+            "date": incoming["date"],
+            "description": incoming["description"].where(incoming["description"] != "", "Virement de " + incoming["from_account"]),
+            "amount": -incoming["amount"],
+            "id": incoming["id"] + "|in",
+        }),
+    ]).reset_index(drop=True)
+
+    ponctuals["category"] = TRANSFER_CATEGORY
+    ponctuals["tags"] = [[]] * len(ponctuals)
+    # Amounts of transfers are in the display currency
+    ponctuals["currency"] = ""
+
+    return compact_frame(ponctuals[list(PONCTUALS_COLUMNS)])
+
+
+def get_account_ponctuals(
+        store: UserStore,
+        account: str=MAIN_ACCOUNT) -> pd.DataFrame :
+    """
+    Saved ponctuals of an account, with its transfers.
+    """
+
+    return safe_concat(
+        store.get(get_account_dataset(account, "ponctuals.csv")),
+        get_transfer_ponctuals(store.get("transfers.csv"), account),
+    )
+
+
+def get_user_adjustments(
+        store: UserStore,
+        account: str=MAIN_ACCOUNT) -> pd.DataFrame :
+    """
+    Adjustments of every checkpoint interval of an account, shared by every caller until the next save.
+    """
+
+    return store.get_computed(
+        ("adjustments", account),
+        lambda: update_persisted_adjustments(store, account),
+    )
+
+
+def compute_user_period_results(
+        store: UserStore,
+        period_start: datetime,
+        period_end: datetime,
+        budget: str|None=None,
+        offset: float|None=None,
+        account: str=MAIN_ACCOUNT,
+        workers: int=1,
+        use_processes: bool=False) -> PeriodResults :
+    """
+    Same results as the app for the saved data of an account of a user, without any UI.
+    A precomputed offset skips the offset pipeline.
+    """
+
+    checkpoints = store.get(get_account_dataset(account, "checkpoints.csv"))
+    periodics = store.get(get_account_dataset(account, "periodics.csv"))
+    ponctuals = get_account_ponctuals(store, account)
+
+    # Same mask as the app : a periodic without a last date is left out of the period
+    period_periodics = periodics[( periodics["first"] < period_end ) & ( periodics["last"] >= period_start )].reset_index(drop=True)
+
+    ref_day, ref_balance = None, None
+    if len(checkpoints) > 0 :
+        ref_day = checkpoints["date"].iloc[-1]
+        ref_balance = checkpoints["net_position"].iloc[-1]
+
+    return compute_period_results(
+        period_start=period_start,
+        period_end=period_end,
+        full_periodics=periodics,
+        full_ponctuals=ponctuals,
+        periodics=period_periodics,
+        ponctuals=ponctuals,
+        adjustments=get_user_adjustments(store, account),
+        modify_periodic_occurences=store.get(get_account_dataset(account, "periodic_occurences_modifications.json")),
+        ref_day=ref_day,
+        ref_balance=ref_balance,
+        offset=offset,
+        budget_periodics=None if budget is None else store.get(f"budgets/{budget}/periodics.csv"),
+        budget_ponctuals=None if budget is None else store.get(f"budgets/{budget}/ponctuals.csv"),
+        workers=workers,
+        use_processes=use_processes,
+        rates=store.get("rates.csv"),
+        holidays=store.get("holidays.csv"),
+    )
+
+# endregion
+
+
+# region ALERTS
+
+def scan_low_balance(
+        daily_balance: pd.DataFrame,
+        threshold: float) -> LowBalanceAlert|None :
+    """
+    First day under the threshold and lowest point of the balance, None if it never goes under.
+    """
+
+    balance = daily_balance["balance"].to_numpy(dtype=float)
+
+    below = balance < threshold
+    if not below.any() :
+        return None
+
+    first = int(np.argmax(below))
+    lowest = int(np.argmin(balance))
+
+    return LowBalanceAlert(
+        first_date=daily_balance["date"].iloc[first],
+        first_balance=float(balance[first]),
+        min_date=daily_balance["date"].iloc[lowest],
+        min_balance=float(balance[lowest]),
+    )
+
+
+def get_low_balance_alert(
+        store: UserStore,
+        scan_start: datetime,
+        scan_end: datetime,
+        threshold: float) -> LowBalanceAlert|None :
+    """
+    Projected balance of the saved data from scan_start to scan_end excluded.
+    Shared by every caller until the next save, so it is cheap to check on every rerun.
+    """
+
+    def _scan() -> LowBalanceAlert|None :
+        results = compute_user_period_results(store, scan_start, scan_end)
+        # The first day is the day before scan_start
+        return scan_low_balance(results.daily_balance.iloc[1:], threshold)
+
+    return store.get_computed(("low_balance", scan_start, scan_end, threshold), _scan)
+
+# endregion
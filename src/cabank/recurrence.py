@@ -0,0 +1,344 @@
+from datetime import datetime
+from functools import lru_cache
+from typing import NamedTuple
+import numpy as np
+import pandas as pd
+from cabank.utils import compact_frame
+from cabank.timing import timed
+
+# Values of the "rule" column of periodics, empty for the days and months intervals :
+# "weekly MO,TH", "nth_weekday 2 TU" (-1 for the last one of the month), "last_business_day", "yearly 12-25".
+# Monthly rules (nth_weekday, last_business_day) occur every "months" months (every month with 0), from the month of "first".
+WEEKDAY_CODES = ["MO", "TU", "WE", "TH", "FR", "SA", "SU"]
+RULE_EXAMPLES = ["weekly MO,TH", "nth_weekday 2 TU", "nth_weekday -1 FR", "last_business_day", "yearly 12-25"]
+
+# Values of the "on_holiday" column : what happens to an occurence on a weekend or a day of the holidays table
+ON_HOLIDAY_OPTIONS = ["", "skip", "next", "previous"]
+# Occurences are generated this far outside the period, so that a shift can bring them in
+HOLIDAY_SHIFT_MARGIN_DAYS = 7
+
+# The days of numpy start on 1970-01-01, a thursday
+_EPOCH_WEEKDAY = 3
+
+OCCURENCES_COLUMNS = ["category", "tags", "description", "amount", "date", "periodic_id"]
+
+
+class RecurrenceRule(NamedTuple) :
+    kind: str
+    # Weekdays of weekly, weekday of nth_weekday (0 for monday)
+    weekdays: tuple[int, ...] = ()
+    # nth_weekday : 1 for the first one of the month, -1 for the last one
+    nth: int = 0
+    # yearly
+    month: int = 0
+    day: int = 0
+
+
+# region COMPILATION
+
+def _parse_weekdays(codes: str) -> tuple[int, ...] :
+    return tuple(sorted({WEEKDAY_CODES.index(code) for code in codes.upper().split(",")}))
+
+
+@lru_cache(maxsize=None)
+def compile_rule(rule: str) -> RecurrenceRule :
+    """
+    Parameters of a rule, parsed once for all its periodics and expansions.
+    """
+
+    parts = rule.split()
+
+    try :
+        if parts[0] == "weekly" and len(parts) == 2 :
+            return RecurrenceRule("weekly", weekdays=_parse_weekdays(parts[1]))
+
+        if parts[0] == "nth_weekday" and len(parts) == 3 and int(parts[1]) in [-5, -4, -3, -2, -1, 1, 2, 3, 4, 5] :
+            return RecurrenceRule("nth_weekday", weekdays=_parse_weekdays(parts[2])[:1], nth=int(parts[1]))
+
+        if parts == ["last_business_day"] :
+            return RecurrenceRule("last_business_day")
+
+        if parts[0] == "yearly" and len(parts) == 2 :
+            month, day = ( int(x) for x in parts[1].split("-") )
+            if 1 <= month <= 12 and 1 <= day <= 31 :
+                return RecurrenceRule("yearly", month=month, day=day)
+
+    except (IndexError, ValueError) :
+        pass
+
+    raise ValueError(f"Règle de récurrence invalide : {rule}")
+
+
+def get_rules(periodics: pd.DataFrame) -> pd.Series :
+    """
+    Rule of every periodic, empty when it only has days and months intervals.
+    """
+
+    if not "rule" in periodics.columns :
+        return pd.Series("", index=periodics.index, dtype=str)
+
+    return periodics["rule"].astype(object).fillna("").astype(str).str.strip()
+
+
+def get_invalid_rules(rules: pd.Series) -> list[str] :
+
+    invalid = []
+    for rule in rules.astype(object).fillna("").astype(str).str.strip().unique() :
+        try :
+            if rule != "" :
+                compile_rule(rule)
+        except ValueError :
+            invalid.append(rule)
+
+    return invalid
+
+# endregion
+
+
+# region GENERATORS
+
+def _expand_sequences(
+        rows: np.ndarray,
+        starts: np.ndarray,
+        steps: np.ndarray,
+        counts: np.ndarray) -> tuple[np.ndarray, np.ndarray] :
+    """
+    Arithmetic sequences start, start + step, ... of count terms, all in one array, with the row of each term.
+    """
+
+    counts = np.maximum(counts, 0)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    return np.repeat(rows, counts), np.repeat(starts, counts) + offsets * np.repeat(steps, counts)
+
+
+def _get_weekdays(days: np.ndarray) -> np.ndarray :
+    return ( days + _EPOCH_WEEKDAY ) % 7
+
+
+def _get_month_starts(months: np.ndarray) -> np.ndarray :
+    return months.astype("datetime64[M]").astype("datetime64[D]").astype(np.int64)
+
+
+def _get_months(days: np.ndarray) -> np.ndarray :
+    return days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+
+
+def _generate_weekly(
+        rows: np.ndarray,
+        rules: list[RecurrenceRule],
+        window_start: np.ndarray,
+        window_end: np.ndarray,
+        first_days: np.ndarray,
+        months_step: np.ndarray,
+        holidays: np.ndarray) -> tuple[np.ndarray, np.ndarray] :
+    """
+    One sequence of step 7 days per (periodic, weekday).
+    """
+
+    counts = np.array([len(r.weekdays) for r in rules], dtype=np.int64)
+    pairs = np.repeat(np.arange(len(rows)), counts)
+    weekdays = np.array([w for r in rules for w in r.weekdays], dtype=np.int64)
+
+    starts = window_start[pairs] + ( weekdays - _get_weekdays(window_start[pairs]) ) % 7
+
+    return _expand_sequences(rows[pairs], starts, np.full(len(pairs), 7), ( window_end[pairs] - starts + 6 ) // 7)
+
+
+def _generate_monthly_starts(
+        first_months: np.ndarray,
+        window_start: np.ndarray,
+        window_end: np.ndarray,
+        months_step: np.ndarray) -> tuple[np.ndarray, np.ndarray] :
+    """
+    Months (numbered from 1970-01) of the window, every months_step months from first_months.
+    Returns the index of the periodic and the month of every occurence.
+    """
+
+    lo = _get_months(window_start)
+    hi = _get_months(window_end - 1)
+    starts = first_months + -( ( first_months - lo ) // months_step ) * months_step
+
+    return _expand_sequences(np.arange(len(lo)), starts, months_step, ( hi - starts ) // months_step + 1)
+
+
+def _generate_nth_weekday(
+        rows: np.ndarray,
+        rules: list[RecurrenceRule],
+        window_start: np.ndarray,
+        window_end: np.ndarray,
+        first_days: np.ndarray,
+        months_step: np.ndarray,
+        holidays: np.ndarray) -> tuple[np.ndarray, np.ndarray] :
+
+    index, months = _generate_monthly_starts(_get_months(first_days), window_start, window_end, months_step)
+    weekdays = np.array([r.weekdays[0] for r in rules], dtype=np.int64)[index]
+    nth = np.array([r.nth for r in rules], dtype=np.int64)[index]
+
+    month_start = _get_month_starts(months)
+    month_end = _get_month_starts(months + 1) - 1
+
+    from_start = month_start + ( weekdays - _get_weekdays(month_start) ) % 7 + 7 * ( nth - 1 )
+    from_end = month_end - ( _get_weekdays(month_end) - weekdays ) % 7 + 7 * ( nth + 1 )
+    days = np.where(nth > 0, from_start, from_end)
+
+    # A fifth weekday is not in every month
+    exists = ( days >= month_start ) & ( days <= month_end )
+
+    return rows[index][exists], days[exists]
+
+
+def _generate_last_business_day(
+        rows: np.ndarray,
+        rules: list[RecurrenceRule],
+        window_start: np.ndarray,
+        window_end: np.ndarray,
+        first_days: np.ndarray,
+        months_step: np.ndarray,
+        holidays: np.ndarray) -> tuple[np.ndarray, np.ndarray] :
+
+    index, months = _generate_monthly_starts(_get_months(first_days), window_start, window_end, months_step)
+    month_end = _get_month_starts(months + 1) - 1
+
+    days = np.busday_offset(month_end.astype("datetime64[D]"), 0, roll="backward", holidays=holidays).astype(np.int64)
+
+    return rows[index], days
+
+
+def _generate_yearly(
+        rows: np.ndarray,
+        rules: list[RecurrenceRule],
+        window_start: np.ndarray,
+        window_end: np.ndarray,
+        first_days: np.ndarray,
+        months_step: np.ndarray,
+        holidays: np.ndarray) -> tuple[np.ndarray, np.ndarray] :
+    """
+    Every 12 months from the month of the rule, the day is clamped to the end of shorter months (ex: 02-29).
+    """
+
+    rule_months = np.array([r.month - 1 for r in rules], dtype=np.int64)
+    rule_days = np.array([r.day for r in rules], dtype=np.int64)
+
+    index, months = _generate_monthly_starts(rule_months, window_start, window_end, np.full(len(rows), 12))
+
+    month_start = _get_month_starts(months)
+    month_length = _get_month_starts(months + 1) - month_start
+
+    return rows[index], month_start + np.minimum(rule_days[index], month_length) - 1
+
+
+_GENERATORS = {
+    "weekly": _generate_weekly,
+    "nth_weekday": _generate_nth_weekday,
+    "last_business_day": _generate_last_business_day,
+    "yearly": _generate_yearly,
+}
+
+# endregion
+
+
+# region EXPANSION
+
+def _to_days(serie: pd.Series) -> np.ndarray :
+    return serie.to_numpy().astype("datetime64[D]").astype(np.int64)
+
+
+def _shift_holidays(
+        days: np.ndarray,
+        on_holiday: np.ndarray,
+        holidays: np.ndarray) -> tuple[np.ndarray, np.ndarray] :
+    """
+    Occurences on a weekend or a holiday are skipped, or moved to the next or previous business day.
+    Returns the shifted days and whether each occurence is kept.
+    """
+
+    dates = days.astype("datetime64[D]")
+    is_business_day = np.is_busday(dates, holidays=holidays)
+
+    shifted = days.copy()
+    for option, roll in [("next", "forward"), ("previous", "backward")] :
+        selected = ( on_holiday == option ) & ~is_business_day
+        if selected.any() :
+            shifted[selected] = np.busday_offset(dates[selected], 0, roll=roll, holidays=holidays).astype(np.int64)
+
+    return shifted, ~( ( on_holiday == "skip" ) & ~is_business_day )
+
+
+@timed
+def expand_recurrence_rules(
+        periodics: pd.DataFrame,
+        period_start: datetime,
+        period_end: datetime,
+        holidays: pd.DataFrame|None=None) -> pd.DataFrame :
+    """
+    Occurences of the periodics with a rule over [period_start, period_end), in the columns of get_all_periodics_in_period.
+    Rules are compiled once, then each kind of rule is expanded for all its periodics at once with numpy :
+    no loop over periodics nor occurences.
+    holidays has a date column, weekends are never business days.
+    """
+
+    rules = get_rules(periodics)
+    periodics = periodics[rules != ""]
+    compiled = [compile_rule(rule) for rule in rules[rules != ""]]
+
+    if len(periodics) == 0 :
+        return pd.DataFrame(columns=OCCURENCES_COLUMNS)
+
+    holiday_days = np.array([], dtype="datetime64[D]") if holidays is None else holidays["date"].dropna().to_numpy().astype("datetime64[D]")
+    on_holiday = (
+        periodics["on_holiday"].astype(object).fillna("").astype(str).to_numpy()
+        if "on_holiday" in periodics.columns else np.full(len(periodics), "")
+    )
+
+    start_day = np.datetime64(period_start, "D").astype(np.int64)
+    end_day = np.datetime64(period_end, "D").astype(np.int64)
+    margin = np.where(np.isin(on_holiday, ["next", "previous"]), HOLIDAY_SHIFT_MARGIN_DAYS, 0)
+
+    first_days = _to_days(periodics["first"].fillna(pd.Timestamp(period_start)))
+    last_days = _to_days(periodics["last"].fillna(pd.Timestamp(period_end)))
+    window_start = np.maximum(first_days, start_day - margin)
+    window_end = np.minimum(last_days + 1, end_day + margin)
+    months_step = np.maximum(periodics["months"].fillna(0).to_numpy(dtype=np.int64), 1)
+
+    kinds = np.array([r.kind for r in compiled])
+    all_rows, all_days = [np.array([], dtype=np.int64)], [np.array([], dtype=np.int64)]
+
+    for kind in np.unique(kinds) :
+        selected = np.flatnonzero(( kinds == kind ) & ( window_start < window_end ))
+        if len(selected) == 0 :
+            continue
+
+        rows, days = _GENERATORS[kind](
+            selected,
+            [compiled[i] for i in selected],
+            window_start[selected],
+            window_end[selected],
+            first_days[selected],
+            months_step[selected],
+            holiday_days,
+        )
+
+        # Months of the window may start before or end after it
+        inside = ( days >= window_start[rows] ) & ( days < window_end[rows] )
+        all_rows.append(rows[inside])
+        all_days.append(days[inside])
+
+    rows, days = np.concatenate(all_rows), np.concatenate(all_days)
+
+    days, kept = _shift_holidays(days, on_holiday[rows], holiday_days)
+    kept &= ( days >= start_day ) & ( days < end_day )
+    rows, days = rows[kept], days[kept]
+
+    order = np.lexsort((days, rows))
+    rows, days = rows[order], days[order]
+
+    # Compacted before the take, so that categories and tag lists are shared by the occurences of a periodic
+    source = compact_frame(periodics[["category", "tags", "description", "amount", "id"]].rename(columns={"id": "periodic_id"}))
+
+    occurences = pd.DataFrame({col: source[col].array.take(rows) for col in source.columns})
+    occurences.insert(4, "date", days.astype("datetime64[D]").astype("datetime64[ns]"))
+
+    return occurences
+
+# endregion
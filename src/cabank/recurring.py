@@ -0,0 +1,149 @@
+from dateutil.relativedelta import relativedelta
+import uuid
+import numpy as np
+import pandas as pd
+from cabank.utils import safe_concat
+from cabank.balance import get_all_occurences_in_period
+from cabank.search import tokenize
+
+RECURRING_MIN_OCCURENCES = 3
+RECURRING_MONTHS_INTERVALS = [1, 2, 3, 4, 6, 12]
+RECURRING_MIN_DAYS_INTERVAL = 7
+# Tolerated shift of the payment date, in days
+RECURRING_MONTHS_TOLERANCE = 3
+RECURRING_DAYS_TOLERANCE = 1
+
+PROPOSALS_COLUMNS = ["category", "tags", "description", "amount", "first", "last", "days", "months", "id", "currency", "rule", "on_holiday", "count", "ponctual_ids"]
+
+
+def get_description_key(descriptions: pd.Series) -> pd.Series :
+    """
+    Words of the description without numbers (dates, references...), so that "Netflix 03/2024" matches "NETFLIX 04/2024".
+    """
+
+    return tokenize(descriptions).map(lambda words: " ".join(w for w in words if not w.isdigit()))
+
+
+# region DETECTION
+
+def detect_recurring_ponctuals(ponctuals: pd.DataFrame) -> pd.DataFrame :
+    """
+    Groups ponctuals by category, description key and amount, then keeps the groups paid at a regular interval :
+    the same day of the month every few months, or every few days.
+    Returns proposals in the periodics.csv schema (amounts are signed like periodics),
+    with the number of matched ponctuals and their ids.
+    """
+
+    if len(ponctuals) == 0 :
+        return pd.DataFrame(columns=PROPOSALS_COLUMNS)
+
+    items = pd.DataFrame({
+        "date": ponctuals["date"].dt.normalize(),
+        "category": ponctuals["category"].astype(str),
+        "key": get_description_key(ponctuals["description"]),
+        "amount": ponctuals["amount"].astype(float).round(2),
+        "id": ponctuals["id"].astype(str),
+    }, index=ponctuals.index)
+    items = items[items["key"] != ""].sort_values(["category", "key", "amount", "date"], kind="stable")
+
+    group_keys = ["category", "key", "amount"]
+    groups = items.groupby(group_keys, sort=False)
+
+    # Intervals with the previous ponctual of the same group
+    items["days_diff"] = groups["date"].diff().dt.days
+    month_index = items["date"].dt.year * 12 + items["date"].dt.month
+    items["months_diff"] = month_index.groupby([items[k] for k in group_keys], sort=False).diff()
+    items["day_of_month"] = items["date"].dt.day
+
+    stats = groups.agg(
+        count=("date", "size"),
+        first=("date", "min"),
+        last=("date", "max"),
+        days_min=("days_diff", "min"),
+        days_max=("days_diff", "max"),
+        months_min=("months_diff", "min"),
+        months_max=("months_diff", "max"),
+        day_min=("day_of_month", "min"),
+        day_max=("day_of_month", "max"),
+    )
+    stats = stats[stats["count"] >= RECURRING_MIN_OCCURENCES]
+
+    # Same day of the month, every n months
+    monthly = (
+        ( stats["months_min"] == stats["months_max"] ) &
+        ( stats["months_min"].isin(RECURRING_MONTHS_INTERVALS) ) &
+        ( stats["day_max"] - stats["day_min"] <= RECURRING_MONTHS_TOLERANCE )
+    )
+
+    # Every n days
+    daily = (
+        ( ~monthly ) &
+        ( stats["days_min"] >= RECURRING_MIN_DAYS_INTERVAL ) &
+        ( stats["days_max"] - stats["days_min"] <= 2 * RECURRING_DAYS_TOLERANCE )
+    )
+
+    stats = stats.assign(
+        months=np.where(monthly, stats["months_min"], 0).astype(int),
+        days=np.where(daily, np.rint(( stats["last"] - stats["first"] ).dt.days / ( stats["count"] - 1 )), 0).astype(int),
+    )
+    stats = stats[monthly | daily]
+
+    if len(stats) == 0 :
+        return pd.DataFrame(columns=PROPOSALS_COLUMNS)
+
+    # Description and tags of the latest ponctual of each group
+    latest = items.groupby(group_keys, sort=False).tail(1)
+    latest = pd.Series(latest.index, index=pd.MultiIndex.from_frame(latest[group_keys]))
+    latest_rows = ponctuals.loc[latest.loc[stats.index].to_numpy()]
+
+    matched_ids = groups["id"].agg(list)
+
+    tolerance = np.where(stats["months"] > 0, RECURRING_MONTHS_TOLERANCE, RECURRING_DAYS_TOLERANCE)
+
+    proposals = pd.DataFrame({
+        "category": stats.index.get_level_values("category"),
+        "tags": [t if isinstance(t, list) else [] for t in latest_rows["tags"]],
+        "description": latest_rows["description"].to_numpy(),
+        "amount": -stats.index.get_level_values("amount").to_numpy(),
+        "first": stats["first"].to_numpy(),
+        "last": ( stats["last"] + pd.to_timedelta(tolerance, unit="D") ).to_numpy(),
+        "days": stats["days"].to_numpy(),
+        "months": stats["months"].to_numpy(),
+        "id": [str(uuid.uuid4()) for _ in range(len(stats))],
+        "currency": latest_rows["currency"].astype(object).fillna("").astype(str).to_numpy() if "currency" in latest_rows.columns else "",
+        # Detected on days and months intervals only
+        "rule": "",
+        "on_holiday": "",
+        "count": stats["count"].to_numpy(),
+        "ponctual_ids": matched_ids.loc[stats.index].to_list(),
+    })
+
+    # The periodic must give exactly as many payments as the matched ponctuals, so that the balance stays the same
+    occurences_count = proposals.apply(
+        lambda p: len(get_all_occurences_in_period(p, p["first"], p["last"] + relativedelta(days=1))),
+        axis=1,
+    )
+
+    return proposals[occurences_count == proposals["count"]].sort_values("count", ascending=False).reset_index(drop=True)
+
+# endregion
+
+
+# region ACCEPTANCE
+
+def accept_recurring_proposals(
+        periodics: pd.DataFrame,
+        ponctuals: pd.DataFrame,
+        proposals: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame] :
+    """
+    New periodics and ponctuals : the proposals are added as periodics and their ponctuals are removed in bulk.
+    """
+
+    matched_ids = set(proposals["ponctual_ids"].explode().dropna())
+
+    new_periodics = safe_concat(periodics, proposals[list(periodics.columns)])
+    new_ponctuals = ponctuals[~ponctuals["id"].astype(str).isin(matched_ids)].reset_index(drop=True)
+
+    return new_periodics, new_ponctuals
+
+# endregion
@@ -0,0 +1,209 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from html import escape
+from pathlib import Path
+from dateutil.relativedelta import relativedelta
+from typing import NamedTuple
+import math
+import os
+from cabank.balance import get_provisions
+from cabank.storage import get_user_store
+from cabank.pipeline import (
+    compute_user_period_results,
+    get_user_adjustments,
+)
+from cabank.charts import (
+    build_daily_balance_figure,
+    build_sankey_figure,
+    build_amount_by_cat_figure,
+    build_provisions_figure,
+)
+
+# include_plotlyjs of plotly : inline (self-contained), directory (one plotly.min.js next to the reports) or cdn
+PLOTLYJS_MODES = {"inline": True, "directory": "directory", "cdn": "cdn"}
+
+REPORT_TEMPLATE = """<!DOCTYPE html>
+<html lang="fr">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>body {{ font-family: sans-serif; margin: 2em; }} td {{ padding: 0 1em; }}</style>
+</head>
+<body>
+<h1>{title}</h1>
+{body}
+</body>
+</html>
+"""
+
+
+class ReportTask(NamedTuple) :
+    """
+    Everything a worker process needs to write one report, picklable.
+    """
+    user: str
+    period_start: datetime
+    period_end: datetime
+    budget: str|None
+    categories_colors: dict[str, str]
+    money_symbol: str
+    today: datetime
+    path: Path
+    plotlyjs: str
+
+
+def get_report_periods(
+        start: datetime,
+        end: datetime,
+        months: int=1) -> list[tuple[datetime, datetime]] :
+    """
+    Consecutive periods of the given number of months, from start until end (excluded).
+    """
+
+    periods = []
+    period_start = start
+    while period_start < end :
+        periods.append(( period_start, period_start + relativedelta(months=months) ))
+        period_start += relativedelta(months=months)
+
+    return periods
+
+
+def _format_amount(
+        amount: float,
+        money_symbol: str) -> str :
+    return f"{amount:,.2f} {money_symbol}".replace(",", " ")
+
+
+def write_period_report(task: ReportTask) -> Path :
+    """
+    Balance, Sankey, categories and provisions charts of one period, in one html file.
+    """
+
+    store = get_user_store(task.user)
+    # The offset is computed for the period like in the app, from the last checkpoint
+    results = compute_user_period_results(
+        store=store,
+        period_start=task.period_start,
+        period_end=task.period_end,
+        budget=task.budget,
+    )
+    provisions = get_provisions(
+        period_start=task.period_start,
+        period_end=task.period_end,
+        periodics=store.get("periodics.csv"),
+        modify_periodic_occurences=store.get("periodic_occurences_modifications.json"),
+        rates=store.get("rates.csv"),
+        holidays=store.get("holidays.csv"),
+    )
+    total_provision = math.ceil(-provisions["provision"].sum())
+
+    figures = [
+        build_daily_balance_figure(
+            daily_balance=results.daily_balance,
+            period=results.period,
+            today=task.today,
+            offset=results.offset,
+            categories_colors=task.categories_colors,
+            money_symbol=task.money_symbol,
+            budget_name=task.budget,
+            budget_balance=results.budget_balance,
+            budget_period=results.budget_period,
+        ),
+        build_sankey_figure(
+            period=results.period,
+            categories_colors=task.categories_colors,
+            money_symbol=task.money_symbol,
+        ),
+        build_amount_by_cat_figure(
+            period=results.period,
+            categories_colors=task.categories_colors,
+            money_symbol=task.money_symbol,
+            budget_name=task.budget,
+            budget_period=results.budget_period,
+        ),
+        build_provisions_figure(
+            provisions=provisions,
+            total_provision=total_provision,
+            money_symbol=task.money_symbol,
+        ),
+    ]
+
+    closing_balance = float(results.daily_balance["balance"].iloc[-1])
+    summary = "".join(
+        f"<tr><td>{label}</td><td>{_format_amount(amount, task.money_symbol)}</td></tr>"
+        for label, amount in [("Solde initial", results.offset), ("Solde final", closing_balance), ("Provisions conseillées", total_provision)]
+    )
+
+    # plotly.js is only included with the first figure
+    charts = "\n".join(
+        fig.to_html(full_html=False, include_plotlyjs=PLOTLYJS_MODES[task.plotlyjs] if i == 0 else False)
+        for i, fig in enumerate(figures)
+    )
+
+    title = f"Bilan du {task.period_start:%d/%m/%Y} au {( task.period_end - relativedelta(days=1) ):%d/%m/%Y}"
+    task.path.write_text(
+        REPORT_TEMPLATE.format(title=escape(title), body=f"<table>{summary}</table>\n{charts}"),
+        encoding="utf-8",
+    )
+
+    return task.path
+
+
+def write_period_reports(
+        user: str,
+        periods: list[tuple[datetime, datetime]],
+        output_dir: Path,
+        categories_colors: dict[str, str],
+        money_symbol: str,
+        budget: str|None=None,
+        workers: int|None=None,
+        plotlyjs: str="inline") -> list[Path] :
+    """
+    One report per period, written by a pool of processes (workers=1 writes them in this process),
+    and an index.html linking them.
+    """
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    if plotlyjs == "directory" :
+        from plotly.offline import get_plotlyjs
+        ( output_dir / "plotly.min.js" ).write_text(get_plotlyjs(), encoding="utf-8")
+
+    # Persisted adjustments are brought up to date once, instead of by every worker at the same time
+    get_user_adjustments(get_user_store(user))
+
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    tasks = [
+        ReportTask(
+            user=user,
+            period_start=period_start,
+            period_end=period_end,
+            budget=budget,
+            categories_colors=categories_colors,
+            money_symbol=money_symbol,
+            today=today,
+            path=output_dir / f"{period_start:%Y-%m-%d}.html",
+            plotlyjs=plotlyjs,
+        )
+        for period_start, period_end in periods
+    ]
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 :
+        paths = [write_period_report(task) for task in tasks]
+    else :
+        with ProcessPoolExecutor(max_workers=workers) as executor :
+            # Chunks, so that each worker loads the user data once for several periods
+            paths = list(executor.map(write_period_report, tasks, chunksize=max(1, len(tasks) // ( 4 * workers ))))
+
+    links = "".join(
+        f'<li><a href="{path.name}">{task.period_start:%d/%m/%Y} - {( task.period_end - relativedelta(days=1) ):%d/%m/%Y}</a></li>'
+        for task, path in zip(tasks, paths)
+    )
+    ( output_dir / "index.html" ).write_text(
+        REPORT_TEMPLATE.format(title="Bilans", body=f"<ul>{links}</ul>"),
+        encoding="utf-8",
+    )
+
+    return paths
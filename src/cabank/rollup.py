@@ -0,0 +1,274 @@
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+import numpy as np
+import pandas as pd
+from cabank.utils import safe_concat
+from cabank.balance import (
+    get_real_period,
+    get_budget_period,
+)
+from cabank.storage import UserStore
+from cabank.pipeline import (
+    get_account_ponctuals,
+    get_user_adjustments,
+)
+from cabank.archive import (
+    get_archived_ponctuals,
+    get_first_archived_day,
+)
+
+ALL_TAGS = "*"
+SCENARIO_REAL = "real"
+FLOW_INCOME = "income"
+FLOW_EXPENSE = "expense"
+
+ROLLUP_COLUMNS = ["month", "category", "tag", "scenario", "flow", "amount"]
+ROLLUP_FUTURE_MONTHS = 12
+
+
+def get_month_start(day: datetime) -> datetime :
+    return datetime(day.year, day.month, 1)
+
+
+# region BUILD
+
+def rollup_ledger(
+        ledger: pd.DataFrame,
+        scenario: str) -> pd.DataFrame :
+    """
+    Sums of an expanded ledger by (month, category, tag, flow).
+    Every row is counted once with tag=ALL_TAGS, and once for each of its tags.
+    """
+
+    ledger = ledger[ledger["is_ignored"] == False]
+
+    if len(ledger) == 0 :
+        return pd.DataFrame(columns=ROLLUP_COLUMNS)
+
+    base = pd.DataFrame({
+        "month": ledger["date"].dt.to_period("M").dt.to_timestamp(),
+        "category": ledger["category"].astype(str),
+        "tag": ledger["tags"],
+        "flow": np.where(ledger["amount"] >= 0, FLOW_INCOME, FLOW_EXPENSE),
+        "amount": ledger["amount"].astype(float),
+    })
+
+    all_tags = base.assign(tag=ALL_TAGS)
+    by_tag = base.explode("tag").dropna(subset=["tag"])
+
+    rollup = (
+        pd.concat([all_tags, by_tag])
+        .groupby(["month", "category", "tag", "flow"], as_index=False)["amount"]
+        .sum()
+    )
+    rollup["scenario"] = scenario
+
+    return rollup[ROLLUP_COLUMNS]
+
+
+def _rollup_real(
+        store: UserStore,
+        months_start: datetime,
+        months_end: datetime) -> pd.DataFrame :
+
+    ledger = get_real_period(
+        period_start=months_start,
+        period_end=months_end,
+        periodics=store.get("periodics.csv"),
+        ponctuals=safe_concat(
+            get_archived_ponctuals(store, months_start, months_end),
+            safe_concat(get_account_ponctuals(store), get_user_adjustments(store)),
+        ),
+        modify_periodic_occurences=store.get("periodic_occurences_modifications.json"),
+        rates=store.get("rates.csv"),
+        holidays=store.get("holidays.csv"),
+    )
+
+    return rollup_ledger(ledger, SCENARIO_REAL)
+
+
+def _rollup_budget(
+        store: UserStore,
+        budget: str,
+        months_start: datetime,
+        months_end: datetime) -> pd.DataFrame :
+
+    ledger = get_budget_period(
+        period_start=months_start,
+        period_end=months_end,
+        periodics=store.get("periodics.csv"),
+        budget_periodics=store.get(f"budgets/{budget}/periodics.csv"),
+        budget_ponctuals=store.get(f"budgets/{budget}/ponctuals.csv"),
+        rates=store.get("rates.csv"),
+        holidays=store.get("holidays.csv"),
+    )
+
+    return rollup_ledger(ledger, budget)
+
+# endregion
+
+
+# region MATERIALIZED ROLLUP
+
+class MonthlyRollup :
+    """
+    Sums of the real and budget ledgers by (month, category, tag, scenario, flow), over [months_start, months_end).
+    The scenario is SCENARIO_REAL or the name of a budget.
+    """
+
+    def __init__(
+            self,
+            data: pd.DataFrame,
+            months_start: datetime,
+            months_end: datetime) :
+        self.data = data
+        self.months_start = months_start
+        self.months_end = months_end
+
+    @property
+    def scenarios(self) -> list[str] :
+        return list(self.data["scenario"].unique())
+
+    @property
+    def tags(self) -> list[str] :
+        return sorted(t for t in self.data["tag"].unique() if t != ALL_TAGS)
+
+    def get_monthly_series(
+            self,
+            scenario: str,
+            flow: str,
+            months_start: datetime|None=None,
+            months_end: datetime|None=None,
+            tag: str=ALL_TAGS) -> pd.DataFrame :
+        """
+        One column per category, one row per month (months without data are filled with 0).
+        """
+
+        months_start = self.months_start if months_start is None else max(months_start, self.months_start)
+        months_end = self.months_end if months_end is None else min(months_end, self.months_end)
+
+        rows = self.data[
+            ( self.data["scenario"] == scenario ) &
+            ( self.data["flow"] == flow ) &
+            ( self.data["tag"] == tag ) &
+            ( self.data["month"] >= months_start ) &
+            ( self.data["month"] < months_end )
+        ]
+
+        all_months = pd.date_range(months_start, months_end, freq="MS", inclusive="left")
+
+        return (
+            rows.pivot_table(index="month", columns="category", values="amount", aggfunc="sum", fill_value=0.)
+            .reindex(all_months, fill_value=0.)
+        )
+
+
+def build_rollup(
+        store: UserStore,
+        today: datetime) -> MonthlyRollup :
+
+    ponctuals = store.get("ponctuals.csv")
+    periodics = store.get("periodics.csv")
+    checkpoints = store.get("checkpoints.csv")
+
+    first_dates = [d.min() for d in [ponctuals["date"], periodics["first"], checkpoints["date"]] if len(d) > 0]
+    # Closed years left the live files, their months are rolled up from the archives
+    if not ( first_archived_day := get_first_archived_day(store) ) is None :
+        first_dates.append(first_archived_day)
+    months_start = get_month_start(min(first_dates) if first_dates else today)
+    months_end = get_month_start(today) + relativedelta(months=ROLLUP_FUTURE_MONTHS + 1)
+
+    data = _rollup_real(store, months_start, months_end)
+    for budget in store.get_budget_names() :
+        data = safe_concat(data, _rollup_budget(store, budget, months_start, months_end))
+
+    return MonthlyRollup(data, months_start, months_end)
+
+
+def update_rollup(
+        store: UserStore,
+        rollup: MonthlyRollup,
+        changes: list[tuple[str|None, tuple[datetime, datetime]|None]],
+        today: datetime) -> MonthlyRollup :
+    """
+    Only the months touched by the changes are recomputed : the saved range and the old and new months
+    of the rows moved out of it, as logged by the store.
+    Checkpoint adjustments spread an edit over its whole checkpoint interval, so it is recomputed too.
+    Periodics and checkpoints changes rebuild everything.
+    """
+
+    real_ranges = []
+    budgets = set()
+
+    for name, changed_range in changes :
+
+        if name in ["ponctuals.csv", "periodic_occurences_modifications.json"] and not changed_range is None :
+            real_ranges.append(changed_range)
+
+        elif ( not name is None ) and name.startswith("budgets/") :
+            budgets.add(name.split("/")[1])
+
+        else :
+            return build_rollup(store, today)
+
+    data = rollup.data
+    checkpoint_dates = store.get("checkpoints.csv")["date"]
+
+    months_ranges = []
+    for range_start, range_end in real_ranges :
+
+        # A row moved before the first month extends the rollup
+        if range_start < rollup.months_start :
+            return build_rollup(store, today)
+
+        # Enclosing checkpoints
+        before = checkpoint_dates[checkpoint_dates <= range_start]
+        after = checkpoint_dates[checkpoint_dates >= range_end]
+        range_start = before.iloc[-1] if len(before) > 0 else rollup.months_start
+        range_end = after.iloc[0] + relativedelta(days=1) if len(after) > 0 else rollup.months_end
+
+        months_start = max(get_month_start(range_start), rollup.months_start)
+        months_end = min(get_month_start(range_end - relativedelta(days=1)) + relativedelta(months=1), rollup.months_end)
+        if months_start < months_end :
+            months_ranges.append((months_start, months_end))
+
+    # A save logs the old and new months of its moved rows, often in the same checkpoint interval
+    coalesced = []
+    for months_start, months_end in sorted(months_ranges) :
+        if coalesced and months_start <= coalesced[-1][1] :
+            coalesced[-1] = ( coalesced[-1][0], max(coalesced[-1][1], months_end) )
+        else :
+            coalesced.append((months_start, months_end))
+
+    for months_start, months_end in coalesced :
+
+        outdated = (
+            ( data["scenario"] == SCENARIO_REAL ) &
+            ( data["month"] >= months_start ) &
+            ( data["month"] < months_end )
+        )
+        data = safe_concat(data[~outdated], _rollup_real(store, months_start, months_end))
+
+    for budget in budgets :
+        data = safe_concat(
+            data[data["scenario"] != budget],
+            _rollup_budget(store, budget, rollup.months_start, rollup.months_end)
+        )
+
+    return MonthlyRollup(data, rollup.months_start, rollup.months_end)
+
+
+def get_user_rollup(
+        store: UserStore,
+        today: datetime) -> MonthlyRollup :
+    """
+    Materialized once per user and month, shared between sessions and updated on save.
+    """
+
+    return store.get_materialized(
+        ("rollup", get_month_start(today)),
+        build=lambda: build_rollup(store, today),
+        update=lambda rollup, changes: update_rollup(store, rollup, changes, today),
+    )
+
+# endregion
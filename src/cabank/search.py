@@ -0,0 +1,327 @@
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+import numpy as np
+import pandas as pd
+from cabank.utils import safe_concat
+from cabank.balance import get_real_period
+from cabank.storage import UserStore
+from cabank.archive import (
+    get_archived_ponctuals,
+    get_first_archived_day,
+)
+
+SEARCH_FUTURE_MONTHS = 12
+SEARCH_COLUMNS = ["date", "category", "tags", "description", "amount", "id", "periodic_id", "is_ignored"]
+
+
+def tokenize(text: pd.Series) -> pd.Series :
+    """
+    Lower case words without accents, one list per row.
+    """
+
+    return (
+        text.fillna("").astype(str)
+        .str.normalize("NFKD")
+        .str.encode("ascii", errors="ignore")
+        .str.decode("ascii")
+        .str.lower()
+        .str.findall(r"[a-z0-9]+")
+    )
+
+
+def _drop_repeated(values: pd.Series) -> pd.Series :
+    """
+    Exploded values, without the repetitions inside a row (ex: "Amazon amazon order") :
+    a row appears once in the postings of each of its values.
+    """
+
+    return values[~values.to_frame("value").reset_index().duplicated().to_numpy()]
+
+
+def _merge_postings(
+        postings: dict[str, np.ndarray],
+        keys: pd.Series,
+        positions: np.ndarray) :
+    """
+    keys and positions are aligned, postings are updated in place.
+    """
+
+    keys = keys.reset_index(drop=True)
+    for key, idx in keys.groupby(keys).indices.items() :
+        new = positions[idx]
+        postings[key] = new if key not in postings else np.concatenate([postings[key], new])
+
+
+def _union(
+        postings: dict[str, np.ndarray],
+        keys: list[str]) -> np.ndarray :
+
+    found = [postings[k] for k in keys if k in postings]
+
+    if len(found) == 0 :
+        return np.zeros(0, dtype=int)
+
+    # Postings are already sorted and unique
+    if len(found) == 1 :
+        return found[0]
+
+    return np.unique(np.concatenate(found))
+
+
+# region INDEX
+
+class SearchIndex :
+    """
+    Inverted index of a ledger (ponctuals and expanded periodics, signed like a period).
+    Rows are only appended : removed rows are flagged, so that positions in the postings stay valid.
+    Like the datasets of the store, an index that may be shared is copied before being updated.
+
+    Description words, tags and categories have postings (sorted positions of the rows),
+    dates and amounts are filtered on the candidates with numpy.
+    """
+
+    def __init__(self) :
+        self.rows = pd.DataFrame(columns=SEARCH_COLUMNS)
+        self._alive = np.zeros(0, dtype=bool)
+        self._dates = np.zeros(0, dtype="datetime64[ns]")
+        self._amounts = np.zeros(0, dtype=float)
+        self._words: dict[str, np.ndarray] = {}
+        self._tags: dict[str, np.ndarray] = {}
+        self._categories: dict[str, np.ndarray] = {}
+        self._vocabulary = np.array([], dtype=str)
+
+    def copy(self) -> "SearchIndex" :
+        """
+        Arrays are never modified in place, so they are shared with the copy.
+        """
+
+        index = SearchIndex()
+        index.__dict__.update(self.__dict__)
+        index._words = dict(self._words)
+        index._tags = dict(self._tags)
+        index._categories = dict(self._categories)
+
+        return index
+
+    def __len__(self) -> int :
+        return int(self._alive.sum())
+
+    @property
+    def tags(self) -> list[str] :
+        return sorted(tag for tag, positions in self._tags.items() if self._alive[positions].any())
+
+    def add(self, ledger: pd.DataFrame) :
+
+        if len(ledger) == 0 :
+            return
+
+        ledger = ledger.reindex(columns=SEARCH_COLUMNS).reset_index(drop=True)
+        positions = np.arange(len(self.rows), len(self.rows) + len(ledger))
+
+        self.rows = safe_concat(self.rows, ledger)
+        self._alive = np.concatenate([self._alive, np.ones(len(ledger), dtype=bool)])
+        self._dates = np.concatenate([self._dates, ledger["date"].to_numpy(dtype="datetime64[ns]")])
+        self._amounts = np.concatenate([self._amounts, ledger["amount"].to_numpy(dtype=float)])
+
+        words = _drop_repeated(tokenize(ledger["description"]).explode().dropna())
+        _merge_postings(self._words, words, positions[words.index.to_numpy()])
+
+        tags = _drop_repeated(ledger["tags"].map(lambda t: t if isinstance(t, list) else []).explode().dropna().astype(str))
+        _merge_postings(self._tags, tags, positions[tags.index.to_numpy()])
+
+        _merge_postings(self._categories, ledger["category"].astype(str), positions)
+
+        self._vocabulary = np.array(sorted(self._words), dtype=str)
+
+    def remove(
+            self,
+            range_start: datetime,
+            range_end: datetime) :
+        """
+        Every row dated in [range_start, range_end).
+        """
+
+        self._alive = self._alive & ~( ( self._dates >= np.datetime64(range_start) ) & ( self._dates < np.datetime64(range_end) ) )
+
+    def _get_word_positions(self, word: str) -> np.ndarray :
+        """
+        Rows with a word starting with the given one.
+        """
+
+        start = np.searchsorted(self._vocabulary, word, side="left")
+        end = np.searchsorted(self._vocabulary, word + "\uffff", side="left")
+
+        return _union(self._words, self._vocabulary[start:end])
+
+    def search(
+            self,
+            text: str|None=None,
+            tags: list[str]|None=None,
+            categories: list[str]|None=None,
+            date_min: datetime|None=None,
+            date_max: datetime|None=None,
+            amount_min: float|None=None,
+            amount_max: float|None=None) -> pd.DataFrame :
+        """
+        Every word of text must start a word of the description.
+        Any of the tags, any of the categories.
+        Boundaries are included, amounts are compared in absolute value (a 30 € expense matches 20 to 50).
+        """
+
+        candidates = None
+
+        def _intersect(positions: np.ndarray) -> np.ndarray :
+            return positions if candidates is None else np.intersect1d(candidates, positions, assume_unique=True)
+
+        if text :
+            for word in tokenize(pd.Series([text])).iloc[0] :
+                candidates = _intersect(self._get_word_positions(word))
+
+        if tags :
+            candidates = _intersect(_union(self._tags, tags))
+
+        if categories :
+            candidates = _intersect(_union(self._categories, categories))
+
+        if candidates is None :
+            candidates = np.arange(len(self._alive))
+
+        mask = self._alive[candidates]
+
+        if not date_min is None :
+            mask &= self._dates[candidates] >= np.datetime64(pd.Timestamp(date_min))
+
+        if not date_max is None :
+            mask &= self._dates[candidates] < np.datetime64(pd.Timestamp(date_max) + pd.Timedelta(days=1))
+
+        if not amount_min is None :
+            mask &= np.abs(self._amounts[candidates]) >= amount_min
+
+        if not amount_max is None :
+            mask &= np.abs(self._amounts[candidates]) <= amount_max
+
+        found = candidates[mask]
+        found = found[np.argsort(self._dates[found], kind="stable")]
+
+        return self.rows.iloc[found]
+
+# endregion
+
+
+# region USER INDEX
+
+def _get_ledger(
+        store: UserStore,
+        range_start: datetime,
+        range_end: datetime) -> pd.DataFrame :
+
+    return get_real_period(
+        period_start=range_start,
+        period_end=range_end,
+        periodics=store.get("periodics.csv"),
+        ponctuals=safe_concat(
+            get_archived_ponctuals(store, range_start, range_end, with_adjustments=False),
+            store.get("ponctuals.csv"),
+        ),
+        modify_periodic_occurences=store.get("periodic_occurences_modifications.json"),
+        rates=store.get("rates.csv"),
+        holidays=store.get("holidays.csv"),
+    )
+
+
+def _get_index_range(
+        store: UserStore,
+        today: datetime) -> tuple[datetime, datetime] :
+
+    ponctuals = store.get("ponctuals.csv")
+    periodics = store.get("periodics.csv")
+
+    first_dates = [d.min() for d in [ponctuals["date"], periodics["first"]] if len(d) > 0]
+    if not ( first_archived_day := get_first_archived_day(store) ) is None :
+        first_dates.append(first_archived_day)
+    range_start = min(first_dates) if first_dates else today
+    range_start = range_start.replace(hour=0, minute=0, second=0, microsecond=0)
+    range_end = datetime(today.year, today.month, 1) + relativedelta(months=SEARCH_FUTURE_MONTHS + 1)
+
+    return range_start, range_end
+
+
+def build_search_index(
+        store: UserStore,
+        today: datetime) -> SearchIndex :
+
+    index = SearchIndex()
+    index.add(_get_ledger(store, *_get_index_range(store, today)))
+
+    return index
+
+
+def update_search_index(
+        store: UserStore,
+        index: SearchIndex,
+        changes: list[tuple[str|None, tuple[datetime, datetime]|None]],
+        today: datetime) -> SearchIndex :
+    """
+    Ponctuals and modifications saved over a range only reindex that range.
+    Periodics change every occurence, so they rebuild the index. Checkpoints and budgets are not indexed.
+    """
+
+    ranges = []
+
+    for name, changed_range in changes :
+
+        if name in ["ponctuals.csv", "periodic_occurences_modifications.json"] and not changed_range is None :
+            ranges.append(changed_range)
+
+        elif ( not name is None ) and ( name == "checkpoints.csv" or name.startswith("budgets/") ) :
+            continue
+
+        else :
+            return build_search_index(store, today)
+
+    # Other sessions may be searching the current index
+    index = index.copy()
+
+    for range_start, range_end in ranges :
+        index.remove(range_start, range_end)
+        index.add(_get_ledger(store, range_start, range_end))
+
+    return index
+
+
+def get_user_search_index(
+        store: UserStore,
+        today: datetime) -> SearchIndex :
+    """
+    Built once per user and month, shared between sessions and updated on save.
+    """
+
+    month_start = datetime(today.year, today.month, 1)
+
+    return store.get_materialized(
+        ("search_index", month_start),
+        build=lambda: build_search_index(store, month_start),
+        update=lambda index, changes: update_search_index(store, index, changes, month_start),
+    )
+
+# endregion
+
+
+# region CHARTS
+
+def get_cumulative_balance(rows: pd.DataFrame) -> pd.DataFrame :
+    """
+    Running total of the found rows, day by day, like a daily balance starting at 0.
+    """
+
+    spent = rows[rows["is_ignored"] == False]
+    if len(spent) == 0 :
+        return pd.DataFrame({"date": pd.Series(dtype="datetime64[ns]"), "balance": pd.Series(dtype=float)})
+
+    days = spent["date"].dt.normalize()
+    all_days = pd.date_range(days.min() - pd.Timedelta(days=1), days.max(), freq="D")
+    daily = spent["amount"].astype(float).groupby(days).sum().reindex(all_days, fill_value=0.)
+
+    return pd.DataFrame({"date": all_days, "balance": daily.cumsum().to_numpy()})
+
+# endregion
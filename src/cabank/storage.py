@@ -0,0 +1,793 @@
+from platformdirs import user_data_dir, user_config_dir
+from importlib import resources
+from pathlib import Path
+from functools import cache
+from contextlib import contextmanager
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+from threading import RLock
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Iterator,
+)
+import json
+import shutil
+import sys
+import pandas as pd
+from cabank.utils import (
+    format_datetime,
+    combine_and_save_csv,
+    fill_missing_ids,
+    compact_frame,
+    expand_frame,
+    safe_concat,
+    merge_frames,
+    merge_nested,
+    get_changed_dates,
+)
+from cabank.timing import timed
+
+if sys.platform == "win32" :
+    import msvcrt
+else :
+    import fcntl
+
+APP_NAME = "cabank"
+APP_AUTHOR = "ArthurCabon"
+
+DATA_PATH = Path(user_data_dir(APP_NAME, APP_AUTHOR))
+CONFIG_ROOT_PATH = Path(user_config_dir(APP_NAME, APP_AUTHOR))
+DEFAULT_CONFIG_PATH = CONFIG_ROOT_PATH / "default.json"
+
+
+@cache
+def init_app_directories() :
+    """
+    Base directories and default config, only checked once per process instead of on every rerun.
+    """
+
+    DATA_PATH.mkdir(parents=True, exist_ok=True)
+    CONFIG_ROOT_PATH.mkdir(parents=True, exist_ok=True)
+
+    if not DEFAULT_CONFIG_PATH.exists():
+        with resources.files("cabank").joinpath("data/default_config.json").open("rb") as src:
+            with DEFAULT_CONFIG_PATH.open("wb") as dst:
+                shutil.copyfileobj(src, dst)
+
+
+# region SCHEMAS
+
+CHECKPOINTS_COLUMNS = {
+    "date": "datetime64[ns]",
+    "net_position": "float64",
+}
+
+# Ledgers are held compact (see compact_frame) : categoricals and shared tag lists
+PERIODICS_COLUMNS = {
+    "category": "category",
+    "tags": "object",
+    "description": "category",
+    "amount": "float64",
+    "first": "datetime64[ns]",
+    "last": "datetime64[ns]",
+    "days": "int64",
+    "months": "int64",
+    "id": "str",
+    # Empty for the display currency
+    "currency": "category",
+    # Empty for the days and months intervals, see cabank.recurrence
+    "rule": "str",
+    "on_holiday": "str"
+}
+
+PONCTUALS_COLUMNS = {
+    "date": "datetime64[ns]",
+    "category": "category",
+    "tags": "object",
+    "description": "category",
+    "amount": "float64",
+    "id": "str",
+    "currency": "category"
+}
+
+# Value of one unit of a currency in the display currency, from its date until the next rate
+RATES_COLUMNS = {
+    "date": "datetime64[ns]",
+    "currency": "str",
+    "rate": "float64"
+}
+
+# Days without payments for the periodics with an on_holiday option, on top of weekends
+HOLIDAYS_COLUMNS = {
+    "date": "datetime64[ns]",
+    "description": "str"
+}
+
+# Between two accounts of the user, amount is positive
+TRANSFERS_COLUMNS = {
+    "date": "datetime64[ns]",
+    "from_account": "str",
+    "to_account": "str",
+    "amount": "float64",
+    "description": "str",
+    "id": "str"
+}
+
+
+def get_empty_frame(columns: dict[str, str]) -> pd.DataFrame :
+    return pd.DataFrame({col: pd.Series(dtype=col_type) for col, col_type in columns.items()})
+
+# endregion
+
+
+# region LOADERS
+
+@timed
+def load_checkpoints(path: Path) -> pd.DataFrame :
+
+    if not path.exists() :
+        return get_empty_frame(CHECKPOINTS_COLUMNS)
+
+    checkpoints = pd.read_csv(path)
+
+    # Typing
+    checkpoints["date"] = format_datetime(checkpoints["date"])
+    checkpoints["net_position"] = checkpoints["net_position"].astype(float)
+
+    return checkpoints.sort_values("date").reset_index(drop=True)
+
+
+@timed
+def load_periodics(path: Path) -> pd.DataFrame :
+
+    if not path.exists() :
+        return get_empty_frame(PERIODICS_COLUMNS)
+
+    periodics = pd.read_csv(path)
+
+    # Typing
+    periodics["category"] = periodics["category"].astype(str)
+    periodics["tags"] = periodics["tags"].astype(str).apply(json.loads)
+    periodics["description"] = periodics["description"].fillna("").astype(str)
+    periodics["amount"] = periodics["amount"].astype(float)
+    periodics["first"] = format_datetime(periodics["first"])
+    periodics["last"] = format_datetime(periodics["last"])
+    periodics["days"] = periodics["days"].fillna(0).astype(int)
+    periodics["months"] = periodics["months"].fillna(0).astype(int)
+    periodics = fill_missing_ids(periodics)
+    periodics["id"] = periodics["id"].astype(str)
+    periodics["currency"] = periodics["currency"].fillna("").astype(str) if "currency" in periodics.columns else ""
+    periodics["rule"] = periodics["rule"].fillna("").astype(str).str.strip() if "rule" in periodics.columns else ""
+    periodics["on_holiday"] = periodics["on_holiday"].fillna("").astype(str) if "on_holiday" in periodics.columns else ""
+
+    return compact_frame(periodics)
+
+
+@timed
+def load_ponctuals(path: Path) -> pd.DataFrame :
+
+    if not path.exists() :
+        return get_empty_frame(PONCTUALS_COLUMNS)
+
+    ponctuals = pd.read_csv(path)
+
+    # Typing
+    ponctuals["category"] = ponctuals["category"].astype(str)
+    ponctuals["tags"] = ponctuals["tags"].astype(str).apply(json.loads)
+    ponctuals["description"] = ponctuals["description"].fillna("").astype(str)
+    ponctuals["amount"] = ponctuals["amount"].astype(float)
+    ponctuals["date"] = format_datetime(ponctuals["date"])
+    ponctuals = fill_missing_ids(ponctuals)
+    ponctuals["id"] = ponctuals["id"].astype(str)
+    ponctuals["currency"] = ponctuals["currency"].fillna("").astype(str) if "currency" in ponctuals.columns else ""
+
+    return compact_frame(ponctuals)
+
+
+@timed
+def load_rates(path: Path) -> pd.DataFrame :
+
+    if not path.exists() :
+        return get_empty_frame(RATES_COLUMNS)
+
+    rates = pd.read_csv(path)
+
+    # Typing
+    rates["date"] = format_datetime(rates["date"]).astype("datetime64[ns]")
+    rates["currency"] = rates["currency"].astype(str).str.strip()
+    rates["rate"] = rates["rate"].astype(float)
+
+    return rates.sort_values("date").reset_index(drop=True)
+
+
+@timed
+def load_holidays(path: Path) -> pd.DataFrame :
+
+    if not path.exists() :
+        return get_empty_frame(HOLIDAYS_COLUMNS)
+
+    holidays = pd.read_csv(path)
+
+    # Typing
+    holidays["date"] = format_datetime(holidays["date"]).astype("datetime64[ns]")
+    holidays["description"] = holidays["description"].fillna("").astype(str) if "description" in holidays.columns else ""
+
+    return holidays.sort_values("date").reset_index(drop=True)
+
+
+@timed
+def load_transfers(path: Path) -> pd.DataFrame :
+
+    if not path.exists() :
+        return get_empty_frame(TRANSFERS_COLUMNS)
+
+    transfers = pd.read_csv(path)
+
+    # Typing
+    transfers["date"] = format_datetime(transfers["date"])
+    transfers["from_account"] = transfers["from_account"].astype(str)
+    transfers["to_account"] = transfers["to_account"].astype(str)
+    transfers["amount"] = transfers["amount"].astype(float)
+    transfers["description"] = transfers["description"].fillna("").astype(str)
+    transfers = fill_missing_ids(transfers)
+    transfers["id"] = transfers["id"].astype(str)
+
+    return transfers.sort_values("date").reset_index(drop=True)
+
+
+@timed
+def load_archive_summary(path: Path) -> dict[str, Any] :
+
+    if not path.exists() :
+        return {}
+
+    with open(path, "r", encoding="utf-8") as f :
+        return json.load(f)
+
+
+@timed
+def load_modifications(path: Path) -> dict[str, dict[str, float|None]] :
+
+    if not path.exists() :
+        return {}
+
+    with open(path, "r") as f :
+        return json.load(f)
+
+
+DATASET_LOADERS: dict[str, Callable[[Path], Any]] = {
+    "checkpoints.csv": load_checkpoints,
+    "periodics.csv": load_periodics,
+    "ponctuals.csv": load_ponctuals,
+    "periodic_occurences_modifications.json": load_modifications,
+    "transfers.csv": load_transfers,
+    "rates.csv": load_rates,
+    "holidays.csv": load_holidays,
+    # Archives of closed years, compressed (see cabank.archive)
+    "ponctuals.csv.gz": load_ponctuals,
+    "checkpoints.csv.gz": load_checkpoints,
+    "adjustments.csv.gz": load_ponctuals,
+    "summary.json": load_archive_summary,
+}
+
+# endregion
+
+
+# region ACCOUNTS
+
+# The user folder itself, other accounts have the same datasets in ACCOUNTS_FOLDER/<name>
+MAIN_ACCOUNT = "principal"
+ACCOUNTS_FOLDER = "accounts"
+
+
+def get_account_dataset(
+        account: str,
+        name: str) -> str :
+    """
+    Name in the store of a dataset of an account (ex: "accounts/epargne/ponctuals.csv").
+    """
+
+    if account == MAIN_ACCOUNT :
+        return name
+
+    return f"{ACCOUNTS_FOLDER}/{account}/{name}"
+
+# endregion
+
+
+# region ARCHIVES
+
+# One sub-folder per closed year in the folder of an account
+ARCHIVES_FOLDER = "archives"
+
+
+def get_archive_dataset(
+        year: int,
+        name: str,
+        account: str=MAIN_ACCOUNT) -> str :
+    """
+    Name in the store of a dataset of the archive of a year (ex: "archives/2023/ponctuals.csv.gz").
+    """
+
+    return get_account_dataset(account, f"{ARCHIVES_FOLDER}/{year}/{name}")
+
+# endregion
+
+
+# region USERS
+
+def get_user_path(user: str) -> Path :
+    """
+    Every user must be a direct sub-folder of DATA_PATH, users can't read each other's data.
+    """
+
+    data_path = DATA_PATH.resolve()
+    user_path = ( data_path / user ).resolve()
+
+    if ( not user ) or ( user_path.parent != data_path ) :
+        raise ValueError(f"Nom de compte invalide : {user!r}")
+
+    return user_path
+
+# endregion
+
+
+# region LOCKS
+
+# Saves of several sessions (same process) or several processes (app, cli) on the same dataset
+VERSION_WIDTH = 12
+
+
+class SaveConflictError(ValueError) :
+    """
+    The saved dataset changed since the edited base, and some rows were changed differently on both sides.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            keys: list[Any]=[]) :
+
+        self.name = name
+        self.keys = keys
+
+        details = f" : {', '.join(str(k) for k in keys[:5])}{'...' if len(keys) > 5 else ''}" if keys else ""
+        super().__init__(f"{name} a été modifié dans une autre session, {len(keys)} élément(s) modifié(s) des deux côtés{details}. Rechargez la page pour repartir des données enregistrées.")
+
+
+def get_version_path(path: Path) -> Path :
+    """
+    Hidden file next to a dataset with its version number, also the lock file of the dataset.
+    """
+
+    return path.parent / f".{path.name}.version"
+
+
+@contextmanager
+def lock_dataset(path: Path) -> Iterator[IO[bytes]] :
+    """
+    Exclusive lock of a dataset between processes, while it is read or written. Yields its open version file.
+    """
+
+    version_path = get_version_path(path)
+    version_path.touch(exist_ok=True)
+
+    with open(version_path, "r+b") as f :
+
+        if sys.platform == "win32" :
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, VERSION_WIDTH)
+        else :
+            fcntl.flock(f, fcntl.LOCK_EX)
+
+        try :
+            yield f
+        finally :
+            if sys.platform == "win32" :
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, VERSION_WIDTH)
+            else :
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def read_version(f: IO[bytes]) -> int :
+
+    f.seek(0)
+    content = f.read().strip()
+
+    return int(content) if content.isdigit() else 0
+
+
+def write_version(
+        f: IO[bytes],
+        version: int) :
+    """
+    Fixed width, overwritten in place : a reader without the lock sees the old or the new number.
+    """
+
+    f.seek(0)
+    f.write(str(version).rjust(VERSION_WIDTH).encode())
+    f.truncate()
+    f.flush()
+
+
+def read_saved_version(path: Path) -> int :
+    """
+    Version of a dataset without taking its lock, 0 if it was never saved through a store.
+    """
+
+    try :
+        with open(get_version_path(path), "rb") as f :
+            return read_version(f)
+    except FileNotFoundError :
+        return 0
+
+# endregion
+
+
+# region SHARED CACHE
+
+def get_changed_ranges(
+        saved_df: pd.DataFrame,
+        new_df: pd.DataFrame,
+        changed_range: tuple[datetime, datetime],
+        key: str="id") -> list[tuple[datetime, datetime]] :
+    """
+    The range given by the caller, and the months of the rows that changed outside of it
+    (ex: a row moved out of the edited period, or edited on another page of the editor).
+    """
+
+    if not all(column in df.columns for df in [saved_df, new_df] for column in ["date", key]) :
+        return [changed_range]
+
+    range_start, range_end = changed_range
+    months = sorted({
+        datetime(day.year, day.month, 1)
+        for day in get_changed_dates(saved_df, new_df, key)
+        if not ( range_start <= day < range_end )
+    })
+
+    return [changed_range] + [(month, month + relativedelta(months=1)) for month in months]
+
+
+class UserStore :
+    """
+    Process-wide cache of one user's datasets and computed values, shared by every session.
+
+    Datasets are named by their path relative to the user folder (ex: "budgets/vacances/periodics.csv").
+    They are shared between sessions so they must never be modified in place.
+    Saving a dataset through the store invalidates it, along with every computed value.
+
+    Every dataset has a version number saved next to it, increased by each save under a file lock :
+    sessions and other processes compare it to the version they started from (optimistic concurrency).
+
+    Materialized values survive invalidations : they are kept up to date incrementally
+    by reading the log of changes since their last update.
+    """
+
+    def __init__(self, user_path: Path) :
+        self.user_path = user_path
+        self._lock = RLock()
+        self._datasets: dict[str, Any] = {}
+        self._versions: dict[str, int] = {}
+        self._computed: dict[Any, Any] = {}
+        self._materialized: dict[Any, Any] = {}
+        self._changes: list[tuple[str|None, tuple[datetime, datetime]|None]] = []
+
+    def _get_dataset_path(self, name: str) -> Path :
+
+        path = ( self.user_path / name ).resolve()
+        if not path.is_relative_to(self.user_path) :
+            raise ValueError(f"Dataset hors du dossier utilisateur : {name!r}")
+
+        return path
+
+    def _get_dataset_key(self, name: str) -> str :
+        """
+        Cache key of a dataset : its resolved path relative to the user folder,
+        so that several spellings of the same file share one cached copy and one version.
+        """
+
+        return self._get_dataset_path(name).relative_to(self.user_path).as_posix()
+
+    def get_path(self, name: str) -> Path :
+        return self._get_dataset_path(name)
+
+    def get_budget_names(self) -> list[str] :
+
+        budgets_path = self.user_path / "budgets"
+        if not budgets_path.exists() :
+            return []
+
+        return sorted(p.name for p in budgets_path.iterdir() if p.is_dir())
+
+    def get_account_names(self) -> list[str] :
+        """
+        MAIN_ACCOUNT first.
+        """
+
+        accounts_path = self.user_path / ACCOUNTS_FOLDER
+        if not accounts_path.exists() :
+            return [MAIN_ACCOUNT]
+
+        return [MAIN_ACCOUNT] + sorted(p.name for p in accounts_path.iterdir() if p.is_dir() and p.name != MAIN_ACCOUNT)
+
+    def get_archive_years(self, account: str=MAIN_ACCOUNT) -> list[int] :
+
+        archives_path = self._get_dataset_path(get_account_dataset(account, ARCHIVES_FOLDER))
+        if not archives_path.exists() :
+            return []
+
+        return sorted(int(p.name) for p in archives_path.iterdir() if p.is_dir() and p.name.isdigit())
+
+    def get(self, name: str) -> Any :
+
+        name = self._get_dataset_key(name)
+
+        with self._lock :
+            if name not in self._datasets :
+                path = self._get_dataset_path(name)
+
+                if path.parent.exists() :
+                    with lock_dataset(path) as version_file :
+                        self._versions[name] = read_version(version_file)
+                        self._datasets[name] = DATASET_LOADERS[path.name](path)
+                else :
+                    self._versions[name] = 0
+                    self._datasets[name] = DATASET_LOADERS[path.name](path)
+
+            return self._datasets[name]
+
+    def get_version(self, name: str) -> int :
+        """
+        Version of the dataset as loaded by this process.
+        """
+
+        name = self._get_dataset_key(name)
+
+        with self._lock :
+            if name not in self._versions :
+                self._versions[name] = read_saved_version(self._get_dataset_path(name))
+
+            return self._versions[name]
+
+    def refresh(self) -> list[str] :
+        """
+        Drops the datasets saved by another process since they were loaded, they are reloaded on next access.
+        Returns their names. Saves of the sessions of this process already went through the store.
+        """
+
+        with self._lock :
+            outdated = [
+                name for name in self._versions
+                if read_saved_version(self._get_dataset_path(name)) != self._versions[name]
+            ]
+
+            for name in outdated :
+                self._forget(name, None)
+
+            return outdated
+
+    def get_computed(
+            self,
+            key: Any,
+            compute: Callable[[], Any]) -> Any :
+
+        with self._lock :
+            if key not in self._computed :
+                self._computed[key] = compute()
+
+            return self._computed[key]
+
+    def get_materialized(
+            self,
+            key: Any,
+            build: Callable[[], Any],
+            update: Callable[[Any, list[tuple[str|None, tuple[datetime, datetime]|None]]], Any]) -> Any :
+        """
+        update receives the current value and the changes logged since its last update.
+        A change is (dataset name, changed dates range), None meaning everything.
+        """
+
+        with self._lock :
+            if key not in self._materialized :
+                self._materialized[key] = ( build(), len(self._changes) )
+
+            value, position = self._materialized[key]
+
+            if position < len(self._changes) :
+                value = update(value, self._changes[position:])
+                self._materialized[key] = ( value, len(self._changes) )
+
+            return value
+
+    def invalidate(
+            self,
+            name: str|None=None,
+            changed_range: tuple[datetime, datetime]|None=None) :
+        """
+        name=None invalidates every dataset of the user.
+        changed_range=None means that any date may have changed.
+        Files edited outside of the store get a new version, for the other sessions and processes.
+        """
+
+        if not name is None :
+            name = self._get_dataset_key(name)
+
+        with self._lock :
+            names = list(self._datasets) if name is None else [name]
+            for n in names :
+                path = self._get_dataset_path(n)
+                if path.parent.exists() :
+                    with lock_dataset(path) as version_file :
+                        write_version(version_file, read_version(version_file) + 1)
+
+            self._forget(name, changed_range, names)
+
+    def _forget(
+            self,
+            name: str|None,
+            changed_range: tuple[datetime, datetime]|None,
+            names: list[str]|None=None) :
+
+        for n in [name] if names is None else names :
+            self._datasets.pop(n, None)
+            self._versions.pop(n, None)
+
+        self._computed.clear()
+        self._changes.append((name, changed_range))
+
+    def save_csv(
+            self,
+            name: str,
+            modified_df: pd.DataFrame,
+            isolated_df: pd.DataFrame|None=None,
+            changed_range: tuple[datetime, datetime]|None=None,
+            base_version: int|None=None,
+            base_df: pd.DataFrame|None=None,
+            key: str="id") -> int :
+        """
+        changed_range is widened to the old and new dates of the rows changed outside of it.
+        base_version is the version the edits started from. If another save came in between, the edits
+        (modified_df and isolated_df, against base_df) are merged by key with the saved rows, or SaveConflictError is raised.
+        Without base_version the file is overwritten. Returns the new version.
+        """
+
+        name = self._get_dataset_key(name)
+        path = self._get_dataset_path(name)
+
+        with self._lock, lock_dataset(path) as version_file :
+
+            version = read_version(version_file)
+            conflicting = ( not base_version is None ) and version != base_version
+
+            # The saved rows give the dates a change range must also cover, and the other side of a merge
+            saved_df = DATASET_LOADERS[path.name](path) if conflicting or not changed_range is None else None
+
+            if conflicting :
+                if base_df is None :
+                    raise SaveConflictError(name)
+
+                mine = modified_df if isolated_df is None else safe_concat(modified_df, isolated_df)
+                modified_df, conflicts = merge_frames(base_df, mine, saved_df, key)
+                isolated_df = None
+                if conflicts :
+                    raise SaveConflictError(name, conflicts)
+
+            combine_and_save_csv(
+                modified_df=modified_df,
+                isolated_df=isolated_df,
+                path=path,
+            )
+            write_version(version_file, version + 1)
+
+            if changed_range is None :
+                self._forget(name, None)
+            else :
+                new_df = modified_df if isolated_df is None else safe_concat(modified_df, isolated_df)
+                for logged_range in get_changed_ranges(saved_df, new_df, changed_range, key) :
+                    self._forget(name, logged_range)
+
+        return version + 1
+
+    def save_json(
+            self,
+            name: str,
+            obj: Any,
+            changed_range: tuple[datetime, datetime]|None=None,
+            base_version: int|None=None,
+            base_obj: dict[str, Any]|None=None) -> int :
+        """
+        Same as save_csv, nested dicts are merged leaf by leaf.
+        """
+
+        name = self._get_dataset_key(name)
+        path = self._get_dataset_path(name)
+
+        with self._lock, lock_dataset(path) as version_file :
+
+            version = read_version(version_file)
+
+            if ( not base_version is None ) and version != base_version :
+                if base_obj is None :
+                    raise SaveConflictError(name)
+
+                obj, conflicts = merge_nested(base_obj, obj, DATASET_LOADERS[path.name](path))
+                if conflicts :
+                    raise SaveConflictError(name, ["/".join(c) for c in conflicts])
+
+            with open(path, "w") as f :
+                json.dump(obj, f, indent=4)
+            write_version(version_file, version + 1)
+
+            self._forget(name, changed_range)
+
+        return version + 1
+
+
+_USER_STORES: dict[Path, UserStore] = {}
+_USER_STORES_LOCK = RLock()
+
+def get_user_store(user: str) -> UserStore :
+
+    user_path = get_user_path(user)
+
+    with _USER_STORES_LOCK :
+        if user_path not in _USER_STORES :
+            _USER_STORES[user_path] = UserStore(user_path)
+
+        return _USER_STORES[user_path]
+
+# endregion
+
+
+# region CATEGORIES
+
+@timed
+def update_category_name(
+        store: UserStore,
+        old_name: str,
+        new_name: str) -> list[str] :
+    """
+    Renames a category in every dataset of the user, closed years included, each saved through the store
+    from the version it was read at : the rows saved meanwhile by another session are merged, not overwritten.
+    Raises SaveConflictError if one of them renamed or recategorized the same rows. Returns the names of the saved datasets.
+    """
+
+    saved = []
+    for path in sorted([*store.user_path.rglob("*.csv"), *store.user_path.rglob("*.csv.gz"), *store.user_path.rglob("summary.json")]) :
+
+        name = path.relative_to(store.user_path).as_posix()
+        # Version files, archives being written and caches are not datasets
+        if any(part.startswith(".") for part in name.split("/")) or not path.name in DATASET_LOADERS :
+            continue
+
+        data = store.get(name)
+        version = store.get_version(name)
+
+        if path.name == "summary.json" :
+            categories = data.get("categories", {})
+            if not old_name in categories :
+                continue
+
+            # Merged with the totals of the new name if it already existed that year
+            renamed_categories = {}
+            for category, total in categories.items() :
+                category = new_name if category == old_name else category
+                renamed_categories[category] = round(renamed_categories.get(category, 0.) + total, 2)
+            store.save_json(name, {**data, "categories": renamed_categories}, base_version=version, base_obj=data)
+
+        else :
+            if not "category" in data.columns or not ( data["category"] == old_name ).any() :
+                continue
+
+            renamed = expand_frame(data)
+            renamed["category"] = renamed["category"].replace(old_name, new_name)
+            store.save_csv(name, renamed, base_version=version, base_df=data)
+
+        saved.append(name)
+
+    return saved
+
+# endregion
@@ -0,0 +1,180 @@
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from time import perf_counter
+from typing import (
+    Any,
+    Callable,
+    TypeVar,
+)
+import functools
+import json
+import threading
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+# region RUN
+
+class TimingRun :
+    """
+    Every span of one rerun. Spans of worker threads are recorded too, as long as they run in a copy of the context.
+    """
+
+    def __init__(self, label: str) :
+        self.label = label
+        self.started_at = datetime.now()
+        self.start = perf_counter()
+        self.duration: float|None = None
+        self.spans: list[dict[str, Any]] = []
+        self._depths = threading.local()
+
+    def _enter(self) -> int :
+        depth = getattr(self._depths, "value", 0)
+        self._depths.value = depth + 1
+        return depth
+
+    def _exit(
+            self,
+            name: str,
+            depth: int,
+            start: float) :
+
+        end = perf_counter()
+        self._depths.value = depth
+        self.spans.append({
+            "name": name,
+            "depth": depth,
+            "thread": threading.current_thread().name,
+            "start_ms": round(( start - self.start ) * 1000, 3),
+            "duration_ms": round(( end - start ) * 1000, 3),
+        })
+
+    def get_summary(self) -> dict[str, dict[str, float]] :
+        """
+        Number of calls and total time of every span name.
+        """
+
+        summary: dict[str, dict[str, float]] = {}
+        for s in self.spans :
+            entry = summary.setdefault(s["name"], {"calls": 0, "total_ms": 0.})
+            entry["calls"] += 1
+            entry["total_ms"] = round(entry["total_ms"] + s["duration_ms"], 3)
+
+        return summary
+
+
+# None when timing is off, which is checked first by every span
+_CURRENT_RUN: ContextVar[TimingRun|None] = ContextVar("cabank_timing_run", default=None)
+
+
+def start_run(
+        label: str,
+        enabled: bool=True) -> TimingRun|None :
+    """
+    Always called at the start of a rerun, so that a run left over by an interrupted rerun is dropped.
+    """
+
+    run = TimingRun(label) if enabled else None
+    _CURRENT_RUN.set(run)
+
+    return run
+
+
+def finish_run(
+        run: TimingRun|None,
+        log_path: Path|None=None) :
+    """
+    Appends the run to log_path as one JSON line : the stages (spans of depth 0 and 1) and the summary of every span.
+    """
+
+    _CURRENT_RUN.set(None)
+
+    if run is None :
+        return
+
+    run.duration = perf_counter() - run.start
+
+    if log_path is None :
+        return
+
+    line = {
+        "time": run.started_at.isoformat(timespec="seconds"),
+        "label": run.label,
+        "total_ms": round(run.duration * 1000, 3),
+        "stages": [s for s in run.spans if s["depth"] <= 1],
+        "summary": run.get_summary(),
+    }
+
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    with log_path.open("a", encoding="utf-8") as f :
+        f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+# endregion
+
+
+# region SPANS
+
+def begin_span(name: str) -> tuple[TimingRun, str, int, float]|None :
+    """
+    For spans that can't be a with block (module level regions). Pass the result to end_span.
+    """
+
+    if ( run := _CURRENT_RUN.get() ) is None :
+        return None
+
+    return run, name, run._enter(), perf_counter()
+
+
+def end_span(token: tuple[TimingRun, str, int, float]|None) :
+
+    if token is None :
+        return
+
+    run, name, depth, start = token
+    run._exit(name, depth, start)
+
+
+class span :
+    """
+    with span("kernel.offset") : ...
+    Does nothing but a context variable lookup when timing is off.
+    """
+
+    __slots__ = ("name", "token")
+
+    def __init__(self, name: str) :
+        self.name = name
+        self.token = None
+
+    def __enter__(self) :
+        self.token = begin_span(self.name)
+        return self
+
+    def __exit__(self, *exc_info) :
+        end_span(self.token)
+        return False
+
+
+def timed(func: F) -> F :
+    """
+    Times every call of func, named after its module and name (ex: "balance.get_offset").
+    """
+
+    name = f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs) :
+
+        if _CURRENT_RUN.get() is None :
+            return func(*args, **kwargs)
+
+        token = begin_span(name)
+        try :
+            return func(*args, **kwargs)
+        finally :
+            end_span(token)
+
+    return wrapper
+
+# endregion
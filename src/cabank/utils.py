@@ -2,13 +2,18 @@ import pandas as pd
 from typing import Any
 from datetime import datetime
 from pathlib import Path
-import plotly.graph_objects as go
 import json
 from decimal import Decimal, ROUND_HALF_UP
 import subprocess
 import os
 import sys
 import shutil
+import uuid
+import hashlib
+from cabank.timing import timed
+
+# Few distinct values, or ids repeated on every occurence of a periodic
+CATEGORICAL_COLUMNS = ["category", "description", "periodic_id", "currency"]
 
 
 def hex_to_rgba(hex_color: str, alpha: float) -> str:
@@ -30,10 +35,12 @@ def safe_get(
     return val
 
 
+@timed
 def format_datetime(serie: pd.Series) -> pd.Series :
     return pd.to_datetime(serie)
 
 
+@timed
 def safe_concat(
         df1: pd.DataFrame,
         df2: pd.DataFrame) -> pd.DataFrame :
@@ -44,20 +51,127 @@ def safe_concat(
     if len(df2) == 0 :
         return df1
     
+    df1, df2 = unify_categoricals(df1, df2)
+
     return pd.concat([df1, df2]).reset_index(drop=True)
 
 
+@timed
+def share_lists(serie: pd.Series) -> pd.Series :
+    """
+    Equal lists (tags) become the same list object : most rows have no tag, or the same few ones.
+    Shared lists must never be modified in place.
+    """
+
+    shared: dict[tuple, list] = {}
+
+    return serie.map(lambda l: shared.setdefault(tuple(l), l) if isinstance(l, list) else l)
+
+
+@timed
+def compact_frame(df: pd.DataFrame) -> pd.DataFrame :
+    """
+    Memory-lean copy of a ledger frame : categoricals for the CATEGORICAL_COLUMNS and shared tag lists.
+    Only the storage changes, not the values.
+    """
+
+    df = df.copy()
+
+    for col in CATEGORICAL_COLUMNS :
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype) :
+            df[col] = df[col].astype("category")
+
+    if "tags" in df.columns :
+        df["tags"] = share_lists(df["tags"])
+
+    return df
+
+
+@timed
+def expand_frame(df: pd.DataFrame) -> pd.DataFrame :
+    """
+    Plain columns and one list per row, for the data editors which write any value in any cell.
+    """
+
+    df = df.copy()
+
+    for col in df.columns :
+        if isinstance(df[col].dtype, pd.CategoricalDtype) :
+            df[col] = df[col].astype(df[col].cat.categories.dtype)
+
+    if "tags" in df.columns :
+        df["tags"] = df["tags"].map(lambda l: list(l) if isinstance(l, list) else l)
+
+    return df
+
+
+@timed
+def unify_categoricals(
+        df1: pd.DataFrame,
+        df2: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame] :
+    """
+    pd.concat falls back to object columns when categories differ : common columns that are categorical
+    on either side get the union of the categories on both sides.
+    """
+
+    for col in df1.columns.intersection(df2.columns) :
+
+        dtypes = [df1[col].dtype, df2[col].dtype]
+        if not any(isinstance(d, pd.CategoricalDtype) for d in dtypes) or dtypes[0] == dtypes[1] :
+            continue
+
+        categories = [
+            df[col].cat.categories if isinstance(df[col].dtype, pd.CategoricalDtype) else pd.Index(df[col].dropna().unique())
+            for df in [df1, df2]
+        ]
+        dtype = pd.CategoricalDtype(categories[0].union(categories[1]))
+
+        df1 = df1.assign(**{col: df1[col].astype(dtype)})
+        df2 = df2.assign(**{col: df2[col].astype(dtype)})
+
+    return df1, df2
+
+
+@timed
+def get_fingerprint(*items: Any) -> str :
+    """
+    Cheap content hash of frames, series and json-like objects.
+    """
+
+    hasher = hashlib.blake2b(digest_size=16)
+
+    for item in items :
+
+        if isinstance(item, (pd.DataFrame, pd.Series)) :
+            frame = item.to_frame() if isinstance(item, pd.Series) else item
+            hasher.update(repr(list(frame.columns)).encode())
+
+            if len(frame) > 0 :
+                # Lists (tags) are not hashable by pandas
+                hashable = frame.apply(lambda col: col.astype(str) if col.dtype == object else col)
+                hasher.update(pd.util.hash_pandas_object(hashable, index=True).values.tobytes())
+
+        else :
+            hasher.update(json.dumps(item, sort_keys=True, default=str).encode())
+
+        hasher.update(b"|")
+
+    return hasher.hexdigest()
+
+
+@timed
 def serialize_list_columns(
         df: pd.DataFrame
 ) -> pd.DataFrame :
     
     df = df.copy()
     for col in df.columns:
-        if df[col].apply(lambda x: isinstance(x, list)).any():
+        if df[col].dtype == object and df[col].apply(lambda x: isinstance(x, list)).any():
             df[col] = df[col].apply(json.dumps)
     return df
 
 
+@timed
 def combine_and_save_csv(
         modified_df: pd.DataFrame,
         path: Path,
@@ -76,6 +190,190 @@ def combine_and_save_csv(
     reunited_df.to_csv(path, index=False)
 
 
+_MISSING = object()
+
+
+def merge_changes(
+        base: dict[Any, Any],
+        mine: dict[Any, Any],
+        theirs: dict[Any, Any]) -> tuple[dict[Any, Any], list[Any]] :
+    """
+    Three-way merge of keyed values : the changes of mine since base (added, modified or removed keys) are applied on theirs.
+    A key changed differently on both sides is a conflict, theirs is kept for it. Keys keep the order of theirs, added ones last.
+    """
+
+    merged = dict(theirs)
+    conflicts = []
+
+    for key in [*base, *( k for k in mine if not k in base )] :
+
+        b, m, t = base.get(key, _MISSING), mine.get(key, _MISSING), theirs.get(key, _MISSING)
+
+        # Unchanged on my side, or the same change on both
+        if m == b or m == t :
+            continue
+
+        if t != b :
+            conflicts.append(key)
+        elif m is _MISSING :
+            merged.pop(key, None)
+        else :
+            merged[key] = m
+
+    return merged, conflicts
+
+
+def _get_row_values(
+        df: pd.DataFrame,
+        columns: list[str]) -> list[tuple] :
+    """
+    Comparable rows : lists (tags) become tuples, missing values and empty strings become None.
+    """
+
+    normalize = lambda x: tuple(x) if isinstance(x, list) else ( None if ( not isinstance(x, tuple) and pd.isna(x) ) or x == "" else x )
+
+    return [tuple(normalize(x) for x in row) for row in df.reindex(columns=columns).astype(object).itertuples(index=False, name=None)]
+
+
+@timed
+def merge_frames(
+        base: pd.DataFrame,
+        mine: pd.DataFrame,
+        theirs: pd.DataFrame,
+        key: str="id") -> tuple[pd.DataFrame, list[Any]] :
+    """
+    merge_changes on the rows of ledgers, keyed by id. Returns the merged rows and the conflicting keys.
+    """
+
+    columns = list(theirs.columns)
+    rows = lambda df: dict(zip(df[key].astype(object), _get_row_values(df, columns)))
+
+    theirs_rows = rows(theirs)
+    merged_rows, conflicts = merge_changes(rows(base), rows(mine), theirs_rows)
+
+    # Rows changed on my side are taken from mine, the others from theirs
+    from_mine = [k for k, values in merged_rows.items() if not values is theirs_rows.get(k)]
+    from_mine_set = set(from_mine)
+    position = {k: i for i, k in enumerate(merged_rows)}
+
+    merged = safe_concat(
+        theirs[theirs[key].astype(object).isin([k for k in merged_rows if not k in from_mine_set])],
+        mine[mine[key].astype(object).isin(from_mine)].reindex(columns=columns),
+    )
+    merged = merged.iloc[merged[key].astype(object).map(position).to_numpy().argsort(kind="stable")]
+
+    return merged.reset_index(drop=True), conflicts
+
+
+def get_changed_dates(
+        before: pd.DataFrame,
+        after: pd.DataFrame,
+        key: str="id") -> list[datetime] :
+    """
+    Dates of the rows of a ledger added, removed or modified between two versions, matched by key.
+    A row moved to another day gives both its old and its new date.
+    """
+
+    columns = list(after.columns)
+    rows = lambda df: dict(zip(df[key].astype(object), zip(_get_row_values(df, columns), df["date"])))
+
+    before_rows, after_rows = rows(before), rows(after)
+
+    dates = set()
+    for k in before_rows.keys() | after_rows.keys() :
+
+        old, new = before_rows.get(k), after_rows.get(k)
+        if ( not old is None ) and ( not new is None ) and old[0] == new[0] :
+            continue
+
+        dates.update(row[1] for row in [old, new] if ( not row is None ) and not pd.isna(row[1]))
+
+    return sorted(dates)
+
+
+def _flatten(
+        obj: Any,
+        path: tuple=()) -> dict[tuple, Any] :
+
+    if not isinstance(obj, dict) or len(obj) == 0 :
+        return {path: obj} if path else {}
+
+    return {p: v for k, child in obj.items() for p, v in _flatten(child, (*path, k)).items()}
+
+
+def merge_nested(
+        base: dict[str, Any],
+        mine: dict[str, Any],
+        theirs: dict[str, Any]) -> tuple[dict[str, Any], list[tuple]] :
+    """
+    merge_changes on the leaves of nested dicts (ex: periodic occurences modifications, by periodic and date).
+    """
+
+    merged_leaves, conflicts = merge_changes(_flatten(base), _flatten(mine), _flatten(theirs))
+
+    merged: dict[str, Any] = {}
+    for path, value in merged_leaves.items() :
+        node = merged
+        for k in path[:-1] :
+            node = node.setdefault(k, {})
+        node[path[-1]] = value
+
+    return merged, conflicts
+
+
+@timed
+def fill_missing_ids(
+        df: pd.DataFrame,
+        id_column: str="id") -> pd.DataFrame :
+
+    df = df.copy()
+    missing_ids = df[id_column].isna()
+
+    if missing_ids.any() :
+        df.loc[missing_ids, id_column] = [str(uuid.uuid4()) for _ in range(missing_ids.sum())]
+
+    return df
+
+
+@timed
+def get_ponctuals_filter_mask(
+        ponctuals: pd.DataFrame,
+        date_min: datetime|None=None,
+        date_max: datetime|None=None,
+        categories: list[str]|None=None,
+        search: str|None=None,
+        amount_min: float|None=None,
+        amount_max: float|None=None) -> pd.Series :
+    """
+    Boundaries are included. Search is case insensitive, on description and tags.
+    """
+
+    mask = pd.Series(True, index=ponctuals.index)
+
+    if not date_min is None :
+        mask &= ponctuals["date"] >= pd.Timestamp(date_min)
+
+    if not date_max is None :
+        mask &= ponctuals["date"] <= pd.Timestamp(date_max)
+
+    if categories :
+        mask &= ponctuals["category"].isin(categories)
+
+    if not amount_min is None :
+        mask &= ponctuals["amount"] >= amount_min
+
+    if not amount_max is None :
+        mask &= ponctuals["amount"] <= amount_max
+
+    if search :
+        search = search.lower()
+        in_description = ponctuals["description"].str.lower().str.contains(search, regex=False, na=False)
+        in_tags = ponctuals["tags"].map(lambda tags: any(search in t.lower() for t in tags) if isinstance(tags, list) else False)
+        mask &= in_description | in_tags.astype(bool)
+
+    return mask
+
+
 def get_periodic_occurence_modifications(
         date: str,
         amount: float,
@@ -109,6 +407,7 @@ def is_periodic_occurence_ignored(
     return is_ignored
 
 
+@timed
 def apply_modifs_to_period(
         period: pd.DataFrame,
         modify_periodic_occurences: dict[str, dict[str, float|None]]) -> pd.DataFrame :
@@ -118,7 +417,7 @@ def apply_modifs_to_period(
             modify_periodic_occurences: dict[str, dict[str, float|None]]=modify_periodic_occurences) -> tuple[float, bool] :
         
         amount  = row["amount"]
-        if ( periodic_id := row["periodic_id"] ) is None :
+        if pd.isna(periodic_id := row["periodic_id"]) :
             return amount, False
         
         date = row["date"].strftime("%Y-%m-%d")
@@ -134,151 +433,60 @@ def apply_modifs_to_period(
     return modified_period
 
 
-def update_category_name(
-        old_name: str,
-        new_name: str,
-        user_folder: Path) :
-    
-    for data_file in user_folder.rglob("*.csv") :
-        df = pd.read_csv(data_file)
-        if "category" in df.columns :
-            df.loc[:, "category"] = df["category"].replace(old_name, new_name)
-            df.to_csv(data_file, index=False)
-
-
-def plot_custom_waterfall(
-        fig: go.Figure,
-        categories: list[str],
-        amounts: list[float],
-        colors: list[str],
-        amounts_budget: list[float]|None=None) :
-    
-    # Style parameters
-    if amounts_budget is None :
-        bar_width = 0.8
-        offset = 0
-    else :
-        bar_width = 0.35
-        offset = bar_width/2 +0.05
-
-    # Cumulative heights
-    y_base = []
-    current = 0
-    for amt in amounts[:-1]:
-        y_base.append(current)
-        current += amt
-    
-    # Last bar is a total => base at 0
-    y_base.append(0)
-
-    # First bar is shared
-    fig.add_trace(go.Bar(
-        x=[0],
-        y=[amounts[0]],
-        base=[0],
-        width=0.8,
-        marker=dict(color=colors[0]),
-        name=categories[0],
-        hovertemplate=f"{categories[0]}: {amounts[0]:,.0f}<extra></extra>"
-    ))
-    fig.add_shape(
-        type="line",
-        x0= 0.4,
-        x1= offset + bar_width/2 + (1-bar_width),
-        y0=y_base[0] + amounts[0],
-        y1=y_base[1],
-        line=dict(color="black", width=1)
-    )
+def has_rates(rates: pd.DataFrame|None) -> bool :
+    return ( not rates is None ) and len(rates) > 0
 
-    # Draw the rest of the bars
-    for i in range(1, len(categories)):
-        fig.add_trace(go.Bar(
-            x=[i - offset],
-            y=[amounts[i]],
-            base=[y_base[i]],
-            width=bar_width,
-            marker=dict(color=colors[i]),
-            name=categories[i],
-            hovertemplate=f"{categories[i]}: {amounts[i]:,.0f}<extra></extra>"
-        ))
-
-    # Draw connectors
-    for i in range(1, len(categories) - 2):
-        fig.add_shape(
-            type="line",
-            x0=i - offset + bar_width/2,
-            x1=i - offset + bar_width/2 + (1-bar_width),
-            y0=y_base[i] + amounts[i],
-            y1=y_base[i + 1],
-            line=dict(color="black", width=1)
-        )
-
-    # Draw last connector
-    fig.add_shape(
-        type="line",
-        x0=len(categories)-2 - offset + bar_width/2,
-        x1=len(categories)-2 - offset + bar_width/2 + (1-bar_width),
-        y0=y_base[-2] + amounts[-2],
-        y1=amounts[-1],
-        line=dict(color="black", width=1)
-    )
 
-    if amounts_budget is None :
-        return
-    
-    # Cumulative heights
-    y_base_budget = []
-    current_budget = 0
-    for amt_b in amounts_budget[:-1]:
-        y_base_budget.append(current_budget)
-        current_budget += amt_b
-    
-    # Last bar is a total => base at 0
-    y_base_budget.append(0)
-
-    # Draw every bar (except the first one which is shared)
-    for i in range(1, len(categories)):
-        fig.add_trace(go.Bar(
-            x=[i + offset],
-            y=[amounts_budget[i]],
-            width=bar_width,
-            base=[y_base_budget[i]],
-            marker=dict(color=colors[i]),
-            name=categories[i],
-            hovertemplate=f"{categories[i]}: {amounts_budget[i]:,.0f}<extra></extra>",
-            opacity=0.3
-        ))
-
-    # Draw first connector
-    fig.add_shape(
-        type="line",
-        x0= 0.4,
-        x1= offset + bar_width/2 + (1-bar_width),
-        y0=y_base_budget[0] + amounts_budget[0],
-        y1=y_base_budget[1],
-        line=dict(color="gray", width=1, dash="dot")
-    )
+@timed
+def add_occurences_currency(
+        occurences: pd.DataFrame,
+        periodics: pd.DataFrame) -> pd.DataFrame :
+    """
+    Currency of the periodic of every occurence, mapped on periodic_id.
+    """
 
-    # Draw other connectors
-    for i in range(1, len(categories) - 2):
-        fig.add_shape(
-            type="line",
-            x0= i + offset + bar_width/2,
-            x1= i + offset + bar_width/2 + (1-bar_width),
-            y0=y_base_budget[i] + amounts_budget[i],
-            y1=y_base_budget[i + 1],
-            line=dict(color="gray", width=1, dash="dot")
-        )
-
-    # Draw last connector
-    fig.add_shape(
-        type="line",
-        x0=len(categories)-2 + offset + bar_width/2,
-        x1=len(categories)-2 + offset + bar_width/2 + (1-bar_width),
-        y0=y_base_budget[-2] + amounts_budget[-2],
-        y1=amounts_budget[-1],
-        line=dict(color="gray", width=1, dash="dot")
-    )
+    if len(occurences) == 0 or not "currency" in periodics.columns :
+        return occurences
+
+    currencies = dict(zip(periodics["id"], periodics["currency"]))
+
+    return occurences.assign(currency=occurences["periodic_id"].astype(object).map(currencies).astype("category"))
+
+
+@timed
+def convert_amounts(
+        period: pd.DataFrame,
+        rates: pd.DataFrame) -> pd.DataFrame :
+    """
+    Amounts of the rows in another currency, times the rate of their currency on their date.
+    rates has a date, currency and rate (value of one unit in the display currency) per row, a rate holds until the next one.
+    One as-of join for every row : no per-row lookup. Before the first rate of a currency, its first rate is used.
+    Rows without a currency, or in a currency without rates (the display currency), keep their amount.
+    """
+
+    if len(period) == 0 or not "currency" in period.columns :
+        return period
+
+    currency = period["currency"].astype(object)
+    is_foreign = currency.isin(set(rates["currency"]))
+    if not is_foreign.any() :
+        return period
+
+    foreign = pd.DataFrame({
+        "row": period.index[is_foreign],
+        "date": pd.to_datetime(period.loc[is_foreign, "date"]).astype("datetime64[ns]"),
+        "currency": currency[is_foreign].astype(str),
+    }).sort_values("date", kind="stable")
+
+    sorted_rates = rates.astype({"date": "datetime64[ns]", "currency": str}).sort_values("date", kind="stable")
+
+    joined = pd.merge_asof(foreign, sorted_rates, on="date", by="currency", direction="backward")
+    joined["rate"] = joined["rate"].fillna(joined["currency"].map(sorted_rates.groupby("currency")["rate"].first()))
+
+    converted = period.copy()
+    converted.loc[joined["row"].to_numpy(), "amount"] = converted.loc[joined["row"].to_numpy(), "amount"].to_numpy() * joined["rate"].to_numpy()
+
+    return converted
 
 
 def split_amount(
@@ -302,6 +510,7 @@ def split_amount(
     return [p / 100 for p in parts]
 
 
+@timed
 def open_file_edition(path: Path) :
 
     assert path.exists(), "Checkpoint csv non existent"